@@ -0,0 +1,102 @@
+"""Check and benchmark the csr top_products against q2.sql run by DuckDB.
+
+Builds synthetic friends, products, product_cards and events tables with the
+columns of the PSQL outputs: friendships stored once (friend1 < friend2),
+brands as a category column whose category order is not alphabetical, null
+brands, and products sharing a product_id or category_id, so that most top
+10s end in ties broken by (product_id, category_id, brand). The index is
+built by friend_graph.py as clean_data.py does, and q2.sql runs over the
+same tables written as Parquet (columnar.py). Every user must get the same
+rows in the same order from both; a difference is an error.
+
+    uv run python scripts/analysis/bench_friend_index.py --users 5000
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+
+from columnar import ColumnarEngine
+from friend_index import FriendGraphIndex
+
+# friend_graph.py (and the modules it imports) live in scripts/loading.
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'loading'))
+from friend_graph import build_friend_graph  # noqa: E402
+
+QUERY = Path(__file__).parent / 'q2.sql'
+
+
+# ------------------------------------------------------------------------------
+# SYNTHETIC DATA
+# ------------------------------------------------------------------------------
+def make_tables(rng, users):
+    friends = pd.DataFrame(np.sort(rng.integers(0, users, (users * 4, 2)), axis=1), columns=['friend1', 'friend2'])
+    friends = friends[friends['friend1'] != friends['friend2']].drop_duplicates().reset_index(drop=True)
+    products = pd.DataFrame({'product_id': rng.integers(0, max(users // 40, 2), users // 10 + 2),
+                             'category_id': rng.integers(0, 3, users // 10 + 2)}).drop_duplicates()
+    products.insert(0, 'product_pk', np.arange(len(products)))
+    # Categories in first-appearance order, as an Arrow dictionary column is read; None is a null brand.
+    brands = ['zeta', 'acme', 'mid', None]
+    cards = pd.DataFrame({'product_pk': np.repeat(products['product_pk'].to_numpy(), 3)})
+    cards['brand'] = pd.Categorical(rng.choice(brands, len(cards)), categories=brands[:-1])
+    cards = cards.drop_duplicates().reset_index(drop=True)
+    cards.insert(0, 'product_card_pk', np.arange(len(cards)))
+    events = pd.DataFrame({'user_id': rng.integers(0, users, users * 3),
+                           'product_card_pk': rng.integers(0, len(cards), users * 3),
+                           'event_type': rng.choice(['purchase', 'view', 'cart'], users * 3, p=[0.6, 0.3, 0.1])})
+    return {'friends': friends, 'products': products, 'product_cards': cards, 'events': events}
+
+
+def build_index(tables, path):
+    """The friend_graph stage of clean_data.py over `tables`"""
+    purchases = tables['events'][tables['events']['event_type'] == 'purchase']\
+        .groupby(['user_id', 'product_card_pk']).size().rename('purchases').reset_index()
+    product_cards = tables['product_cards'].merge(tables['products'], on='product_pk')
+    build_friend_graph(tables['friends'], purchases, product_cards, path)
+
+
+# ------------------------------------------------------------------------------
+# BENCHMARK
+# ------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    tables = make_tables(np.random.default_rng(args.seed), args.users)
+    user_ids = np.unique(tables['friends'].to_numpy()).tolist()
+    query = QUERY.read_text(encoding='utf-8')
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        for name, table in tables.items():
+            table.to_parquet(directory / f'{name}.parquet', index=False)
+        build_index(tables, directory / 'friend_graph')
+        index, engine = FriendGraphIndex(directory / 'friend_graph'), ColumnarEngine(directory)
+        try:
+            start = time.perf_counter()
+            expected = [engine.execute(query, {'user_id': user_id}) for user_id in user_ids]
+            sql_time = time.perf_counter() - start
+            start = time.perf_counter()
+            actual = index.top_products_batch(user_ids)
+            csr_time = time.perf_counter() - start
+        finally:
+            engine.close()
+
+    different = [user_id for user_id, rows, csr_rows in zip(user_ids, expected, actual) if rows != csr_rows]
+    null_brands = sum(row[2] is None for rows in expected for row in rows)
+    print(tabulate([[len(user_ids), null_brands, f"{sql_time:.3f}s", f"{csr_time:.3f}s",
+                     f"{sql_time / csr_time:.1f}x", len(different)]],
+                   headers=["Users", "Null brand rows", "q2.sql (DuckDB)", "csr top_products_batch",
+                            "Speedup", "Different users"], tablefmt="pretty"))
+    if different:
+        raise SystemExit(f"csr top_products differs from q2.sql for users {different[:10]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+"""Query benchmarking: warmup, timed iterations, latency percentiles, saved runs and regression checks.
+
+Every query is executed `warmup` times, then `iterations` times, timed with
+time.perf_counter. The first warmup execution is kept as the cold run (first
+execution in this process; the database caches are not flushed). The others
+only warm the caches. Failed executions are counted and logged, never timed.
+In streaming mode (`stream`), the rows are consumed as they arrive, in
+batches of `batch_size`, and counted but never kept; the time to the first
+row is then reported too (first_row_p50/p95), while the other statistics
+are the time to the last row.
+A parameterized query gets a new parameter set at each execution, and its
+latencies are also reported per parameter bucket (see workloads.py). The
+report also shows whether the query returned the same result on the other
+backends (see equivalence.py), so a fast but wrong query stands out.
+
+A run (its results, plan metrics, settings and system specs) is saved as JSON
+or CSV, with the raw plans next to it (see plans.py), and two saved runs can be
+compared; the comparison also shows whether the plan of a query changed and
+how its I/O did, to tell a plan flip from an I/O change:
+
+    uv run python scripts/analysis/data_analysis.py compare baseline.json output/benchmarks/<run>.json
+"""
+import csv
+import json
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field, asdict
+from functools import partial
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from tabulate import tabulate
+
+from plans import PLAN_METRICS
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_PATH = Path('output/benchmarks')
+PERCENTILES = [50, 95, 99]
+PLAN_COLUMNS = ['plan_id', *PLAN_METRICS, 'full_scans']
+STAT_COLUMNS = ['runs', 'failures', 'cold', 'mean', 'stdev', 'min', 'p50', 'p95', 'p99', 'max',
+                'first_row_p50', 'first_row_p95']
+FIRST_ROW_PERCENTILES = [50, 95]
+
+
+@dataclass
+class BenchmarkConfig:
+    warmup: int = 1
+    iterations: int = 10
+    pause: float = 0.0      # seconds between two executions
+    stream: bool = False    # consume the rows as they arrive instead of buffering the whole result
+    batch_size: int = 2000  # rows per round trip in streaming mode
+    explain: bool = True    # capture the plan of every query on one extra, profiled run (see plans.py)
+
+
+@dataclass
+class StreamTiming:
+    """A streamed execution: its row count and the seconds to its first and last row."""
+    rows: int
+    first_row: float        # the time to the last row if there were no rows
+    last_row: float
+
+
+@dataclass
+class BenchmarkResult:
+    """Latencies of one query on one database, in seconds."""
+    database: str
+    query: str
+    times: List[float] = field(default_factory=list)
+    cold: Optional[float] = None
+    failures: int = 0
+    errors: List[str] = field(default_factory=list)
+    buckets: List[str] = field(default_factory=list)    # parameter bucket of every timed run, if any
+    equivalent: Optional[bool] = None   # result matches the other backends' (equivalence.py); None if unchecked
+    first_rows: List[float] = field(default_factory=list)   # time to the first row of every timed run, if streamed
+    plan: Optional[Dict[str, Any]] = None   # plan id, PLAN_METRICS and full scans of the profiled run
+
+    def stats(self, bucket: Optional[str] = None) -> Dict[str, Any]:
+        times = np.asarray(self.times if bucket is None else
+                           [t for t, b in zip(self.times, self.buckets) if b == bucket])
+        first_rows = np.asarray(self.first_rows if bucket is None else
+                                [t for t, b in zip(self.first_rows, self.buckets) if b == bucket])
+        stats = {'runs': len(times), 'failures': self.failures if bucket is None else None,
+                 'cold': self.cold if bucket is None else None}
+        if not len(times):
+            return {**stats, **dict.fromkeys(STAT_COLUMNS[3:])}
+        stats.update(mean=times.mean(), stdev=times.std(ddof=1) if len(times) > 1 else 0.0, min=times.min())
+        stats.update({f'p{p}': value for p, value in zip(PERCENTILES, np.percentile(times, PERCENTILES))})
+        stats['max'] = times.max()
+        stats.update({f'first_row_p{p}': np.percentile(first_rows, p) if len(first_rows) else None
+                      for p in FIRST_ROW_PERCENTILES})
+        return {key: float(value) if isinstance(value, np.floating) else value for key, value in stats.items()}
+
+    def bucket_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {bucket: self.stats(bucket) for bucket in sorted(set(self.buckets) - {''})}
+
+
+def _timed(execute: Callable[[], Any]) -> Tuple[float, Any]:
+    start = time.perf_counter()
+    returned = execute()
+    return time.perf_counter() - start, returned
+
+
+def run_benchmark(database: str, query: str, execute: Callable[..., Any],
+                  config: BenchmarkConfig = BenchmarkConfig(),
+                  samples: Optional[List[Tuple[Dict[str, Any], str]]] = None) -> BenchmarkResult:
+    """Warm up, then time `config.iterations` executions of `execute`; failed ones are only counted.
+
+    With `samples` ((parameters, bucket) per execution, warmup included), each
+    execution is `execute(parameters)`. An execution returning a StreamTiming
+    also records its time to the first row."""
+    result = BenchmarkResult(database, query)
+    for i in range(config.warmup + config.iterations):
+        measured = i >= config.warmup
+        label = f"run {i + 1 - config.warmup}" if measured else f"warmup {i + 1}"
+        params, bucket = samples[i] if samples else (None, '')
+        try:
+            elapsed, returned = _timed(execute if samples is None else partial(execute, params))
+        except Exception as e:
+            result.failures += measured
+            result.errors.append(f"{type(e).__name__}: {e}")
+            logger.error("%s %s %s failed: %s", database, query, label, e)
+        else:
+            if i == 0:
+                result.cold = elapsed
+            if measured:
+                result.times.append(elapsed)
+                result.buckets.append(bucket)
+                if isinstance(returned, StreamTiming):
+                    result.first_rows.append(returned.first_row)
+            logger.info("%s %s %s: %.4fs%s", database, query, label, elapsed, f" {params}" if params else '')
+        if config.pause:
+            time.sleep(config.pause)
+    return result
+
+
+def _rows(result: BenchmarkResult) -> List[Tuple[str, Dict[str, Any]]]:
+    """(query label, stats) of a result and of each of its parameter buckets."""
+    return [(result.query, result.stats())] + \
+        [(f"{result.query} [{bucket}]", stats) for bucket, stats in result.bucket_stats().items()]
+
+
+def report(results: List[BenchmarkResult]) -> str:
+    rows = []
+    for result in results:
+        for query, stats in _rows(result):
+            check = {None: '-', True: 'ok', False: 'MISMATCH'}[result.equivalent] if query == result.query else ''
+            rows.append([result.database, query, stats['runs'], '-' if stats['failures'] is None else stats['failures'],
+                         *(f"{stats[key]:.4f}s" if stats[key] is not None else '-' for key in STAT_COLUMNS[2:]),
+                         check])
+    return tabulate(rows, headers=['Database', 'Query', *STAT_COLUMNS, 'result'], tablefmt='pretty')
+
+
+# ------------------------------------------------------------------------------
+# SAVED RUNS
+# ------------------------------------------------------------------------------
+def save_results(results: List[BenchmarkResult], path: Path, system: Dict[str, str],
+                 config: BenchmarkConfig) -> Path:
+    """Save a run as JSON (all latencies) or, for a .csv path, one summary row per result."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    meta = {'run_id': uuid.uuid4().hex[:12], 'created': datetime.now(timezone.utc).isoformat(timespec='seconds')}
+    if path.suffix == '.csv':
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, ['run_id', 'created', 'database', 'query', *STAT_COLUMNS, 'equivalent',
+                                           *PLAN_COLUMNS, *asdict(config), *system])
+            writer.writeheader()
+            for result in results:
+                plan = dict(result.plan or {}, full_scans='; '.join((result.plan or {}).get('full_scans', [])))
+                for query, stats in _rows(result):
+                    writer.writerow({**meta, 'database': result.database, 'query': query, **stats,
+                                     'equivalent': result.equivalent, **(plan if query == result.query else {}),
+                                     **asdict(config), **system})
+    else:
+        path.write_text(json.dumps({**meta, 'system': system, 'config': asdict(config),
+                                    'results': [{**asdict(result), 'stats': result.stats(),
+                                                 'bucket_stats': result.bucket_stats()}
+                                                for result in results]}, indent=2), encoding='utf-8')
+    logger.info("Benchmark results saved to %s", path)
+    return path
+
+
+def load_results(path: Path) -> Dict[tuple, Dict[str, Any]]:
+    """(database, query) -> stats and plan metrics of a run saved by save_results; buckets are queries
+    'q2 [low]', ..."""
+    path = Path(path)
+    if path.suffix == '.csv':
+        with open(path, newline='', encoding='utf-8') as file:
+            return {(row['database'], row['query']): {**{key: float(row[key]) if row.get(key) else None
+                                                         for key in STAT_COLUMNS + PLAN_METRICS},
+                                                      'plan_id': row.get('plan_id') or None}
+                    for row in csv.DictReader(file)}
+    run = json.loads(path.read_text(encoding='utf-8'))
+    stats = {}
+    for result in run['results']:
+        stats[result['database'], result['query']] = {**result['stats'], **(result.get('plan') or {})}
+        for bucket, bucket_stats in result.get('bucket_stats', {}).items():
+            stats[result['database'], f"{result['query']} [{bucket}]"] = bucket_stats
+    return stats
+
+
+def _plan_change(before: Dict[str, Any], after: Dict[str, Any]) -> Tuple[str, str]:
+    """Whether the plan of a query changed between two runs, and the change of its reads
+    (buffer reads, or documents examined on Mongo)"""
+    if not before.get('plan_id') or not after.get('plan_id'):
+        return '-', '-'
+    plan = 'same' if before['plan_id'] == after['plan_id'] else 'CHANGED'
+    for metric in ('buffer_reads', 'docs_examined'):
+        if before.get(metric) is not None and after.get(metric) is not None:
+            return plan, f"{metric} {before[metric]:,.0f} -> {after[metric]:,.0f}"
+    return plan, '-'
+
+
+def compare_results(baseline_path: Path, current_path: Path, metric: str = 'p50',
+                    threshold: float = 0.10) -> bool:
+    """Log `metric` of both runs per query; returns True if a query is more than `threshold` slower
+    or failed more often."""
+    baseline, current = load_results(baseline_path), load_results(current_path)
+    rows, regressed = [], False
+    for key in sorted(baseline.keys() | current.keys()):
+        plan, io = _plan_change(baseline.get(key, {}), current.get(key, {}))
+        before = baseline.get(key, {}).get(metric)
+        after = current.get(key, {}).get(metric)
+        failures = current.get(key, {}).get('failures') or 0
+        if failures > (baseline.get(key, {}).get('failures') or 0):
+            status, change = 'MORE FAILURES', '-'
+            regressed = True
+        elif before is None or after is None:
+            status, change = 'missing' if key not in current or key not in baseline else 'no runs', '-'
+        else:
+            ratio = after / before - 1 if before else 0.0
+            status = 'REGRESSION' if ratio > threshold else 'faster' if ratio < -threshold else 'ok'
+            change = f"{ratio:+.1%}"
+            regressed |= status == 'REGRESSION'
+        rows.append([*key, '-' if before is None else f"{before:.4f}s", '-' if after is None else f"{after:.4f}s",
+                     change, status, plan, io])
+    logger.info(f"\n{metric} latency, {baseline_path} -> {current_path} (threshold {threshold:.0%}):\n" +
+                tabulate(rows, headers=['Database', 'Query', 'Baseline', 'Current', 'Change', 'Status', 'Plan', 'I/O'],
+                         tablefmt='pretty'))
+    return regressed
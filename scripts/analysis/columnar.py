@@ -0,0 +1,71 @@
+"""Embedded columnar backend: the PSQL catalog queries, run in process by DuckDB over Parquet copies of the tables.
+
+`clean_data.py --parquet` (scripts/loading/psql_parquet.py) writes every PSQL
+table to PARQUET_PATH/<table>.parquet. The engine exposes each file as a view
+e_commerce.<table> of an in-memory DuckDB database, so the q{N}.sql files run
+unchanged: their %(name)s parameters become DuckDB $name parameters. A query
+DuckDB cannot run as written (q3.sql uses the PostgreSQL full-text search) has
+a q{N}.duckdb file next to it, which workloads.py reads instead.
+
+No server is involved: the Parquet files are scanned in place, with the
+`threads` worker threads of DuckDB per query (all cores by default). Every
+caller thread gets its own cursor, so the load mode can run queries
+concurrently. The parameter populations of workloads.py are PSQL queries too,
+and are drawn from this backend when PostgreSQL is not benchmarked.
+"""
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import duckdb
+
+logger = logging.getLogger(__name__)
+
+# Written by scripts/loading/psql_parquet.py.
+PARQUET_PATH = Path('output/parquet')
+SCHEMA = 'e_commerce'
+PARAM_PATTERN = re.compile(r'%\((\w+)\)s')
+
+
+def translate(query: str) -> str:
+    """A PSQL catalog query in the DuckDB dialect: %(name)s parameters as $name"""
+    return PARAM_PATTERN.sub(r'$\1', query)
+
+
+class ColumnarEngine:
+    """An in-memory DuckDB database whose e_commerce schema is views over the Parquet tables."""
+
+    def __init__(self, path: Path = PARQUET_PATH, threads: Optional[int] = None):
+        self.path = Path(path)
+        tables = sorted(self.path.glob('*.parquet'))
+        if not tables:
+            raise FileNotFoundError(f"No Parquet tables in {self.path}; run clean_data.py --parquet first")
+        self.threads = threads or os.cpu_count()
+        self.connection = duckdb.connect(':memory:', config={'threads': self.threads})
+        self.connection.execute(f"CREATE SCHEMA {SCHEMA}")
+        for table in tables:
+            self.connection.execute(f"CREATE VIEW {SCHEMA}.{table.stem} AS "
+                                    f"SELECT * FROM read_parquet('{table.as_posix()}')")
+        self._local = threading.local()
+        logger.info("DuckDB %s: %s Parquet tables of %s, %s threads",
+                    duckdb.__version__, len(tables), self.path, self.threads)
+
+    def cursor(self) -> duckdb.DuckDBPyConnection:
+        """The cursor of the calling thread (a DuckDB connection is not shared between threads)"""
+        if getattr(self._local, 'cursor', None) is None:
+            self._local.cursor = self.connection.cursor()
+        return self._local.cursor
+
+    def execute(self, query: str, params: Optional[Dict] = None) -> List[tuple]:
+        return self.cursor().execute(translate(query), params or None).fetchall()
+
+    def stream(self, query: str, params: Optional[Dict] = None, batch_size: int = 2000) -> Iterator[tuple]:
+        cursor = self.cursor().execute(translate(query), params or None)
+        while rows := cursor.fetchmany(batch_size):
+            yield from rows
+
+    def close(self):
+        self.connection.close()
@@ -1,13 +1,20 @@
 import platform, psutil
+import argparse
 import logging
+import re
+import sys
+import threading
 import time
-import statistics
-from typing import Dict, Any, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from itertools import cycle
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 from pathlib import Path
 
 import psycopg2
 from psycopg2 import sql
-from psycopg2.extensions import connection as pg_connection
+from psycopg2.pool import ThreadedConnectionPool
 from pymongo import MongoClient
 from pymongo.database import Database
 from neo4j import GraphDatabase, Driver
@@ -15,25 +22,68 @@ from neo4j.exceptions import Neo4jError
 import configparser
 from tabulate import tabulate
 
+from benchmark import (BenchmarkConfig, BenchmarkResult, StreamTiming, BENCHMARK_PATH, STAT_COLUMNS,
+                       run_benchmark, report, save_results, compare_results)
+import loadgen
+from loadgen import LoadConfig, LoadResult
+from workloads import Workload, ParameterSampler, discover_queries, find_workloads
+from mongosh import MongoQuery
+import equivalence
+import plans
+import design
+from result_cache import ResultCache, MAX_BYTES, TTL
+from friend_index import FriendGraphIndex, FRIEND_GRAPH_PATH
+from columnar import ColumnarEngine, PARQUET_PATH
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(message)s",
     handlers=[logging.FileHandler("analysis.log"), logging.StreamHandler()]
 )
 
+# Parameter sets drawn per workload for the load mode, cycled through by the workers.
+LOAD_SAMPLES = 10_000
+DATABASES = ['postgres', 'mongo', 'neo4j', 'csr', 'duckdb']
+SERVERS = ['postgres', 'mongo', 'neo4j']
+
+
 class HybridAnalysis:
-    def __init__(self, config_path: str = "scripts/analysis/config.ini"):
+    def __init__(self, config_path: str = "scripts/analysis/config.ini",
+                 benchmark: BenchmarkConfig = BenchmarkConfig(), pool_size: int = 1, seed: int = 42,
+                 parallel: bool = True, cache: Optional[ResultCache] = None, databases: List[str] = SERVERS):
         self.config = self._load_config(config_path)
-        self.pg_conn: Optional[pg_connection] = None
+        # Backends connected by connect(); PostgreSQL also serves the parameter populations unless DuckDB does.
+        self.databases = databases
+        self.benchmark = benchmark
+        # Run the backends in parallel threads (see per_backend); their queries still run one at a time.
+        self.parallel = parallel
+        # Parameter values of the workloads, drawn from the loaded PSQL tables.
+        self.sampler = ParameterSampler(self._fetch_population, seed)
+        # Connections per backend, shared by the threads of the load mode.
+        self.pool_size = pool_size
+        self.pg_pool: Optional[ThreadedConnectionPool] = None
+        self._pg_prepared: Dict[int, set] = {}      # id(connection) -> prepared statement names
+        self._pg_prepared_lock = threading.Lock()
         self.mongo_client: Optional[MongoClient] = None
+        self._mongo_indexed: set = set()           # createIndex calls of the q{N}.js files already run
         self.neo4j_driver: Optional[Driver] = None
-        self.performance_data: Dict[str, List[float]] = {
+        # In-process friend-graph index (friend_index.py), the 'csr' backend.
+        self.friend_index: Optional[FriendGraphIndex] = None
+        # Embedded DuckDB over the Parquet copies of the PSQL tables (columnar.py), the 'duckdb' backend.
+        self.columnar: Optional[ColumnarEngine] = None
+        self.performance_data: Dict[str, List[BenchmarkResult]] = {
             'postgres': [],
             'mongo': [],
-            'neo4j': []
+            'neo4j': [],
+            'csr': [],
+            'duckdb': []
         }
+        self.load_data: List[LoadResult] = []
+        self.raw_plans: Dict[Tuple[str, str], Any] = {}   # (database, query) -> plan of the profiled run
+        # Results of the workloads, for the runs through execute_cached (result_cache.py).
+        self.cache = cache
         
-        self.log_system_specs()
+        self.system_specs = self.log_system_specs()
 
     def __enter__(self):
         self.connect()
@@ -51,40 +101,62 @@ class HybridAnalysis:
         config.read(config_path)
         return config
 
-    def log_system_specs(self):
-        """Log hardware and OS specifications"""
+    def log_system_specs(self) -> Dict[str, str]:
+        """Log hardware and OS specifications; they are saved with the benchmark results"""
         system_info = {
             'OS': platform.system(),
             'OS Version': platform.version(),
             'CPU': platform.processor(),
+            'CPU Cores': str(psutil.cpu_count()),
             'RAM': f"{round(psutil.virtual_memory().total / (1024.**3))} GB",
             'Machine Type': platform.machine(),
             'Python Version': platform.python_version()
         }
         logging.info("System Specifications:\n" + 
                     tabulate(system_info.items(), headers=["Component", "Details"], tablefmt="pretty"))
+        return system_info
 
     def connect(self):
         try:
             # PostgreSQL
-            self.pg_conn = psycopg2.connect(**self.config['postgresql'])
-            logging.info("PostgreSQL connection established")
+            if 'postgres' in self.databases or 'duckdb' not in self.databases:
+                self.pg_pool = ThreadedConnectionPool(1, self.pool_size, **self.config['postgresql'])
+                logging.info(f"PostgreSQL connection pool established ({self.pool_size} connections)")
             
             # MongoDB
-            self.mongo_client = MongoClient(
-                self.config['mongodb']['host'],
-                serverSelectionTimeoutMS=5000
-            )
-            self.mongo_db = self.mongo_client[self.config['mongodb']['dbname']]
-            logging.info("MongoDB connection established")
+            if 'mongo' in self.databases:
+                self.mongo_client = MongoClient(
+                    self.config['mongodb']['host'],
+                    serverSelectionTimeoutMS=5000,
+                    maxPoolSize=self.pool_size,
+                    minPoolSize=self.pool_size
+                )
+                self.mongo_db = self.mongo_client[self.config['mongodb']['dbname']]
+                logging.info("MongoDB connection established")
             
             # Neo4j
-            self.neo4j_driver = GraphDatabase.driver(
-                self.config['neo4j']['uri'],
-                auth=(self.config['neo4j']['user'], 
-                     self.config['neo4j']['password'])
-            )
-            logging.info("Neo4j connection established")
+            if 'neo4j' in self.databases:
+                self.neo4j_driver = GraphDatabase.driver(
+                    self.config['neo4j']['uri'],
+                    auth=(self.config['neo4j']['user'], 
+                         self.config['neo4j']['password']),
+                    max_connection_pool_size=self.pool_size
+                )
+                logging.info("Neo4j connection established")
+
+            # Friend-graph index: memory-mapped, only paged in by the lookups.
+            if 'csr' in self.databases:
+                if (FRIEND_GRAPH_PATH / 'meta.json').exists():
+                    self.friend_index = FriendGraphIndex(FRIEND_GRAPH_PATH)
+                    logging.info("Friend graph index opened")
+                else:
+                    logging.warning(f"No friend graph index in {FRIEND_GRAPH_PATH}: the csr backend is unavailable")
+
+            # DuckDB: in process, no server ([duckdb] section of config.ini, optional).
+            if 'duckdb' in self.databases:
+                self.columnar = ColumnarEngine(self.config.get('duckdb', 'parquet_path', fallback=str(PARQUET_PATH)),
+                                               self.config.getint('duckdb', 'threads', fallback=0))
+                logging.info(f"DuckDB engine opened ({self.columnar.threads} threads)")
             
         except Exception as e:
             logging.error(f"Connection failed: {str(e)}")
@@ -92,121 +164,561 @@ class HybridAnalysis:
             raise
 
     def close(self):
-        if self.pg_conn:
-            self.pg_conn.close()
-            logging.info("PostgreSQL connection closed")
+        if self.pg_pool:
+            self.pg_pool.closeall()
+            logging.info("PostgreSQL connections closed")
         if self.mongo_client:
             self.mongo_client.close()
             logging.info("MongoDB connection closed")
         if self.neo4j_driver:
             self.neo4j_driver.close()
             logging.info("Neo4j connection closed")
+        self.friend_index = None
+        if self.columnar:
+            self.columnar.close()
+            logging.info("DuckDB engine closed")
+
+    def _fetch_population(self, query: str) -> List[tuple]:
+        """Rows of a parameter population query, from DuckDB when PostgreSQL is not connected"""
+        if self.pg_pool is None and self.columnar is not None:
+            return self.columnar.execute(query)
+        return self._execute_pg_query(query)[0]
 
+    # The _execute_* methods log and re-raise errors, so that a failed run is never timed.
     def _execute_pg_query(self, query: str, params: Dict = None) -> Tuple[List[tuple], float]:
-        start_time = time.time()
+        start_time = time.perf_counter()
+        conn = self.pg_pool.getconn()
         try:
-            with self.pg_conn.cursor() as cursor:
+            with conn.cursor() as cursor:
                 cursor.execute(sql.SQL(query), params or {})
-                return cursor.fetchall(), time.time() - start_time
+                return cursor.fetchall(), time.perf_counter() - start_time
         except Exception as e:
             logging.error(f"PostgreSQL error: {str(e)}")
-            return [], 0.0
+            conn.rollback()
+            raise
+        finally:
+            self.pg_pool.putconn(conn)
 
-    def _execute_mongo_aggregation(self, pipeline: List[Dict]) -> Tuple[List[Dict], float]:
-        start_time = time.time()
+    def _mongo_cursor(self, query: MongoQuery, params: Dict = None, batch_size: Optional[int] = None):
+        query = query.bind(params)
+        collection = self.mongo_db[query.collection]
+        if query.operation == 'aggregate':
+            options = dict(query.options, batchSize=batch_size) if batch_size else query.options
+            return collection.aggregate(query.pipeline, **options)
+        options = dict(query.options, batch_size=batch_size or 0)
+        if 'sort' in options:
+            options['sort'] = list(options['sort'].items())
+        return collection.find(query.filter, **options)
+
+    def _execute_mongo_query(self, query: MongoQuery, params: Dict = None) -> Tuple[List[Dict], float]:
+        start_time = time.perf_counter()
         try:
-            result = list(self.mongo_db.messages.aggregate(pipeline))
-            return result, time.time() - start_time
+            result = list(self._mongo_cursor(query, params))
+            return result, time.perf_counter() - start_time
         except Exception as e:
             logging.error(f"MongoDB error: {str(e)}")
-            return [], 0.0
+            raise
 
     def _execute_neo4j_query(self, query: str, params: Dict = None) -> Tuple[List[Dict], float]:
-        start_time = time.time()
+        start_time = time.perf_counter()
         try:
             with self.neo4j_driver.session() as session:
                 result = session.run(query, params or {})
-                return result.data(), time.time() - start_time
+                return result.data(), time.perf_counter() - start_time
         except Neo4jError as e:
             logging.error(f"Neo4j error: {e.message}")
-            return [], 0.0
-
-    def run_query_multiple_times(self, db_type: str, *args, **kwargs) -> List[float]:
-        """Run query 5 times and collect execution times"""
-        times = []
-        for i in range(5):
-            if db_type == 'postgres':
-                _, exec_time = self._execute_pg_query(*args, **kwargs)
-            elif db_type == 'mongo':
-                _, exec_time = self._execute_mongo_aggregation(*args, **kwargs)
-            elif db_type == 'neo4j':
-                _, exec_time = self._execute_neo4j_query(*args, **kwargs)
-                
-            times.append(exec_time)
-            logging.info(f"{db_type.capitalize()} run {i+1}: {exec_time:.4f}s")
-            time.sleep(0.5)
-            
-        return times
+            raise
 
-    def analyze_campaigns(self) -> Dict[str, Any]:
-        results = {}
-        
-        # PostgreSQL
-        pg_query = Path("scripts/analysis/q1.sql").read_text()
-        pg_times = self.run_query_multiple_times('postgres', pg_query)
-        results['postgres'] = self._execute_pg_query(pg_query)[0]
-        self.performance_data['postgres'].extend(pg_times)
-        
-        # MongoDB
-        # mongo_pipeline = eval(Path("scripts/analysis/q1.js").read_text())
-        # mongo_times = self.run_query_multiple_times('mongo', mongo_pipeline)
-        # results['mongo'] = self._execute_mongo_aggregation(mongo_pipeline)[0]
-        # self.performance_data['mongo'].extend(mongo_times)
-        
-        # # Neo4j
-        # cypher_query = Path("scripts/analysis/q1.cypher").read_text()
-        # neo_times = self.run_query_multiple_times('neo4j', cypher_query)
-        # results['neo4j'] = self._execute_neo4j_query(cypher_query)[0]
-        # self.performance_data['neo4j'].extend(neo_times)
-        
+    def _execute_duckdb_query(self, query: str, params: Dict = None) -> Tuple[List[tuple], float]:
+        start_time = time.perf_counter()
+        try:
+            return self.columnar.execute(query, params), time.perf_counter() - start_time
+        except Exception as e:
+            logging.error(f"DuckDB error: {str(e)}")
+            raise
+
+    def _execute_csr_query(self, operation: str, params: Dict = None) -> Tuple[List[tuple], float]:
+        start_time = time.perf_counter()
+        try:
+            if self.friend_index is None:
+                raise RuntimeError(f"No friend graph index in {FRIEND_GRAPH_PATH}, run clean_data.py first")
+            return self.friend_index.run(operation, params), time.perf_counter() - start_time
+        except Exception as e:
+            logging.error(f"Friend graph error: {str(e)}")
+            raise
+
+    def _execute_pg_prepared(self, name: str, query: str, params: Dict) -> Tuple[List[tuple], float]:
+        """Execute a parameterized query as a server-side prepared statement, prepared once per connection"""
+        start_time = time.perf_counter()
+        conn = self.pg_pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                order = list(dict.fromkeys(re.findall(r'%\((\w+)\)s', query)))
+                with self._pg_prepared_lock:
+                    prepared = self._pg_prepared.setdefault(id(conn), set())
+                if name not in prepared:
+                    positional = re.sub(r'%\((\w+)\)s', lambda m: f"${order.index(m.group(1)) + 1}", query)
+                    cursor.execute(f"PREPARE {name} AS {positional.strip().rstrip(';')}")
+                    prepared.add(name)
+                cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(order))})",
+                               [params[parameter] for parameter in order])
+                return cursor.fetchall(), time.perf_counter() - start_time
+        except Exception as e:
+            logging.error(f"PostgreSQL error: {str(e)}")
+            conn.rollback()
+            raise
+        finally:
+            self.pg_pool.putconn(conn)
+
+    # The _stream_* generators yield the rows as the driver fetches them, `batch_size` rows per round trip.
+    def _stream_pg_query(self, query: str, params: Dict = None, batch_size: int = 2000) -> Iterator[tuple]:
+        """Rows of a server-side named cursor; parameters are bound client-side, since a cursor cannot be
+        declared over a prepared statement"""
+        conn = self.pg_pool.getconn()
+        try:
+            with conn.cursor(name=f"stream_{threading.get_ident()}") as cursor:
+                cursor.itersize = batch_size
+                cursor.execute(query.strip().rstrip(';'), params or {})
+                yield from cursor
+        except Exception as e:
+            logging.error(f"PostgreSQL error: {str(e)}")
+            raise
+        finally:
+            # Ends the transaction the named cursor lives in.
+            conn.rollback()
+            self.pg_pool.putconn(conn)
+
+    def _stream_mongo_query(self, query: MongoQuery, params: Dict = None,
+                            batch_size: int = 2000) -> Iterator[Dict]:
+        try:
+            with self._mongo_cursor(query, params, batch_size) as cursor:
+                yield from cursor
+        except Exception as e:
+            logging.error(f"MongoDB error: {str(e)}")
+            raise
+
+    def _stream_neo4j_query(self, query: str, params: Dict = None, batch_size: int = 2000) -> Iterator[Dict]:
+        try:
+            with self.neo4j_driver.session(fetch_size=batch_size) as session:
+                for record in session.run(query, params or {}):
+                    yield record.data()
+        except Neo4jError as e:
+            logging.error(f"Neo4j error: {e.message}")
+            raise
+
+    # The _explain_* methods run a query once under the profiler of its backend and return the raw plan.
+    def _explain_pg_query(self, query: str, params: Dict = None) -> List[Dict]:
+        conn = self.pg_pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query.strip().rstrip(';')}", params or {})
+                return cursor.fetchone()[0]
+        except Exception as e:
+            logging.error(f"PostgreSQL error: {str(e)}")
+            raise
+        finally:
+            # EXPLAIN ANALYZE executes the query: nothing it did is kept.
+            conn.rollback()
+            self.pg_pool.putconn(conn)
+
+    def _explain_mongo_query(self, query: MongoQuery, params: Dict = None) -> Dict:
+        query = query.bind(params)
+        if query.operation == 'aggregate':
+            command = {'aggregate': query.collection, 'pipeline': query.pipeline, 'cursor': {}, **query.options}
+        else:
+            command = {'find': query.collection, 'filter': query.filter, **query.options}
+        try:
+            return self.mongo_db.command('explain', command, verbosity='executionStats')
+        except Exception as e:
+            logging.error(f"MongoDB error: {str(e)}")
+            raise
+
+    def _explain_neo4j_query(self, query: str, params: Dict = None) -> Dict:
+        try:
+            with self.neo4j_driver.session() as session:
+                return session.run(f"PROFILE {query}", params or {}).consume().profile
+        except Neo4jError as e:
+            logging.error(f"Neo4j error: {e.message}")
+            raise
+
+    def stream(self, workload: Workload, params: Optional[Dict] = None, sink=None) -> StreamTiming:
+        """Run a workload once and consume its rows as they arrive, passing each to `sink` if given;
+        no row is kept, so memory does not grow with the result size"""
+        batch_size = self.benchmark.batch_size
+        if workload.database == 'postgres':
+            rows = self._stream_pg_query(workload.text, params, batch_size)
+        elif workload.database == 'mongo':
+            rows = self._stream_mongo_query(workload.mongo, params, batch_size)
+        elif workload.database == 'duckdb':
+            rows = self.columnar.stream(workload.text, params, batch_size)
+        elif workload.database == 'csr':
+            # The rows are computed in process, there is nothing to stream.
+            rows = iter(self._execute_csr_query(workload.operation, params)[0])
+        else:
+            rows = self._stream_neo4j_query(workload.text, params, batch_size)
+        start_time, first_row, count = time.perf_counter(), None, 0
+        for row in rows:
+            if first_row is None:
+                first_row = time.perf_counter() - start_time
+            count += 1
+            if sink is not None:
+                sink(row)
+        last_row = time.perf_counter() - start_time
+        return StreamTiming(count, last_row if first_row is None else first_row, last_row)
+
+    def execute(self, workload: Workload, params: Optional[Dict] = None) -> Tuple[List, float]:
+        """Run a workload once, with the parameter values of `params`"""
+        if workload.database == 'postgres':
+            if workload.parameters:
+                return self._execute_pg_prepared(f"{workload.query}_workload", workload.text, params)
+            return self._execute_pg_query(workload.text)
+        if workload.database == 'mongo':
+            return self._execute_mongo_query(workload.mongo, params)
+        if workload.database == 'csr':
+            return self._execute_csr_query(workload.operation, params)
+        if workload.database == 'duckdb':
+            return self._execute_duckdb_query(workload.text, params)
+        return self._execute_neo4j_query(workload.text, params)
+
+    def execute_cached(self, workload: Workload, params: Optional[Dict] = None) -> Tuple[List, float]:
+        """Run a workload once through the result cache: its rows are only fetched on a miss"""
+        return self.cache.fetch(workload.database, workload.query, workload.text, params,
+                                partial(self.execute, workload, params))
+
+    def workloads(self, queries: Optional[List[str]], databases: List[str]) -> List[Workload]:
+        """The catalog workloads of `queries` (all of them if None) on `databases`, with their Mongo indexes built"""
+        workloads = find_workloads(queries or discover_queries(), databases)
+        for workload in workloads:
+            for collection, keys, options in workload.mongo.indexes if workload.mongo else []:
+                if (collection, repr(keys)) not in self._mongo_indexed:
+                    self.mongo_db[collection].create_index(list(keys.items()), **options)
+                    self._mongo_indexed.add((collection, repr(keys)))
+                    logging.info(f"MongoDB index {keys} ensured on {collection} for {workload.query}")
+        return workloads
+
+    def per_backend(self, workloads: List[Workload], run) -> List:
+        """`run(workload)` for every workload: the backends in parallel threads, the queries of a backend in order"""
+        backends: Dict[str, List[int]] = {}
+        for i, workload in enumerate(workloads):
+            backends.setdefault(workload.database, []).append(i)
+        # The parameter populations are read from PSQL once, before the threads compete for its connection.
+        self.sampler.prefetch(workloads)
+        if not self.parallel or len(backends) < 2:
+            return [run(workload) for workload in workloads]
+        results = [None] * len(workloads)
+
+        def run_backend(indexes: List[int]):
+            for i in indexes:
+                results[i] = run(workloads[i])
+
+        with ThreadPoolExecutor(max_workers=len(backends), thread_name_prefix='backend') as executor:
+            for future in [executor.submit(run_backend, indexes) for indexes in backends.values()]:
+                future.result()
         return results
 
-    def generate_performance_report(self):
-        """Calculate statistics and log performance results"""
-        report = []
-        for db in self.performance_data:
-            if not self.performance_data[db]:
-                continue
-            avg = statistics.mean(self.performance_data[db])
-            stdev = statistics.stdev(self.performance_data[db]) if len(self.performance_data[db]) > 1 else 0
-            report.append([
-                db.capitalize(),
-                f"{avg:.4f}s",
-                f"{stdev:.4f}s",
-                f"{min(self.performance_data[db]):.4f}s",
-                f"{max(self.performance_data[db]):.4f}s"
-            ])
-            
-        logging.info("\nPerformance Report:\n" + 
-                    tabulate(report, 
-                            headers=["Database", "Avg Time", "Std Dev", "Min", "Max"],
-                            tablefmt="pretty"))
-        logging.info("Individual run times:")
-        for db_type, times in self.performance_data.items():
-            logging.info(f"{db_type.capitalize()}: {['%.4fs' % t for t in times]}")
+    def run_query_multiple_times(self, workload: Workload, cached: bool = False) -> BenchmarkResult:
+        """Benchmark a workload with the warmup and iterations of self.benchmark, on sampled parameters;
+        through the result cache if `cached` (reported as '<query> (cached)')"""
+        samples = None
+        if workload.parameters:
+            samples = self.sampler.draw(workload, self.benchmark.warmup + self.benchmark.iterations)
+        execute = self.execute_cached if cached else self.stream if self.benchmark.stream else self.execute
+        result = run_benchmark(workload.database, _label(workload.query, cached), partial(execute, workload),
+                               self.benchmark, samples)
+        self.performance_data[workload.database].append(result)
+        return result
+
+    def benchmark_workloads(self, queries: Optional[List[str]], databases: List[str]) -> List[BenchmarkResult]:
+        """Benchmark every query on every backend, then check that the backends agree on each query's
+        result and capture the plans"""
+        workloads = self.workloads(queries, databases)
+        results = self.per_backend(workloads, self.run_query_multiple_times)
+        checks = self.check_equivalence(workloads)
+        plan_metrics = self.capture_plans(workloads) if self.benchmark.explain else {}
+        for result in results:
+            result.equivalent = checks.get((result.database, result.query))
+            result.plan = plan_metrics.get((result.database, result.query))
+        if self.cache is not None:
+            results += self.benchmark_cached(workloads, results)
+        return results
+
+    def benchmark_cached(self, workloads: List[Workload], uncached: List[BenchmarkResult]) -> List[BenchmarkResult]:
+        """Benchmark the workloads again through the result cache, and log their hit rates and their
+        latencies with and without it"""
+        results = self.per_backend(workloads, partial(self.run_query_multiple_times, cached=True))
+        rows = []
+        for workload, before, after in zip(workloads, uncached, results):
+            # The cache returns the rows of the uncached runs.
+            after.equivalent = before.equivalent
+            stats = self.cache.stats.get((workload.database, workload.query))
+            before_p50, after_p50 = before.stats()['p50'], after.stats()['p50']
+            rows.append([workload.database, workload.query,
+                         '-' if stats is None or stats.hit_rate is None else f"{stats.hit_rate:.1%}",
+                         *('-' if p50 is None else f"{p50:.4f}s" for p50 in (before_p50, after_p50)),
+                         f"{before_p50 / after_p50:.1f}x" if before_p50 and after_p50 else '-'])
+        logging.info("\nResult Cache:\n" + self.cache.report() + "\n" +
+                     tabulate(rows, headers=['Database', 'Query', 'hit rate', 'p50 uncached', 'p50 cached',
+                                             'speedup'], tablefmt='pretty'))
+        return results
+
+    def _first_params(self, workload: Workload) -> Optional[Dict]:
+        return self.sampler.draw(workload, 1)[0][0] if workload.parameters else None
+
+    def _fingerprint(self, workload: Workload) -> Optional[equivalence.Fingerprint]:
+        """The fingerprint of one streamed run of a workload with its first parameter sample, None if it failed"""
+        fingerprint = equivalence.Fingerprint()
+        try:
+            self.stream(workload, self._first_params(workload), sink=fingerprint.add)
+            return fingerprint
+        except Exception as e:
+            logging.warning(f"{workload.database} {workload.query}: no result to compare ({e})")
+            return None
+
+    def _result(self, workload: Workload) -> Optional[List]:
+        """The rows of one run of a workload with its first parameter sample, None if it failed"""
+        try:
+            return self.execute(workload, self._first_params(workload))[0]
+        except Exception as e:
+            logging.warning(f"{workload.database} {workload.query}: no result ({e})")
+            return None
+
+    def _plan(self, workload: Workload) -> Optional[Tuple[Dict[str, Any], Any]]:
+        """The plan metrics and raw plan of one profiled run of a workload with its first parameter sample"""
+        if workload.database not in plans.METRICS:
+            return None
+        params = self._first_params(workload)
+        try:
+            if workload.database == 'postgres':
+                raw = self._explain_pg_query(workload.text, params)
+            elif workload.database == 'mongo':
+                raw = self._explain_mongo_query(workload.mongo, params)
+            else:
+                raw = self._explain_neo4j_query(workload.text, params)
+            return plans.METRICS[workload.database](raw), raw
+        except Exception as e:
+            logging.warning(f"{workload.database} {workload.query}: no plan captured ({e})")
+            return None
+
+    def capture_plans(self, workloads: List[Workload]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """(database, query) -> plan metrics of every workload (plans.py); the raw plans go to self.raw_plans"""
+        captured = dict(zip(((workload.database, workload.query) for workload in workloads),
+                            self.per_backend(workloads, self._plan)))
+        metrics = {key: plan[0] for key, plan in captured.items() if plan is not None}
+        self.raw_plans.update({key: plan[1] for key, plan in captured.items() if plan is not None})
+        if metrics:
+            logging.info("\nQuery Plans:\n" + plans.report(metrics))
+        for (database, query), plan in metrics.items():
+            for scan in plan['full_scans']:
+                logging.warning(f"{database} {query}: full scan, {scan}")
+        return metrics
+
+    def check_equivalence(self, workloads: List[Workload]) -> Dict[Tuple[str, str], Optional[bool]]:
+        """(database, query) -> whether the backends that ran the query agree on its result (equivalence.py)"""
+        comparable = [workload for workload in workloads if workload.incomparable is None]
+        fingerprints = dict(zip(((workload.database, workload.query) for workload in comparable),
+                                self.per_backend(comparable, self._fingerprint)))
+        status = {}
+        for query in dict.fromkeys(workload.query for workload in workloads):
+            results = {database: result for (database, name), result in fingerprints.items() if name == query}
+            incomparable = {workload.database: workload.incomparable for workload in workloads
+                            if workload.query == query and workload.incomparable is not None}
+            status.update({(database, query): equivalent
+                           for database, equivalent in equivalence.check(query, results, incomparable).items()})
+        return status
+
+    def analyze_campaigns(self, databases: List[str]) -> Dict[str, Any]:
+        """The q1 results of every backend"""
+        workloads = self.workloads(['q1'], databases)
+        return dict(zip((workload.database for workload in workloads), self.per_backend(workloads, self._result)))
+
+    def run_load(self, queries: List[str], databases: List[str], config: LoadConfig) -> List[LoadResult]:
+        """Throughput and latency curves of every workload, one backend after the other; with a result
+        cache, every workload runs again through it"""
+        for workload in self.workloads(queries, databases):
+            for cached in (False, True) if self.cache is not None else (False,):
+                execute = self.execute_cached if cached else self.stream if self.benchmark.stream else self.execute
+                execute = partial(execute, workload)
+                if workload.parameters:
+                    # Every query of every worker thread takes the next parameter set of a seeded cycle.
+                    samples = cycle(params for params, _ in self.sampler.draw(workload, LOAD_SAMPLES))
+                    execute = lambda execute=execute, samples=samples: execute(next(samples))
+                self.load_data.extend(loadgen.run_load(workload.database, _label(workload.query, cached),
+                                                       execute, config))
+        logging.info("\nLoad Report:\n" + loadgen.report(self.load_data))
+        if self.cache is not None:
+            logging.info("\nResult Cache:\n" + self.cache.report())
+        return self.load_data
+
+    def apply_physical_design(self, path: Path = design.DESIGN_PATH):
+        """Apply the physical design stage (design.py) and start the next benchmark afresh"""
+        conn = psycopg2.connect(**self.config['postgresql'])
+        try:
+            timings = design.apply(conn, path)
+        except Exception as e:
+            logging.error(f"PostgreSQL error: {str(e)}")
+            raise
+        finally:
+            conn.close()
+        logging.info(f"Physical design stage applied in {sum(seconds for _, seconds in timings):.2f}s")
+        # The pooled connections hold statements prepared against the former tables.
+        self.pg_pool.closeall()
+        self.pg_pool = ThreadedConnectionPool(1, self.pool_size, **self.config['postgresql'])
+        self._pg_prepared.clear()
+        self.performance_data = {db_type: [] for db_type in self.performance_data}
+        self.raw_plans = {}
+        if self.cache is not None:
+            self.cache.clear()
+
+    def generate_performance_report(self, output: Optional[Path] = None) -> Optional[Path]:
+        """Log the latency statistics of every benchmarked query and save them to `output` (.json or .csv)"""
+        results = [result for db_results in self.performance_data.values() for result in db_results]
+        logging.info("\nPerformance Report:\n" + report(results))
+        for result in results:
+            if result.failures:
+                logging.warning(f"{result.database} {result.query}: {result.failures} failed runs excluded, "
+                                f"last error: {result.errors[-1]}")
+        if output is not None:
+            if self.raw_plans:
+                plans.save_plans(self.raw_plans, output)
+            return save_results(results, output, self.system_specs, self.benchmark)
+
+
+def _label(query: str, cached: bool) -> str:
+    return f"{query} (cached)" if cached else query
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run and benchmark the analysis queries.")
+    subparsers = parser.add_subparsers(dest='command')
+    run = subparsers.add_parser('run', help="Benchmark the queries (default command).")
+    run.add_argument('--output', type=Path,
+                     default=BENCHMARK_PATH / f"{datetime.now():%Y%m%d-%H%M%S}.json",
+                     help="Results file, .json (with every latency) or .csv.")
+    design_stage = subparsers.add_parser('design', help="Benchmark the queries before and after the physical "
+                                                        "design stage of the PSQL schema.")
+    design_stage.add_argument('--design-file', type=Path, default=design.DESIGN_PATH,
+                              help="SQL script of the stage.")
+    design_stage.add_argument('--output-dir', type=Path, default=BENCHMARK_PATH,
+                              help="Directory of the design-<date>-<time>-before/after.json results.")
+    design_stage.add_argument('--threshold', type=float, default=10,
+                              help="Slowdown in percent above which a query is flagged.")
+    for command in (run, design_stage):
+        command.add_argument('--warmup', type=int, default=BenchmarkConfig.warmup,
+                             help="Untimed executions before the timed ones; the first one is reported as cold.")
+        command.add_argument('--iterations', type=int, default=BenchmarkConfig.iterations,
+                             help="Timed executions per query.")
+        command.add_argument('--pause', type=float, default=BenchmarkConfig.pause,
+                             help="Seconds to sleep between two executions.")
+        command.add_argument('--queries', nargs='+', default=None,
+                             help="Queries of the catalog to run (default: every q{N} file).")
+        command.add_argument('--databases', nargs='+', default=['postgres', 'mongo', 'neo4j'],
+                             choices=DATABASES,
+                             help="Backends to run; csr is the in-process friend-graph index of clean_data.py, "
+                                  "duckdb the embedded DuckDB engine over its Parquet tables (no server).")
+        command.add_argument('--sequential', action='store_true',
+                             help="Run the backends one after the other instead of in parallel threads.")
+        command.add_argument('--no-explain', dest='explain', action='store_false',
+                             help="Do not capture the query plans (EXPLAIN ANALYZE, explain, PROFILE) after the "
+                                  "benchmark.")
+    # The stage only changes the PSQL schema.
+    design_stage.set_defaults(databases=['postgres'])
+    load = subparsers.add_parser('load', help="Throughput and latency curves under concurrent load.")
+    load.add_argument('--concurrency', type=int, nargs='+', default=LoadConfig().concurrency,
+                      help="Closed-loop load levels: worker threads sending queries back to back.")
+    load.add_argument('--qps', type=float, nargs='+', default=None,
+                      help="Open-loop load levels instead: queries per second, served by max(--concurrency) "
+                           "workers.")
+    load.add_argument('--duration', type=float, default=LoadConfig.duration,
+                      help="Measured seconds per load level.")
+    load.add_argument('--warmup', type=float, default=LoadConfig.warmup,
+                      help="Unmeasured seconds before each load level.")
+    load.add_argument('--queries', nargs='+', default=None,
+                      help="Queries of the catalog to run (default: every q{N} file).")
+    load.add_argument('--databases', nargs='+', default=['postgres', 'mongo', 'neo4j'],
+                      choices=DATABASES,
+                      help="Backends to run; csr is the in-process friend-graph index of clean_data.py, duckdb "
+                           "the embedded DuckDB engine over its Parquet tables (no server).")
+    for command in (run, load):
+        command.add_argument('--cache', action='store_true',
+                             help="Run every query again through the result cache and report its hit rate and "
+                                  "latency next to the uncached ones; the cached runs buffer the rows.")
+        command.add_argument('--cache-size', type=float, default=MAX_BYTES / 1024**2,
+                             help="Memory bound of the result cache, in MB (least recently used results are "
+                                  "evicted beyond it).")
+        command.add_argument('--cache-ttl', type=float, default=TTL,
+                             help="Seconds a cached result is served; results are also dropped when the loading "
+                                  "scripts bump the load generation of their backend.")
+    for command in (run, design_stage, load):
+        command.add_argument('--seed', type=int, default=42,
+                             help="Seed of the parameter values drawn from the loaded data.")
+        command.add_argument('--stream', action='store_true',
+                             help="Consume the rows as they arrive (named cursors, batched cursors, lazy "
+                                  "records) instead of buffering each result; also times the first row.")
+        command.add_argument('--batch-size', type=int, default=BenchmarkConfig.batch_size,
+                             help="Rows per round trip with --stream.")
+    load.add_argument('--output', type=Path,
+                      default=BENCHMARK_PATH / f"load-{datetime.now():%Y%m%d-%H%M%S}.json",
+                      help="Results file, .json (with every latency) or .csv.")
+    compare = subparsers.add_parser('compare', help="Flag the regressions of a saved run against a baseline run.")
+    compare.add_argument('baseline', type=Path)
+    compare.add_argument('current', type=Path)
+    compare.add_argument('--metric', default='p50', choices=STAT_COLUMNS[3:])
+    compare.add_argument('--threshold', type=float, default=10,
+                         help="Slowdown in percent above which a query is flagged.")
+    argv = sys.argv[1:]
+    if not argv or argv[0] not in ('run', 'design', 'load', 'compare', '-h', '--help'):
+        argv = ['run', *argv]
+    return parser.parse_args(argv)
+
+
+def cache(args) -> Optional[ResultCache]:
+    return ResultCache(int(args.cache_size * 1024**2), args.cache_ttl) if args.cache else None
+
 
 if __name__ == "__main__":
-    with HybridAnalysis() as analyzer:
+    args = parse_args()
+    if args.command == 'compare':
+        sys.exit(compare_results(args.baseline, args.current, args.metric, args.threshold / 100))
+
+    if args.command == 'load':
+        config = LoadConfig(args.concurrency, args.qps, args.duration, args.warmup)
+        with HybridAnalysis(benchmark=BenchmarkConfig(stream=args.stream, batch_size=args.batch_size),
+                            pool_size=max(args.concurrency), seed=args.seed, cache=cache(args),
+                            databases=args.databases) as analyzer:
+            analyzer.run_load(args.queries, args.databases, config)
+            loadgen.save_load_results(analyzer.load_data, args.output, analyzer.system_specs, config)
+        sys.exit()
+
+    benchmark = BenchmarkConfig(args.warmup, args.iterations, args.pause, args.stream, args.batch_size, args.explain)
+    if args.command == 'design':
+        stamp = f"{datetime.now():%Y%m%d-%H%M%S}"
+        before, after = (args.output_dir / f"design-{stamp}-{stage}.json" for stage in ('before', 'after'))
+        with HybridAnalysis(benchmark=benchmark, seed=args.seed, parallel=not args.sequential,
+                            databases=args.databases) as analyzer:
+            analyzer.benchmark_workloads(args.queries, args.databases)
+            analyzer.generate_performance_report(before)
+            analyzer.apply_physical_design(args.design_file)
+            analyzer.benchmark_workloads(args.queries, args.databases)
+            analyzer.generate_performance_report(after)
+        compare_results(before, after, threshold=args.threshold / 100)
+        sys.exit()
+
+    with HybridAnalysis(benchmark=benchmark, seed=args.seed, parallel=not args.sequential,
+                        cache=cache(args), databases=args.databases) as analyzer:
         try:
+            analyzer.benchmark_workloads(args.queries, args.databases)
+            analyzer.generate_performance_report(args.output)
             logging.info("Starting campaign analysis")
-            campaign_results = analyzer.analyze_campaigns()
-            analyzer.generate_performance_report()
+            campaign_results = analyzer.analyze_campaigns(args.databases)
             
-            logging.info("\n" + tabulate(campaign_results['postgres'], 
-                                  headers=["campaign_id", "campaign_type", "total_messages", 
-                                           "clients_with_interaction", "users_purchased", 
-                                           "friends_who_also_purchased", "conversion_rate (%)"], 
-                                  tablefmt="pretty"))
+            for db_type, rows in campaign_results.items():
+                if db_type in ('postgres', 'duckdb'):
+                    rows, headers = rows or [], ["campaign_id", "campaign_type", "total_messages",
+                                                 "clients_with_interaction", "users_purchased",
+                                                 "friends_who_also_purchased", "conversion_rate (%)"]
+                else:
+                    rows, headers = [list(row.values()) for row in rows or []], list((rows or [{}])[0])
+                logging.info(f"\n{db_type}:\n" + tabulate(rows, headers=headers, tablefmt="pretty"))
             
             logging.info("Analysis completed successfully")
             
@@ -0,0 +1,47 @@
+"""Physical design stage of the PSQL schema (scripts/loading/physical_design_psql.sql).
+
+The stage adds the secondary and full-text indexes the queries lack, monthly
+range partitions on events.event_time and a BRIN index on message_sent.sent_at.
+The `design` command of data_analysis.py benchmarks the queries, applies it,
+and benchmarks them again: the comparison of the two runs shows, per query, the
+latency change and whether its plan changed.
+"""
+import logging
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+DESIGN_PATH = Path('scripts/loading/physical_design_psql.sql')
+
+
+def statements(text: str) -> List[str]:
+    """The statements of a SQL script: split at the semicolons ending a line, outside $$ bodies"""
+    result, current = [], []
+    for line in text.splitlines():
+        if not current and (not line.strip() or line.lstrip().startswith('--')):
+            continue
+        current.append(line)
+        if line.rstrip().endswith(';') and '\n'.join(current).count('$$') % 2 == 0:
+            result.append('\n'.join(current))
+            current = []
+    if current:
+        result.append('\n'.join(current))
+    return result
+
+
+def apply(conn, path: Path = DESIGN_PATH) -> List[Tuple[str, float]]:
+    """Run the statements of `path` one by one on `conn` (in autocommit); (first line, seconds) of each"""
+    conn.autocommit = True
+    timings = []
+    with conn.cursor() as cursor:
+        for statement in statements(Path(path).read_text(encoding='utf-8')):
+            start = time.perf_counter()
+            cursor.execute(statement)
+            summary = statement.splitlines()[0].strip()
+            timings.append((summary, time.perf_counter() - start))
+            logger.info("[PSQL]: %s (%.2fs)", summary, timings[-1][1])
+    for notice in conn.notices:
+        logger.info("[PSQL]: %s", notice.strip())
+    return timings
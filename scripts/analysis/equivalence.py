@@ -0,0 +1,101 @@
+"""Result equivalence: the same query must return the same rows on every backend.
+
+Each backend runs the query once with the same parameter values, and its rows
+are normalized to compare across drivers:
+
+- a row is the tuple of its values, in column order (PSQL tuples, Mongo
+  documents, Neo4j records), with the ObjectId `_id` of Mongo documents dropped;
+- numbers are compared as floats rounded to FLOAT_DIGITS decimals (integral
+  values as ints, so 19-digit ids keep their precision), temporal values as ISO
+  strings, nested documents and arrays as tuples;
+- the rows are compared as a multiset, since ties may come back in any order:
+  the fingerprint of a result is its row count and the sum of the hashes of
+  its rows, computed one row at a time, so a streamed result is never kept.
+
+A result is equivalent when a strict majority of the backends that did not
+fail returned it; without a majority (e.g. two backends that disagree) every
+result is flagged, since there is no telling which one is right. Only results
+meant to be equal are counted: a query file that computes something else
+(declared @incomparable, see workloads.py) is not run for the check and is
+reported as 'not comparable', with its reason, instead of as a mismatch.
+"""
+import hashlib
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from bson import Decimal128, ObjectId
+from tabulate import tabulate
+
+logger = logging.getLogger(__name__)
+
+FLOAT_DIGITS = 6
+
+
+def normalize(value: Any) -> Any:
+    if hasattr(value, 'to_native'):         # neo4j.time types
+        value = value.to_native()
+    if isinstance(value, Decimal128):
+        value = value.to_decimal()
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, Decimal):
+        value = int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else round(value, FLOAT_DIGITS)
+    if isinstance(value, int):
+        return value
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return tuple(normalize(item) for key, item in value.items()
+                     if not (key == '_id' and isinstance(item, ObjectId)))
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize(item) for item in value)
+    return str(value)
+
+
+@dataclass
+class Fingerprint:
+    """Order-insensitive fingerprint of a result, fed one row at a time."""
+    rows: int = 0
+    total: int = 0
+
+    def add(self, row: Any):
+        row = normalize(row) if isinstance(row, (dict, list, tuple)) else (normalize(row),)
+        self.rows += 1
+        self.total = (self.total + int.from_bytes(hashlib.sha1(repr(row).encode()).digest()[:8], 'big')) % 2 ** 64
+
+    @property
+    def digest(self) -> str:
+        return f"{self.rows}:{self.total:016x}"
+
+
+def fingerprint(rows: List[Any]) -> Fingerprint:
+    result = Fingerprint()
+    for row in rows:
+        result.add(row)
+    return result
+
+
+def check(query: str, results: Dict[str, Optional[Fingerprint]],
+          incomparable: Optional[Dict[str, str]] = None) -> Dict[str, Optional[bool]]:
+    """database -> whether its result is the majority result (None if it failed, or if it is one of the
+    `incomparable` database -> reason, left out of the vote); logs a summary table"""
+    incomparable = incomparable or {}
+    fingerprints = {database: None if result is None else result.digest for database, result in results.items()}
+    votes = Counter(value for value in fingerprints.values() if value is not None)
+    majority = next((value for value, count in votes.items() if count > sum(votes.values()) / 2), None)
+    status = {database: None if value is None else value == majority for database, value in fingerprints.items()}
+    rows = [[query, database, '-' if results[database] is None else results[database].rows,
+             '-' if results[database] is None else f"{results[database].total:016x}",
+             {None: 'failed', True: 'ok', False: 'MISMATCH'}[status[database]]] for database in results]
+    log = logger.info if all(status.values()) else logger.warning
+    rows += [[query, database, '-', '-', f"not comparable: {reason}"] for database, reason in incomparable.items()]
+    status.update(dict.fromkeys(incomparable))
+    log(f"\nResult equivalence of {query}:\n" +
+        tabulate(rows, headers=['Query', 'Database', 'Rows', 'Fingerprint', 'Status'], tablefmt='pretty'))
+    return status
@@ -0,0 +1,124 @@
+"""In-process friend-graph backend: friend-based recommendations served from memory-mapped CSR arrays.
+
+clean_data.py writes the index to FRIEND_GRAPH_PATH (scripts/loading/friend_graph.py):
+the friends of every user in both directions and the user x product card
+purchase counts, as int32 offsets and values. Opening it maps the arrays
+without reading them, so pages are only loaded when a lookup touches them.
+
+top_products_batch answers "top products among the friends of a user" for
+many users at once, without a Python loop over users or friends: the friend
+ranges of the users, then the purchase ranges of the friends, are gathered
+with one fancy-indexing pass each, and the (user, product card) counts are
+summed with np.unique/np.bincount. Products are ranked by purchase count,
+ties by (product_id, category_id, brand), and answered by that natural key,
+as q2 on the other backends, whose product keys differ from product_card_pk.
+
+It is the 'csr' backend of data_analysis.py. Its catalog entries are
+q{N}.csr files naming one of OPERATIONS and declaring their parameters like
+the other query files; an operation takes the parameter values as keyword
+arguments and returns tuples, as PSQL rows.
+"""
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Written by scripts/loading/friend_graph.py.
+FRIEND_GRAPH_PATH = Path('output/friend_graph')
+ARRAYS = ['users', 'friend_offsets', 'friend_neighbors', 'purchase_offsets', 'purchase_products', 'purchase_counts']
+OPERATIONS = ['top_products']
+LIMIT = 10
+
+
+def gather(offsets: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(positions of the values of every row of `rows`, index in `rows` of each position)"""
+    starts, ends = offsets[rows].astype('int64'), offsets[rows + 1].astype('int64')
+    lengths = ends - starts
+    owners = np.repeat(np.arange(len(rows)), lengths)
+    # Position k of row r is starts[r] + k: the running index minus the lengths of the rows before r.
+    positions = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return positions, owners
+
+
+class FriendGraphIndex:
+    """The memory-mapped arrays of a friend-graph index."""
+
+    def __init__(self, path: Path = FRIEND_GRAPH_PATH):
+        self.path = Path(path)
+        for name in ARRAYS:
+            setattr(self, name, np.load(self.path / f'{name}.npy', mmap_mode='r'))
+        cards = pd.read_parquet(self.path / 'product_cards.parquet')
+        # product_id, category_id, brand and tie rank of every product_card_pk, by position.
+        positions = cards['product_card_pk'].to_numpy()
+        size = int(positions.max()) + 1 if len(positions) else 1
+        self.product_ids = np.zeros(size, dtype='int64')
+        self.product_ids[positions] = cards['product_id'].to_numpy()
+        self.category_ids = np.zeros(size, dtype='int64')
+        self.category_ids[positions] = cards['category_id'].to_numpy()
+        self.brands = np.full(size, None, dtype=object)
+        self.brands[positions] = cards['brand'].astype(object).where(cards['brand'].notna(), None).to_numpy()
+        # As object strings: a category column would sort by category order, and has no '' category.
+        ordered = cards.assign(brand=cards['brand'].astype(object).fillna(''))\
+            .sort_values(['product_id', 'category_id', 'brand'])
+        self.ranks = np.zeros(size, dtype='int64')
+        self.ranks[ordered['product_card_pk'].to_numpy()] = np.arange(len(ordered))
+        self.meta = json.loads((self.path / 'meta.json').read_text())
+        logger.info("Friend graph index %s opened: %s users, %s friendships, %s purchase entries",
+                    self.path, self.meta['users'], self.meta['friendships'], self.meta['purchase_entries'])
+
+    def rows(self, user_ids: Sequence[int]) -> np.ndarray:
+        """Row of every user_id in the index, -1 for unknown users"""
+        user_ids = np.asarray(user_ids, dtype='int64')
+        rows = np.searchsorted(self.users, user_ids)
+        found = rows < len(self.users)
+        found[found] = self.users[rows[found]] == user_ids[found]
+        return np.where(found, rows, -1)
+
+    def friends(self, user_id: int) -> np.ndarray:
+        """user_id of the friends of a user"""
+        row = self.rows([user_id])[0]
+        if row < 0:
+            return np.empty(0, dtype='int64')
+        return np.asarray(self.users[self.friend_neighbors[self.friend_offsets[row]:self.friend_offsets[row + 1]]])
+
+    def top_products_batch(self, user_ids: Sequence[int], limit: int = LIMIT) -> List[List[tuple]]:
+        """(product_id, category_id, brand, popularity_score) of the `limit` products most purchased by the
+        friends of each user, in the order of `user_ids`"""
+        rows = self.rows(user_ids)
+        queries = np.flatnonzero(rows >= 0)
+        positions, owners = gather(self.friend_offsets, rows[queries])
+        friends = self.friend_neighbors[positions]
+        positions, friend_of = gather(self.purchase_offsets, friends)
+        owners = queries[owners[friend_of]]
+        products = np.asarray(self.purchase_products[positions], dtype='int64')
+        counts = self.purchase_counts[positions]
+
+        # One key per (user, product card), to sum the counts of every friend.
+        width = int(products.max(initial=0)) + 1
+        keys, inverse = np.unique(owners * width + products, return_inverse=True)
+        scores = np.bincount(inverse, weights=counts, minlength=len(keys)).astype('int64')
+        owners, products = np.divmod(keys, width)
+        order = np.lexsort((self.ranks[products], -scores, owners))
+        owners, products, scores = owners[order], products[order], scores[order]
+        # Rank of every product within its user: its position minus the position of the user's first product.
+        starts = np.searchsorted(owners, owners)
+        keep = np.arange(len(owners)) - starts < limit
+        results: List[List[tuple]] = [[] for _ in range(len(rows))]
+        for owner, product, score in zip(owners[keep].tolist(), products[keep].tolist(), scores[keep].tolist()):
+            results[owner].append((int(self.product_ids[product]), int(self.category_ids[product]),
+                                   self.brands[product], score))
+        return results
+
+    def top_products(self, user_id: int, limit: int = LIMIT) -> List[tuple]:
+        return self.top_products_batch([user_id], limit)[0]
+
+    def run(self, operation: str, params: Optional[Dict] = None) -> List[tuple]:
+        """The rows of a catalog operation (a q{N}.csr file) with its parameter values"""
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown friend graph operation {operation!r}, expected one of {OPERATIONS}")
+        return getattr(self, operation)(**(params or {}))
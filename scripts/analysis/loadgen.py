@@ -0,0 +1,207 @@
+"""Concurrent load generation: throughput and latency curves per backend and query.
+
+Each workload (a query on one backend) is run at every load level, for
+`duration` seconds after `warmup` untimed seconds:
+
+- closed loop (default): `concurrency` worker threads, each sending its next
+  query as soon as the previous one returns;
+- open loop (`qps`): queries are scheduled at a fixed rate and served by
+  `concurrency` worker threads. Latency is counted from the scheduled time, so
+  the time spent queued behind a saturated backend is included.
+
+The worker threads share the pooled connections of HybridAnalysis (psycopg2
+ThreadedConnectionPool, pymongo and Neo4j driver pools of the same size). A
+workload saturates at the first level whose throughput grows by less than
+SATURATION_GAIN over the previous one (in open loop: the first level served
+more than SATURATION_GAIN below its target rate).
+"""
+import csv
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from tabulate import tabulate
+
+from benchmark import PERCENTILES
+
+logger = logging.getLogger(__name__)
+
+SATURATION_GAIN = 0.10
+
+
+@dataclass
+class LoadConfig:
+    concurrency: List[int] = field(default_factory=lambda: [1, 2, 4, 8, 16])
+    qps: Optional[List[float]] = None    # open-loop rates, one level each, instead of closed loop
+    duration: float = 30.0
+    warmup: float = 2.0
+
+
+@dataclass
+class LoadResult:
+    """One workload at one load level; latencies in seconds."""
+    database: str
+    query: str
+    concurrency: int
+    qps: Optional[float] = None
+    elapsed: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+    failures: int = 0
+    errors: List[str] = field(default_factory=list)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {'concurrency': self.concurrency, 'target_qps': self.qps, 'completed': len(self.latencies),
+                 'failures': self.failures,
+                 'throughput': len(self.latencies) / self.elapsed if self.elapsed else 0.0}
+        latencies = np.asarray(self.latencies)
+        percentiles = np.percentile(latencies, PERCENTILES) if len(latencies) else [None] * len(PERCENTILES)
+        stats['mean'] = float(latencies.mean()) if len(latencies) else None
+        stats.update({f'p{p}': None if value is None else float(value) for p, value in zip(PERCENTILES, percentiles)})
+        return stats
+
+
+class _Recorder:
+    """Latencies and failures of the worker threads, recorded only inside the measured window."""
+
+    def __init__(self, result: LoadResult, measure_from: float):
+        self.result = result
+        self.measure_from = measure_from
+        self.lock = threading.Lock()
+
+    def call(self, execute: Callable[[], Any], since: float):
+        try:
+            execute()
+        except Exception as e:
+            if since >= self.measure_from:
+                with self.lock:
+                    self.result.failures += 1
+                    if len(self.result.errors) < 10:
+                        self.result.errors.append(f"{type(e).__name__}: {e}")
+            return
+        latency = time.perf_counter() - since
+        if since >= self.measure_from:
+            with self.lock:
+                self.result.latencies.append(latency)
+
+
+def _closed_loop(execute, result: LoadResult, config: LoadConfig):
+    start = time.perf_counter()
+    recorder = _Recorder(result, start + config.warmup)
+    end = recorder.measure_from + config.duration
+
+    def worker():
+        while (now := time.perf_counter()) < end:
+            recorder.call(execute, now)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(result.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result.elapsed = time.perf_counter() - recorder.measure_from
+
+
+def _open_loop(execute, result: LoadResult, config: LoadConfig):
+    start = time.perf_counter()
+    recorder = _Recorder(result, start + config.warmup)
+    end = recorder.measure_from + config.duration
+    scheduled = queue.Queue()
+
+    def worker():
+        while (since := scheduled.get()) is not None:
+            recorder.call(execute, since)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(result.concurrency)]
+    for thread in threads:
+        thread.start()
+    interval, n = 1 / result.qps, 0
+    while (at := start + n * interval) < end:
+        time.sleep(max(0.0, at - time.perf_counter()))
+        scheduled.put(at)
+        n += 1
+    backlog = scheduled.qsize()
+    for _ in threads:
+        scheduled.put(None)
+    for thread in threads:
+        thread.join()
+    result.elapsed = time.perf_counter() - recorder.measure_from
+    if backlog > result.concurrency:
+        logger.warning("%s %s at %s qps: %s queries still queued when scheduling stopped",
+                       result.database, result.query, result.qps, backlog)
+
+
+def run_load(database: str, query: str, execute: Callable[[], Any], config: LoadConfig) -> List[LoadResult]:
+    """The results of one workload at every load level of `config`."""
+    levels = [(max(config.concurrency), qps) for qps in config.qps] if config.qps \
+        else [(concurrency, None) for concurrency in config.concurrency]
+    results = []
+    for concurrency, qps in levels:
+        result = LoadResult(database, query, concurrency, qps)
+        (_open_loop if qps else _closed_loop)(execute, result, config)
+        stats = result.stats()
+        logger.info("%s %s, %s workers%s: %.1f queries/s, p50 %s, p99 %s, %s failures",
+                    database, query, concurrency, f" at {qps} qps" if qps else '', stats['throughput'],
+                    _seconds(stats['p50']), _seconds(stats['p99']), result.failures)
+        results.append(result)
+    return results
+
+
+def saturation(results: List[LoadResult]) -> Optional[LoadResult]:
+    """The first level of a workload whose throughput grew by less than SATURATION_GAIN
+    (or, open loop, fell short of its target rate by more than that), if any."""
+    for result in results:
+        if result.qps and result.stats()['throughput'] < result.qps * (1 - SATURATION_GAIN):
+            return result
+    for previous, result in zip(results, results[1:]):
+        if result.qps:
+            continue
+        if result.stats()['throughput'] < previous.stats()['throughput'] * (1 + SATURATION_GAIN):
+            return result
+    return None
+
+
+def _seconds(value: Optional[float]) -> str:
+    return '-' if value is None else f"{value:.4f}s"
+
+
+def report(results: List[LoadResult]) -> str:
+    rows, workloads = [], {}
+    for result in results:
+        workloads.setdefault((result.database, result.query), []).append(result)
+    for (database, query), curve in workloads.items():
+        saturated = saturation(curve)
+        for result in curve:
+            stats = result.stats()
+            rows.append([database, query, result.concurrency, result.qps or '-', f"{stats['throughput']:.1f}",
+                         *(_seconds(stats[key]) for key in ['mean', *(f'p{p}' for p in PERCENTILES)]),
+                         result.failures, 'saturated' if result is saturated else ''])
+    return tabulate(rows, headers=['Database', 'Query', 'Workers', 'Target QPS', 'Queries/s', 'mean',
+                                   *(f'p{p}' for p in PERCENTILES), 'failures', ''], tablefmt='pretty')
+
+
+def save_load_results(results: List[LoadResult], path: Path, system: Dict[str, str], config: LoadConfig) -> Path:
+    """Save the curves as JSON (with every latency) or, for a .csv path, one row per load level."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    meta = {'run_id': uuid.uuid4().hex[:12], 'created': datetime.now(timezone.utc).isoformat(timespec='seconds')}
+    if path.suffix == '.csv':
+        rows = [{**meta, 'database': result.database, 'query': result.query, **result.stats(), **system}
+                for result in results]
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, list(rows[0]) if rows else list(meta))
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        path.write_text(json.dumps({**meta, 'system': system, 'config': asdict(config),
+                                    'results': [{**asdict(result), 'stats': result.stats()}
+                                                for result in results]}, indent=2), encoding='utf-8')
+    logger.info("Load results saved to %s", path)
+    return path
@@ -0,0 +1,274 @@
+"""Safe loader of the mongosh query files (q{N}.js): no JavaScript is evaluated.
+
+A file holds one query statement, optionally preceded by createIndex calls:
+
+    db.products.createIndex({ category_code: "text" });
+    db.getCollection('products').find({ $text: { $search: params.term } }).sort({ ... }).limit(10);
+    db.messages.aggregate([ { $match: ... }, ... ], { allowDiskUse: true })
+
+The arguments are JavaScript object literals (unquoted keys, single or double
+quoted strings, trailing commas, comments) and may use the constructors in
+CONSTRUCTORS. `params.<name>` is a workload parameter, bound at execution time
+(see workloads.py for the @param declarations).
+"""
+import json
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import Decimal128, ObjectId
+
+TOKEN_PATTERN = re.compile(r"""
+    (?P<skip>\s+|//[^\n]*|/\*.*?\*/)
+  | (?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+  | (?P<number>-?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<name>[A-Za-z_$][\w$]*)
+  | (?P<punct>[{}\[\](),:;.])
+""", re.VERBOSE | re.DOTALL)
+
+CONSTRUCTORS = {
+    'ISODate': lambda value: datetime.fromisoformat(value.replace('Z', '+00:00')),
+    'Date': lambda value: datetime.fromisoformat(value.replace('Z', '+00:00')),
+    'ObjectId': ObjectId,
+    'NumberInt': int,
+    'NumberLong': int,
+    'NumberDecimal': lambda value: Decimal128(str(value)),
+}
+LITERALS = {'true': True, 'false': False, 'null': None}
+# Cursor methods chained to find(), and the find options they set.
+CURSOR_METHODS = {'sort': 'sort', 'limit': 'limit', 'skip': 'skip', 'hint': 'hint', 'project': 'projection'}
+IGNORED_METHODS = {'toArray', 'pretty'}
+
+
+@dataclass(frozen=True)
+class Param:
+    """A `params.<name>` reference, replaced by the parameter value at execution time."""
+    name: str
+
+
+@dataclass
+class MongoQuery:
+    collection: str
+    operation: str                                  # 'aggregate' or 'find'
+    pipeline: List[Dict] = field(default_factory=list)
+    filter: Dict = field(default_factory=dict)
+    options: Dict[str, Any] = field(default_factory=dict)
+    # createIndex calls of the file: (collection, keys, options)
+    indexes: List[Tuple[str, Dict, Dict]] = field(default_factory=list)
+
+    @property
+    def parameters(self) -> set:
+        return _params([self.pipeline, self.filter, self.options])
+
+    def bind(self, params: Optional[Dict[str, Any]] = None) -> 'MongoQuery':
+        """A copy with the `params.<name>` references replaced by the values of `params`"""
+        params = params or {}
+        missing = self.parameters - params.keys()
+        if missing:
+            raise KeyError(f"Missing query parameters {sorted(missing)}")
+        return MongoQuery(self.collection, self.operation, _bind(self.pipeline, params), _bind(self.filter, params),
+                          _bind(self.options, params), self.indexes)
+
+
+def _params(value) -> set:
+    if isinstance(value, Param):
+        return {value.name}
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        return set().union(*map(_params, value)) if value else set()
+    return set()
+
+
+def _bind(value, params: Dict[str, Any]):
+    if isinstance(value, Param):
+        return params[value.name]
+    if isinstance(value, dict):
+        return {key: _bind(item, params) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_bind(item, params) for item in value]
+    return value
+
+
+# ------------------------------------------------------------------------------
+# PARSER
+# ------------------------------------------------------------------------------
+class _Parser:
+    def __init__(self, text: str, source: str):
+        self.source = source
+        self.text = text
+        self.tokens: List[Tuple[str, str, int]] = []
+        position = 0
+        while position < len(text):
+            match = TOKEN_PATTERN.match(text, position)
+            if not match:
+                raise self.error(f"unexpected character {text[position]!r}", position)
+            if match.lastgroup != 'skip':
+                self.tokens.append((match.lastgroup, match.group(), position))
+            position = match.end()
+        self.index = 0
+
+    def error(self, message: str, position: Optional[int] = None) -> ValueError:
+        if position is None:
+            position = self.tokens[self.index][2] if self.index < len(self.tokens) else len(self.text)
+        line = self.text.count('\n', 0, position) + 1
+        return ValueError(f"{self.source}, line {line}: {message}")
+
+    def peek(self, value: Optional[str] = None) -> bool:
+        return self.index < len(self.tokens) and (value is None or self.tokens[self.index][1] == value)
+
+    def next(self, kind: Optional[str] = None) -> str:
+        if not self.peek():
+            raise self.error("unexpected end of file")
+        token_kind, value, _ = self.tokens[self.index]
+        if kind is not None and token_kind != kind:
+            raise self.error(f"expected a {kind}, got {value!r}")
+        self.index += 1
+        return value
+
+    def expect(self, value: str):
+        if not self.peek(value):
+            raise self.error(f"expected {value!r}, got {self.tokens[self.index][1]!r}" if self.peek()
+                             else f"expected {value!r}")
+        self.index += 1
+
+    # Values
+    def value(self) -> Any:
+        if not self.peek():
+            raise self.error("unexpected end of file")
+        kind, token, _ = self.tokens[self.index]
+        if token == '{':
+            return self.object()
+        if token == '[':
+            return self.array()
+        if kind == 'string':
+            return self.string()
+        if kind == 'number':
+            self.index += 1
+            return float(token) if re.search(r'[.eE]', token) else int(token)
+        if kind == 'name':
+            self.index += 1
+            if token in LITERALS:
+                return LITERALS[token]
+            if token == 'params':
+                self.expect('.')
+                return Param(self.next('name'))
+            if token == 'new':
+                token = self.next('name')
+            if token in CONSTRUCTORS:
+                self.expect('(')
+                arguments = self.arguments()
+                try:
+                    return CONSTRUCTORS[token](*arguments)
+                except (TypeError, ValueError) as e:
+                    raise self.error(f"invalid {token}(): {e}")
+        raise self.error(f"unsupported value {token!r}")
+
+    def string(self) -> str:
+        token = self.next('string')
+        if token[0] == "'":
+            token = '"' + token[1:-1].replace("\\'", "'").replace('"', '\\"') + '"'
+        return json.loads(token)
+
+    def object(self) -> Dict:
+        self.expect('{')
+        result = {}
+        while not self.peek('}'):
+            kind = self.tokens[self.index][0] if self.peek() else None
+            key = self.string() if kind == 'string' else self.next()
+            if kind not in ('string', 'name', 'number'):
+                raise self.error(f"invalid key {key!r}")
+            self.expect(':')
+            result[key] = self.value()
+            if not self.peek('}'):
+                self.expect(',')
+        self.expect('}')
+        return result
+
+    def array(self) -> List:
+        self.expect('[')
+        result = []
+        while not self.peek(']'):
+            result.append(self.value())
+            if not self.peek(']'):
+                self.expect(',')
+        self.expect(']')
+        return result
+
+    def arguments(self) -> List:
+        """The arguments of a call, after its opening parenthesis"""
+        result = []
+        while not self.peek(')'):
+            result.append(self.value())
+            if not self.peek(')'):
+                self.expect(',')
+        self.expect(')')
+        return result
+
+    # Statements
+    def collection(self) -> str:
+        if self.next('name') != 'db':
+            raise self.error("statements must start with db", self.tokens[self.index - 1][2])
+        if self.peek('['):
+            self.expect('[')
+            name = self.string()
+            self.expect(']')
+            return name
+        self.expect('.')
+        name = self.next('name')
+        if name == 'getCollection':
+            self.expect('(')
+            name = self.string()
+            self.expect(')')
+        return name
+
+    def statements(self) -> List[Tuple[int, str, List[Tuple[str, List]]]]:
+        """(position, collection, [(method, arguments), ...]) of every statement"""
+        statements = []
+        while self.peek():
+            if self.peek(';'):
+                self.index += 1
+                continue
+            position = self.tokens[self.index][2]
+            collection, calls = self.collection(), []
+            while self.peek('.'):
+                self.expect('.')
+                method = self.next('name')
+                self.expect('(')
+                calls.append((method, self.arguments()))
+            if not calls:
+                raise self.error(f"db.{collection} is not a call")
+            statements.append((position, collection, calls))
+        return statements
+
+
+def parse(text: str, source: str = '<query>') -> MongoQuery:
+    """The query of a mongosh file, with its createIndex calls"""
+    parser = _Parser(text, source)
+    indexes, queries = [], []
+    for position, collection, calls in parser.statements():
+        (method, arguments), chain = calls[0], calls[1:]
+        if method == 'createIndex' and not chain:
+            keys, options = (arguments + [{}])[:2]
+            indexes.append((collection, keys, options))
+        elif method == 'aggregate' and all(name in IGNORED_METHODS for name, _ in chain):
+            pipeline, options = (arguments + [{}])[:2]
+            if not isinstance(pipeline, list):
+                raise parser.error("aggregate() takes a pipeline array", position)
+            queries.append(MongoQuery(collection, 'aggregate', pipeline=pipeline, options=options))
+        elif method == 'find':
+            query_filter, projection = (arguments + [{}])[0], (arguments + [None, None])[1]
+            options = {} if projection is None else {'projection': projection}
+            for name, (value, *_) in [(name, arguments or [None]) for name, arguments in chain]:
+                if name in CURSOR_METHODS:
+                    options[CURSOR_METHODS[name]] = value
+                elif name not in IGNORED_METHODS:
+                    raise parser.error(f"unsupported cursor method {name}()", position)
+            queries.append(MongoQuery(collection, 'find', filter=query_filter, options=options))
+        else:
+            raise parser.error(f"unsupported statement db.{collection}.{method}()", position)
+    if len(queries) != 1:
+        raise parser.error(f"expected one aggregate() or find() statement, found {len(queries)}", 0)
+    queries[0].indexes = indexes
+    return queries[0]
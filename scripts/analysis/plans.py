@@ -0,0 +1,191 @@
+"""Query plans: one profiled run per query and backend, reduced to comparable metrics.
+
+The designated run (after the timed ones, with the first parameter sample) is
+    - PostgreSQL: EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)
+    - MongoDB: the explain command with executionStats verbosity
+    - Neo4j: PROFILE
+and its plan is reduced to the metrics of PLAN_METRICS (None where a backend
+has no such counter):
+
+    rows_scanned     rows read by the scan nodes (PSQL: including the ones
+                     removed by a filter; Neo4j: rows of the scan operators)
+    rows_returned    rows of the plan root (Mongo: nReturned)
+    buffer_hits      shared-buffer hits (PSQL), page-cache hits (Neo4j)
+    buffer_reads     shared-buffer reads (PSQL), page-cache misses (Neo4j)
+    docs_examined    documents examined (Mongo, $lookup sub-pipelines included)
+    keys_examined    index keys examined (Mongo)
+    db_hits          storage hits of all the operators (Neo4j)
+
+Full scans of more than LARGE_SCAN_ROWS rows (Seq Scan, COLLSCAN, AllNodesScan
+and NodeByLabelScan) are flagged. The plan id hashes the shape of the plan (its
+node types and the relations and indexes they read), so comparing two saved
+runs tells a plan flip from an I/O change.
+"""
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+from tabulate import tabulate
+
+logger = logging.getLogger(__name__)
+
+PLAN_METRICS = ['rows_scanned', 'rows_returned', 'buffer_hits', 'buffer_reads',
+                'docs_examined', 'keys_examined', 'db_hits']
+LARGE_SCAN_ROWS = 100_000
+NEO4J_FULL_SCANS = {'AllNodesScan', 'NodeByLabelScan'}
+
+
+def _plan_id(shape: Any) -> str:
+    return hashlib.sha1(json.dumps(shape, default=str).encode()).hexdigest()[:10]
+
+
+def _metrics(shape: Any, full_scans: List[str], **metrics) -> Dict[str, Any]:
+    return {**dict.fromkeys(PLAN_METRICS), **metrics, 'plan_id': _plan_id(shape), 'full_scans': full_scans}
+
+
+# ------------------------------------------------------------------------------
+# POSTGRESQL
+# ------------------------------------------------------------------------------
+def _pg_nodes(node: Dict) -> Iterator[Dict]:
+    yield node
+    for child in node.get('Plans', []):
+        yield from _pg_nodes(child)
+
+
+def _pg_shape(node: Dict) -> list:
+    return [node['Node Type'], node.get('Relation Name'), node.get('Index Name'),
+            [_pg_shape(child) for child in node.get('Plans', [])]]
+
+
+def pg_metrics(explain: List[Dict]) -> Dict[str, Any]:
+    """Metrics of an EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) result"""
+    root = explain[0]['Plan']
+    rows_scanned, full_scans = 0, []
+    for node in _pg_nodes(root):
+        if not node['Node Type'].endswith('Scan') or 'Relation Name' not in node:
+            continue
+        loops = node.get('Actual Loops', 1)
+        scanned = (node.get('Actual Rows', 0) + node.get('Rows Removed by Filter', 0)) * loops
+        rows_scanned += scanned
+        if node['Node Type'] == 'Seq Scan' and scanned >= LARGE_SCAN_ROWS:
+            full_scans.append(f"Seq Scan on {node.get('Schema', '')}.{node['Relation Name']} ({scanned:,} rows)"
+                              .replace(' on .', ' on '))
+    # The buffer counters of a node include its children's.
+    return _metrics(_pg_shape(root), full_scans, rows_scanned=rows_scanned,
+                    rows_returned=root.get('Actual Rows', 0) * root.get('Actual Loops', 1),
+                    buffer_hits=root.get('Shared Hit Blocks'), buffer_reads=root.get('Shared Read Blocks'))
+
+
+# ------------------------------------------------------------------------------
+# MONGODB
+# ------------------------------------------------------------------------------
+def _mongo_stages(document: Any) -> Iterator[Dict]:
+    """Every sub-document of an explain output"""
+    if isinstance(document, dict):
+        yield document
+        document = list(document.values())
+    if isinstance(document, list):
+        for item in document:
+            yield from _mongo_stages(item)
+
+
+def _mongo_shape(document: Any) -> Any:
+    if isinstance(document, dict):
+        return [document.get('stage'), document.get('indexName'),
+                [_mongo_shape(value) for key, value in document.items()
+                 if key in ('inputStage', 'inputStages', 'winningPlan', 'queryPlan', 'queryPlanner', '$cursor')
+                 or key.startswith('$')]]
+    if isinstance(document, list):
+        return [_mongo_shape(item) for item in document]
+    return None
+
+
+def mongo_metrics(explain: Dict) -> Dict[str, Any]:
+    """Metrics of an explain command run with executionStats verbosity, for a find or an aggregate"""
+    docs_examined = keys_examined = 0
+    full_scans = []
+    # An aggregate reports the documents returned by each of its stages, a find by its root only.
+    returned = explain['stages'][-1].get('nReturned') if explain.get('stages') \
+        else explain.get('executionStats', {}).get('nReturned')
+    for stage in _mongo_stages(explain):
+        stats = stage.get('executionStats')
+        if isinstance(stats, dict):
+            docs_examined += stats.get('totalDocsExamined', 0)
+            keys_examined += stats.get('totalKeysExamined', 0)
+        # $lookup stages report their sub-pipeline totals next to the stage.
+        if '$lookup' in stage and 'totalDocsExamined' in stage:
+            docs_examined += stage['totalDocsExamined']
+            keys_examined += stage.get('totalKeysExamined', 0)
+            if stage.get('collectionScans') and stage['totalDocsExamined'] >= LARGE_SCAN_ROWS:
+                full_scans.append(f"COLLSCAN in $lookup from {stage['$lookup'].get('from')} "
+                                  f"({stage['totalDocsExamined']:,} docs)")
+        if stage.get('stage') == 'COLLSCAN' and stage.get('docsExamined', 0) >= LARGE_SCAN_ROWS:
+            full_scans.append(f"COLLSCAN ({stage['docsExamined']:,} docs)")
+    planner = next((stage['queryPlanner'] for stage in _mongo_stages(explain) if 'queryPlanner' in stage), {})
+    namespace = planner.get('namespace')
+    if namespace:
+        full_scans = [scan.replace('COLLSCAN (', f"COLLSCAN on {namespace} (", 1) for scan in full_scans]
+    return _metrics(_mongo_shape(explain.get('stages', planner)), full_scans, rows_returned=returned,
+                    docs_examined=docs_examined, keys_examined=keys_examined)
+
+
+# ------------------------------------------------------------------------------
+# NEO4J
+# ------------------------------------------------------------------------------
+def _operator(node: Dict) -> str:
+    return node.get('operatorType', '').split('@')[0]
+
+
+def _neo4j_nodes(node: Dict) -> Iterator[Dict]:
+    yield node
+    for child in node.get('children', []):
+        yield from _neo4j_nodes(child)
+
+
+def _neo4j_shape(node: Dict) -> list:
+    return [_operator(node), node.get('args', {}).get('Details'),
+            [_neo4j_shape(child) for child in node.get('children', [])]]
+
+
+def neo4j_metrics(profile: Dict) -> Dict[str, Any]:
+    """Metrics of the profile of a PROFILE query (the driver's ResultSummary.profile)"""
+    nodes = list(_neo4j_nodes(profile))
+    full_scans = [f"{_operator(node)} {node.get('args', {}).get('Details', '')} ({node.get('rows', 0):,} rows)"
+                  for node in nodes if _operator(node) in NEO4J_FULL_SCANS and node.get('rows', 0) >= LARGE_SCAN_ROWS]
+    return _metrics(_neo4j_shape(profile), full_scans,
+                    rows_scanned=sum(node.get('rows', 0) for node in nodes if 'Scan' in _operator(node)),
+                    rows_returned=profile.get('rows'), db_hits=sum(node.get('dbHits', 0) for node in nodes),
+                    buffer_hits=sum(node.get('pageCacheHits', 0) for node in nodes),
+                    buffer_reads=sum(node.get('pageCacheMisses', 0) for node in nodes))
+
+
+METRICS = {'postgres': pg_metrics, 'mongo': mongo_metrics, 'neo4j': neo4j_metrics}
+
+
+# ------------------------------------------------------------------------------
+# REPORT
+# ------------------------------------------------------------------------------
+def report(plans: Dict[Tuple[str, str], Dict[str, Any]]) -> str:
+    rows = [[database, query, metrics['plan_id'],
+             *('-' if metrics[key] is None else f"{metrics[key]:,}" for key in PLAN_METRICS),
+             '\n'.join(metrics['full_scans'])]
+            for (database, query), metrics in plans.items()]
+    return tabulate(rows, headers=['Database', 'Query', 'plan', *PLAN_METRICS, 'full scans'], tablefmt='pretty')
+
+
+def plans_path(results_path: Path) -> Path:
+    """The plans file saved next to a results file: <run>.json -> <run>.plans.json"""
+    results_path = Path(results_path)
+    return results_path.with_name(f"{results_path.stem}.plans.json")
+
+
+def save_plans(raw: Dict[Tuple[str, str], Any], results_path: Path) -> Path:
+    path = plans_path(results_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps([{'database': database, 'query': query, 'plan': plan}
+                                for (database, query), plan in raw.items()], indent=2, default=str),
+                    encoding='utf-8')
+    logger.info("Query plans saved to %s", path)
+    return path
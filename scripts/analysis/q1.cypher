@@ -1,5 +1,7 @@
+// @param campaign_id campaigns_by_message_count
+// @incomparable purchased products per user of one campaign, not the campaign leaderboard of q1.sql
 // Path analysis: Campaign → Message → Client → Purchase <button class="citation-flag" data-index="10">
-MATCH (c:Campaign {campaign_id: 57})<-[:BELONGS_TO]-(m:Message)-[:SENT_TO]->(cl:Client)<-[:OWNS]-(u:User)
+MATCH (c:Campaign {campaign_id: $campaign_id})<-[:BELONGS_TO]-(m:Message)-[:SENT_TO]->(cl:Client)<-[:OWNS]-(u:User)
 MATCH (u)-[iw:INTERACTED_WITH {event_type: 'purchase'}]->(p:Product)
 WHERE iw.event_time > m.sent_at
 RETURN u.user_id, COUNT(DISTINCT p) AS purchased_products
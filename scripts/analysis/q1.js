@@ -1,3 +1,4 @@
+// @incomparable counts only the purchasing clients with a purchasing friend, without the interaction window of q1.sql
 db.messages.aggregate([
   {
     $match: {
@@ -50,5 +50,5 @@ LEFT JOIN CampaignInteractions ci ON ms.client_id = ci.client_id AND m.campaign_
 LEFT JOIN PurchasingUsers pu ON SUBSTRING(ms.client_id::varchar(19), 10, 9)::int = pu.user_id AND m.campaign_id = pu.campaign_id
 LEFT JOIN FriendPurchases fp ON pu.user_id = fp.friend_user_id AND pu.campaign_id = fp.campaign_id
 GROUP BY c.id, c.campaign_type
-ORDER BY conversion_rate  DESC
+ORDER BY conversion_rate DESC, c.id, c.campaign_type
 LIMIT 10;
\ No newline at end of file
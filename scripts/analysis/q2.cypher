@@ -1,4 +1,10 @@
-MATCH (u:User {user_id: 123})-[:FRIENDSHIP]-(friend:User)-[:INTERACTED_WITH]->(p:Product)
-RETURN p.product_pk, p.brand, COUNT(*) AS friend_interest
-ORDER BY friend_interest DESC
+// @param user_id users_by_friend_count
+// q2.sql: top products among the friends of a user. The import stores every value as a string, and the
+// purchase events as relationships from the product to the user.
+MATCH (:user {user_id: toString($user_id)})-[:FRIENDSHIP]-(friend:user)<-[e]-(p:product)
+WHERE e.event_type = 'purchase'
+WITH p, count(e) AS popularity_score
+RETURN toInteger(p.product_id) AS product_id, toInteger(p.category_id) AS category_id, p.brand AS brand,
+       popularity_score
+ORDER BY popularity_score DESC, product_id, category_id, coalesce(brand, '')
 LIMIT 10;
\ No newline at end of file
@@ -1,26 +1,41 @@
-db.getCollection('events').aggregate([
+// @param user_id users_by_friend_count
+// q2.sql: top products among the friends of a user (friendships are stored once, in either member's field)
+db.friends.createIndex({ friend2: 1 });
+db.events.createIndex({ user_id: 1, event_type: 1 });
+db.getCollection('friends').aggregate([
+    { $match: { $or: [{ friend1: params.user_id }, { friend2: params.user_id }] } },
+    { $project: { _id: 0, friend: { $cond: [{ $eq: ["$friend1", params.user_id] }, "$friend2", "$friend1"] } } },
     {
-        $match: {
-            user_id: 123,
-            event_type: 'view',
-            user_session: "abc-123"
+        $lookup: {
+            from: "events",
+            localField: "friend",
+            foreignField: "user_id",
+            pipeline: [{ $match: { event_type: "purchase" } }],
+            as: "purchases"
         }
     },
+    { $unwind: "$purchases" },
+    { $group: { _id: "$purchases.product_pk", popularity_score: { $sum: 1 } } },
     {
         $lookup: {
             from: "products",
-            localField: "product_pk",
+            localField: "_id",
             foreignField: "product_pk",
-            as: "product_details"
+            as: "product"
         }
     },
-    { $unwind: "$product_details" },
+    { $unwind: "$product" },
     {
-        $group: {
-            _id: "$product_details.product_id",
-            brand: { $first: "$product_details.brand" },
-            views: { $sum: 1 }
+        $project: {
+            _id: 0,
+            product_id: "$product.product_id",
+            category_id: "$product.category_id",
+            brand: { $ifNull: ["$product.brand", null] },
+            popularity_score: "$popularity_score",
+            brand_order: { $ifNull: ["$product.brand", ""] }
         }
     },
-    { $sort: { views: -1 } }
+    { $sort: { popularity_score: -1, product_id: 1, category_id: 1, brand_order: 1 } },
+    { $limit: 10 },
+    { $project: { brand_order: 0 } }
 ]);
\ No newline at end of file
@@ -1,12 +1,21 @@
-SELECT 
-    e.product_card_pk,
-    p.brand,
+-- @param user_id users_by_friend_count
+-- Top products among the friends of a user: a friendship is stored once, with friend1 < friend2.
+-- Products are identified by (product_id, category_id, brand), as on every backend, ties broken in that order.
+WITH user_friends AS (
+    SELECT friend2 AS friend FROM e_commerce.friends WHERE friend1 = %(user_id)s
+    UNION ALL
+    SELECT friend1 FROM e_commerce.friends WHERE friend2 = %(user_id)s
+)
+SELECT
+    p.product_id,
+    p.category_id,
+    pc.brand,
     COUNT(*) AS popularity_score
-FROM e_commerce.events e
-JOIN e_commerce.product_cards p ON e.product_card_pk = p.product_card_pk
-JOIN e_commerce.friends f ON e.user_id = f.friend2
-WHERE f.friend1 = 123
-    AND e.event_type = 'purchase'
-GROUP BY e.product_card_pk, p.brand
-ORDER BY popularity_score DESC
+FROM user_friends f
+JOIN e_commerce.events e ON e.user_id = f.friend
+JOIN e_commerce.product_cards pc ON e.product_card_pk = pc.product_card_pk
+JOIN e_commerce.products p ON pc.product_pk = p.product_pk
+WHERE e.event_type = 'purchase'
+GROUP BY pc.product_card_pk, p.product_id, p.category_id, pc.brand
+ORDER BY popularity_score DESC, p.product_id, p.category_id, COALESCE(pc.brand, '')
 LIMIT 10;
\ No newline at end of file
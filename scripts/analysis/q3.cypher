@@ -1,3 +1,5 @@
-CALL db.index.fulltext.queryNodes("categoryIndex", "electronics.smartphone") YIELD node, score
+// @param term category_codes
+// @incomparable the Lucene fulltext index tokenizes, matches and scores differently from to_tsquery
+CALL db.index.fulltext.queryNodes("categoryIndex", $term) YIELD node, score
 RETURN node.product_pk, node.brand, score
 ORDER BY score DESC;
\ No newline at end of file
@@ -1,5 +1,7 @@
+// @param term category_codes
+// @incomparable $text tokenizes, matches and scores differently from to_tsquery
 db.products.createIndex({ category_code: "text" });
 db.getCollection('products').find(
-    { $text: { $search: "electronics.smartphone" } },
+    { $text: { $search: params.term } },
     { score: { $meta: "textScore" } }
 ).sort({ score: { $meta: "textScore" } });
\ No newline at end of file
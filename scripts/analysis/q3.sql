@@ -1,3 +1,5 @@
-SELECT product_id, brand, category_code
-FROM e_commerce.products
-WHERE to_tsvector(category_code) @@ to_tsquery('electronics.smartphone');
\ No newline at end of file
+-- @param term category_codes
+SELECT p.product_id, pc.brand, p.category_code
+FROM e_commerce.products p
+JOIN e_commerce.product_cards pc ON pc.product_pk = p.product_pk
+WHERE to_tsvector('english', p.category_code) @@ to_tsquery('english', %(term)s);
\ No newline at end of file
@@ -0,0 +1,9 @@
+// Campaign conversion leaderboard: the rollup properties of the campaign nodes (q1, precomputed by clean_data.py
+// and set by campaign_conversions_neo4j.cypher), read from the campaign_conversion_rate_index
+MATCH (c:campaign)
+WHERE c.conversion_rate IS NOT NULL
+RETURN toInteger(c.id) AS campaign_id, c.campaign_type AS campaign_type, c.total_messages AS total_messages,
+       c.clients_with_interaction AS clients_with_interaction, c.users_purchased AS users_purchased,
+       c.friends_who_also_purchased AS friends_who_also_purchased, c.conversion_rate AS conversion_rate
+ORDER BY conversion_rate DESC, campaign_id, campaign_type
+LIMIT 10;
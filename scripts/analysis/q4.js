@@ -0,0 +1,9 @@
+// Campaign conversion leaderboard: the top of the campaign_conversions rollup (q1, precomputed by clean_data.py)
+db.campaign_conversions.createIndex({ conversion_rate: -1, campaign_id: 1, campaign_type: 1 });
+db.campaign_conversions.find(
+    {},
+    {
+        _id: 0, campaign_id: 1, campaign_type: 1, total_messages: 1, clients_with_interaction: 1,
+        users_purchased: 1, friends_who_also_purchased: 1, conversion_rate: 1
+    }
+).sort({ conversion_rate: -1, campaign_id: 1, campaign_type: 1 }).limit(10);
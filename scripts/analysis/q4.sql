@@ -0,0 +1,7 @@
+-- Campaign conversion leaderboard: the top of the campaign_conversions rollup (q1, precomputed by clean_data.py),
+-- read from its conversion_rate index
+SELECT campaign_id, campaign_type, total_messages, clients_with_interaction, users_purchased,
+       friends_who_also_purchased, conversion_rate
+FROM e_commerce.campaign_conversions
+ORDER BY conversion_rate DESC, campaign_id, campaign_type
+LIMIT 10;
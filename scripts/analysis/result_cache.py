@@ -0,0 +1,178 @@
+"""Query result cache: the rows of a workload kept in memory for its next runs with the same parameters.
+
+An entry is keyed on the backend, the query text (whitespace collapsed and the
+final semicolon dropped, so reformatting a query file keeps its entries) and
+the parameter values. The cache holds at most `max_bytes` of results, an
+estimate of their size in memory, and evicts the least recently used entries
+beyond it; a result larger than a quarter of the cache is never kept. An entry
+expires `ttl` seconds after it was stored.
+
+The data only changes when the loaders run, so the entries of a backend are
+also dropped as soon as its load generation changes: the counter per backend
+that the loading scripts bump after each reload (scripts/loading/load_generation.py)
+in GENERATION_PATH. The file is only read again when its modification time
+changes.
+
+The hits and misses are counted per backend and query, and reported next to
+the latencies with and without the cache (`data_analysis.py run --cache`).
+"""
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from tabulate import tabulate
+
+logger = logging.getLogger(__name__)
+
+# Written by scripts/loading/load_generation.py.
+GENERATION_PATH = Path('output/load_generation.json')
+MAX_BYTES = 256 * 1024**2
+TTL = 300.0
+
+
+def normalize_query(text: str) -> str:
+    return re.sub(r'\s+', ' ', text).strip().rstrip(';').rstrip()
+
+
+def _key(backend: str, text: str, params: Optional[Dict]) -> tuple:
+    return backend, normalize_query(text), tuple(sorted((name, repr(value)) for name, value in (params or {}).items()))
+
+
+def size_of(value: Any) -> int:
+    """Estimated bytes of a result: the objects and the containers of its rows, recursively"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(size_of(key) + size_of(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(size_of(item) for item in value)
+    return size
+
+
+@dataclass
+class CacheEntry:
+    rows: List
+    size: int
+    expires: float
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    expired: int = 0        # misses on an entry past its TTL
+    oversized: int = 0      # results too large to keep
+
+    @property
+    def lookups(self) -> int:
+        return self.hits + self.misses
+
+    @property
+    def hit_rate(self) -> Optional[float]:
+        return self.hits / self.lookups if self.lookups else None
+
+
+class ResultCache:
+    """Memory-bounded LRU of query results with a TTL, invalidated per backend by the load generation."""
+
+    def __init__(self, max_bytes: int = MAX_BYTES, ttl: float = TTL, generation_path: Path = GENERATION_PATH):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.generation_path = Path(generation_path)
+        self.size = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stats: Dict[Tuple[str, str], CacheStats] = {}     # (backend, query name) -> counters
+        self._entries: 'OrderedDict[tuple, CacheEntry]' = OrderedDict()
+        self._generations: Dict[str, Any] = {}      # backend -> generation its entries were stored under
+        self._marker: Tuple[Optional[int], Dict[str, Any]] = (None, {})     # (mtime_ns, contents) of the file
+        self._lock = threading.Lock()
+
+    def generation(self, backend: str) -> Any:
+        """The current load generation of a backend (None before its first bump)"""
+        try:
+            mtime = os.stat(self.generation_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime != self._marker[0]:
+            try:
+                self._marker = (mtime, json.loads(self.generation_path.read_text(encoding='utf-8')))
+            except ValueError as e:
+                # Kept at the last generation read; the file is read again at the next lookup.
+                logger.warning("Unreadable load generation file %s: %s", self.generation_path, e)
+        return self._marker[1].get(backend, {}).get('generation')
+
+    def _invalidate(self, backend: str, generation: Any):
+        if self._generations.get(backend, generation) != generation:
+            stale = [key for key in self._entries if key[0] == backend]
+            for key in stale:
+                self.size -= self._entries.pop(key).size
+            self.invalidations += 1
+            logger.info("%s was reloaded (load generation %s): %s cached results dropped",
+                        backend, generation, len(stale))
+        self._generations[backend] = generation
+
+    def get(self, backend: str, name: str, text: str, params: Optional[Dict] = None) -> Optional[List]:
+        """The cached rows of a query, None on a miss"""
+        key = _key(backend, text, params)
+        generation = self.generation(backend)
+        with self._lock:
+            self._invalidate(backend, generation)
+            stats = self.stats.setdefault((backend, name), CacheStats())
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= time.monotonic():
+                self.size -= self._entries.pop(key).size
+                stats.expired += 1
+                entry = None
+            if entry is None:
+                stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            stats.hits += 1
+            return entry.rows
+
+    def put(self, backend: str, name: str, text: str, params: Optional[Dict], rows: List):
+        size = size_of(rows)
+        with self._lock:
+            if size > self.max_bytes / 4:
+                self.stats.setdefault((backend, name), CacheStats()).oversized += 1
+                return
+            key = _key(backend, text, params)
+            if key in self._entries:
+                self.size -= self._entries.pop(key).size
+            self._entries[key] = CacheEntry(rows, size, time.monotonic() + self.ttl)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.size -= self._entries.popitem(last=False)[1].size
+                self.evictions += 1
+
+    def fetch(self, backend: str, name: str, text: str, params: Optional[Dict],
+              run: Callable[[], Tuple[List, float]]) -> Tuple[List, float]:
+        """(rows, seconds) from the cache, else from `run()` (an _execute_* call), whose rows are then stored"""
+        start_time = time.perf_counter()
+        rows = self.get(backend, name, text, params)
+        if rows is not None:
+            return rows, time.perf_counter() - start_time
+        rows, elapsed = run()
+        self.put(backend, name, text, params, rows)
+        return rows, elapsed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def report(self) -> str:
+        rows = [[backend, name, stats.lookups, stats.hits, '-' if stats.hit_rate is None else f"{stats.hit_rate:.1%}",
+                 stats.expired, stats.oversized] for (backend, name), stats in self.stats.items()]
+        return tabulate(rows, headers=['Database', 'Query', 'lookups', 'hits', 'hit rate', 'expired', 'oversized'],
+                        tablefmt='pretty') + \
+            f"\n{len(self._entries)} results cached, {self.size / 1024**2:.1f} of {self.max_bytes / 1024**2:.0f} MB; " \
+            f"{self.evictions} evictions, {self.invalidations} invalidations"
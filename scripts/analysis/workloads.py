@@ -0,0 +1,166 @@
+"""Query workloads: the q{N} files of each backend and the parameters they declare.
+
+The catalog is the set of q{N}.sql (PostgreSQL), q{N}.js (MongoDB, parsed by
+mongosh.py), q{N}.cypher (Neo4j) and q{N}.csr (the in-process friend-graph
+index, the name of one of friend_index.OPERATIONS) files of QUERIES_PATH; a
+query may be missing on some backends. The embedded DuckDB backend
+(columnar.py) runs the q{N}.sql files, or the q{N}.duckdb file of a query
+where its dialect differs.
+
+A query file declares each of its parameters in a comment line, with the
+population its values are drawn from:
+
+    -- @param user_id users_by_friend_count      (q2.sql, as %(user_id)s)
+    // @param user_id users_by_friend_count      (q2.cypher, as $user_id)
+
+The populations (POPULATIONS) are queried from the loaded PSQL tables, with a
+weight per value (e.g. the friend count of a user). Values are drawn with
+probability proportional to their weight from a generator seeded with the
+harness seed and the query name, so a run can be repeated. Every value also
+falls in a bucket ('low', 'mid' or 'high' weight, by terciles of the
+population), and latencies are reported per bucket.
+
+A query file that does not compute the same result as the other files of its
+query (e.g. a full-text search, whose matching and scoring differ from engine
+to engine) says why in an @incomparable line; the result equivalence check
+(equivalence.py) leaves it out of the vote:
+
+    // @incomparable $text matches and scores differently from to_tsquery
+"""
+import logging
+import re
+import zlib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import mongosh
+from mongosh import MongoQuery
+import friend_index
+
+logger = logging.getLogger(__name__)
+
+QUERIES_PATH = Path("scripts/analysis")
+SUFFIXES = {'postgres': 'sql', 'mongo': 'js', 'neo4j': 'cypher', 'csr': 'csr', 'duckdb': 'sql'}
+# Dialect files read instead of the SUFFIXES file of a backend when they exist.
+OVERRIDES = {'duckdb': 'duckdb'}
+BUCKETS = ['low', 'mid', 'high']
+QUERY_FILE_PATTERN = re.compile(r'^q(\d+)\.(?:sql|js|cypher|csr|duckdb)$')
+PARAM_PATTERN = re.compile(r'^\s*(?:--|//)\s*@param\s+(\w+)\s+(\w+)\s*$', re.MULTILINE)
+INCOMPARABLE_PATTERN = re.compile(r'^\s*(?:--|//)\s*@incomparable\s+(.+?)\s*$', re.MULTILINE)
+
+# Population -> PSQL query returning (value, weight) rows.
+POPULATIONS = {
+    'users_by_friend_count': """
+        SELECT user_id, count(*) FROM (
+            SELECT friend1 AS user_id FROM e_commerce.friends
+            UNION ALL SELECT friend2 FROM e_commerce.friends
+        ) f GROUP BY user_id""",
+    'users_by_event_count': """
+        SELECT user_id, count(*) FROM e_commerce.events GROUP BY user_id""",
+    'campaigns_by_message_count': """
+        SELECT m.campaign_id, count(*) FROM e_commerce.message_sent ms
+        JOIN e_commerce.messages m ON ms.id = m.id GROUP BY m.campaign_id""",
+    'category_codes': """
+        SELECT category_code, count(*) FROM e_commerce.products
+        WHERE category_code IS NOT NULL GROUP BY category_code""",
+}
+
+
+@dataclass
+class Workload:
+    database: str
+    query: str
+    text: str
+    parameters: Dict[str, str] = field(default_factory=dict)   # parameter -> population
+    mongo: Optional[MongoQuery] = None                          # the parsed q{N}.js statement
+    operation: Optional[str] = None                             # the friend_index operation of a q{N}.csr file
+    incomparable: Optional[str] = None                          # why its result differs from the other backends'
+
+
+def read_workload(database: str, query: str, path: Path) -> Workload:
+    text = path.read_text(encoding='utf-8')
+    parameters = dict(PARAM_PATTERN.findall(text))
+    unknown = set(parameters.values()) - POPULATIONS.keys()
+    if unknown:
+        raise ValueError(f"{path}: unknown parameter populations {sorted(unknown)}")
+    incomparable = INCOMPARABLE_PATTERN.search(text)
+    workload = Workload(database, query, text, parameters, incomparable=incomparable and incomparable.group(1))
+    if database == 'mongo':
+        workload.mongo = mongosh.parse(text, str(path))
+        undeclared = workload.mongo.parameters - parameters.keys()
+        if undeclared:
+            raise ValueError(f"{path}: parameters {sorted(undeclared)} used without an @param declaration")
+    if database == 'csr':
+        workload.operation = re.sub(r'^\s*//.*$', '', text, flags=re.MULTILINE).strip()
+        if workload.operation not in friend_index.OPERATIONS:
+            raise ValueError(f"{path}: unknown friend graph operation {workload.operation!r}, "
+                             f"expected one of {friend_index.OPERATIONS}")
+    return workload
+
+
+def discover_queries() -> List[str]:
+    """The q{N} names of the catalog, in query number order"""
+    numbers = {int(match.group(1)) for path in QUERIES_PATH.iterdir()
+               if (match := QUERY_FILE_PATTERN.match(path.name))}
+    return [f"q{number}" for number in sorted(numbers)]
+
+
+def query_path(database: str, query: str) -> Path:
+    """The file of a query on a backend: its dialect override if there is one"""
+    if database in OVERRIDES and (QUERIES_PATH / f"{query}.{OVERRIDES[database]}").exists():
+        return QUERIES_PATH / f"{query}.{OVERRIDES[database]}"
+    return QUERIES_PATH / f"{query}.{SUFFIXES[database]}"
+
+
+def find_workloads(queries: List[str], databases: List[str]) -> List[Workload]:
+    return [read_workload(database, query, query_path(database, query))
+            for database in databases for query in queries if query_path(database, query).exists()]
+
+
+class ParameterSampler:
+    """Seeded, weighted draws of workload parameters from the populations of the loaded data."""
+
+    def __init__(self, fetch: Callable[[str], List[tuple]], seed: int = 42):
+        self.fetch = fetch
+        self.seed = seed
+        self.populations: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+
+    def prefetch(self, workloads: List[Workload]):
+        """Query the populations of `workloads` now, e.g. before the backends run in parallel"""
+        for workload in workloads:
+            for population in workload.parameters.values():
+                self.population(population)
+
+    def population(self, name: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Values, draw probabilities and bucket indexes of a population."""
+        if name not in self.populations:
+            rows = self.fetch(POPULATIONS[name])
+            if not rows:
+                raise ValueError(f"Parameter population {name} is empty; load the PSQL tables first")
+            values = np.array([row[0] for row in rows], dtype=object)
+            weights = np.array([row[1] for row in rows], dtype=float)
+            edges = np.quantile(weights, np.linspace(0, 1, len(BUCKETS) + 1)[1:-1])
+            self.populations[name] = (values, weights / weights.sum(), np.searchsorted(edges, weights, 'right'))
+            logger.info("Parameter population %s: %s values, bucket edges %s", name, len(values), edges.tolist())
+        return self.populations[name]
+
+    def draw(self, workload: Workload, n: int) -> List[Tuple[Dict[str, Any], str]]:
+        """`n` parameter sets of a workload and their buckets (the same for every backend of a query)."""
+        if not workload.parameters:
+            return [({}, '')] * n
+        rng = np.random.default_rng([self.seed, zlib.crc32(workload.query.encode())])
+        draws, buckets = {}, []
+        for parameter, population in workload.parameters.items():
+            values, probabilities, bucket = self.population(population)
+            picked = rng.choice(len(values), size=n, p=probabilities)
+            draws[parameter] = [_python(value) for value in values[picked]]
+            buckets.append(bucket[picked])
+        labels = ['/'.join(BUCKETS[b] for b in combination) for combination in zip(*buckets)]
+        return [({parameter: draws[parameter][i] for parameter in draws}, labels[i]) for i in range(n)]
+
+
+def _python(value):
+    return value.item() if isinstance(value, np.generic) else value
@@ -0,0 +1,189 @@
+"""Benchmark the columnar MongoDB document builders against the previous apply-based code.
+
+Builds synthetic campaigns, messages/behaviors and users frames with the dtypes
+produced by clean_data.py, checks that both implementations serialize to
+byte-identical JSON and reports the timings.
+
+    uv run python scripts/loading/bench_mongo_docs.py --messages 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+
+from mongo_docs import build_campaign_docs, group_message_behaviors, build_user_devices
+from transforms import extract_message_behaviors
+
+
+# ------------------------------------------------------------------------------
+# PREVIOUS IMPLEMENTATIONS (reference)
+# ------------------------------------------------------------------------------
+def build_campaign_doc(row):
+    doc = {
+        "id": row["id"],
+        "campaign_type": row["campaign_type"],
+        "channel": row["channel"],
+        "topic": row.get("topic")
+    }
+    if row["campaign_type"] == "bulk":
+        doc["bulk_details"] = {
+            "started_at": row["started_at"],
+            "finished_at": row.get("finished_at"),
+            "total_count": row.get("total_count", None),
+            "warmup_mode": row["warmup_mode"],
+            "hour_limit": row.get("hour_limit", None),
+            "ab_test": row["ab_test"]
+        }
+    if row["campaign_type"] == "trigger":
+        doc["trigger_details"] = {"position": row.get("position", None)}
+    if row["channel"] not in ["sms", "multichannel"]:
+        doc["subject_details"] = {
+            "subject_length": row.get("subject_length", None),
+            "subject_with_personalization": row["subject_with_personalization"],
+            "subject_with_deadline": row["subject_with_deadline"],
+            "subject_with_emoji": row["subject_with_emoji"],
+            "subject_with_bonuses": row["subject_with_bonuses"],
+            "subject_with_discount": row["subject_with_discount"],
+            "subject_with_saleout": row["subject_with_saleout"]
+        }
+    return doc
+
+
+def apply_campaign_docs(campaigns):
+    return campaigns.reset_index().apply(build_campaign_doc, axis=1)
+
+
+def apply_message_behaviors(messages, message_behavior):
+    behavior_grouped = message_behavior.reset_index().groupby('message_id')\
+        [['message_id', 'type','happened_first_time','happened_last_time']].apply(
+        lambda grp: grp[['type', 'happened_first_time', 'happened_last_time']].to_dict('records')
+    ).reset_index(name='behaviors')
+    messages_mongo = messages.reset_index().merge(behavior_grouped, on='message_id', how='left')
+    messages_mongo['behaviors'] = messages_mongo['behaviors'].apply(lambda x: x if isinstance(x, list) else [])
+    return messages_mongo
+
+
+def apply_user_devices(users):
+    grouped = users.groupby('user_id')\
+        [['user_id', 'client_id',
+          'user_device_id', 'first_purchase_date']].apply(
+              lambda x:
+              x[['client_id', 'user_device_id',
+                 'first_purchase_date']].to_dict('records')).reset_index()
+    grouped.columns = ['user_id', 'devices']
+    grouped['devices'] =\
+          grouped['devices'].apply(lambda device_list: [
+              {k: v
+               for k, v in device.items() if pd.notna(v)}
+            for device in device_list])
+    return grouped
+
+
+# ------------------------------------------------------------------------------
+# SYNTHETIC DATA
+# ------------------------------------------------------------------------------
+def _timestamps(rng, n, null_share=0.0):
+    ts = pd.Series(pd.Timestamp('2021-01-01') + pd.to_timedelta(rng.integers(0, 200 * 86400, n), unit='s'))
+    return ts.where(rng.random(n) >= null_share)
+
+
+def make_campaigns(rng, n):
+    flags = lambda: pd.array(rng.random(n) < 0.5, dtype='boolean')
+    campaigns = pd.DataFrame({
+        'id': np.arange(n),
+        'campaign_type': pd.Categorical(rng.choice(['bulk', 'trigger', 'transactional'], n)),
+        'channel': pd.Categorical(rng.choice(['email', 'mobile_push', 'sms', 'multichannel'], n)),
+        'topic': pd.array(rng.choice(['sale out', 'event', None], n), dtype='string'),
+        'started_at': _timestamps(rng, n),
+        'finished_at': _timestamps(rng, n, 0.3),
+        'total_count': pd.array(rng.integers(10, 10000, n), dtype='Int32'),
+        'ab_test': flags(), 'warmup_mode': flags(),
+        'hour_limit': pd.array(np.where(rng.random(n) < 0.5, rng.integers(1, 100, n), None), dtype='Int32'),
+        'subject_length': pd.array(rng.integers(10, 200, n), dtype='Int16'),
+        'position': pd.array(np.where(rng.random(n) < 0.2, None, rng.integers(1, 10, n)), dtype='Int16'),
+    })
+    for col in ['personalization', 'deadline', 'emoji', 'bonuses', 'discount', 'saleout']:
+        campaigns[f'subject_with_{col}'] = flags()
+    campaigns.index.names = ['campaign_pk']
+    return campaigns
+
+
+def make_messages(rng, n):
+    messages = pd.DataFrame({
+        'message_id': pd.array([f'{i:08x}-0000-0000-0000-{i:012x}' for i in rng.permutation(n)], dtype='string'),
+        'campaign_id': rng.integers(0, 1000, n).astype('int32'),
+        'client_id': rng.integers(10**18, 2 * 10**18, n),
+        'sent_at': _timestamps(rng, n),
+    })
+    for behavior, share in [('opened', 0.4), ('clicked', 0.2), ('purchased', 0.05), ('hard_bounced', 0.02)]:
+        messages[f'is_{behavior}'] = rng.random(n) < share
+        if behavior in ('opened', 'clicked'):
+            messages[f'{behavior}_first_time_at'] = _timestamps(rng, n)
+            messages[f'{behavior}_last_time_at'] = _timestamps(rng, n, 0.2)
+        else:
+            messages[f'{behavior}_at'] = _timestamps(rng, n)
+    return messages
+
+
+def make_users(rng, n):
+    users = pd.DataFrame({'user_id': rng.integers(0, n // 2, n).astype('int32')})
+    users['client_id'] = np.where(rng.random(n) < 0.1, np.nan, rng.integers(10**18, 2 * 10**18, n))
+    users['user_device_id'] = np.where(np.isnan(users['client_id']), np.nan, rng.integers(1, 4, n))
+    users['first_purchase_date'] = _timestamps(rng, n, 0.6).dt.normalize()
+    return users
+
+
+# ------------------------------------------------------------------------------
+# BENCHMARK
+# ------------------------------------------------------------------------------
+def timed(func, *args, repeat=1):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--campaigns', type=int, default=10_000)
+    parser.add_argument('--messages', type=int, default=50_000)
+    parser.add_argument('--users', type=int, default=50_000)
+    parser.add_argument('--repeat', type=int, default=3, help="Best of N runs per implementation")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    campaigns = make_campaigns(rng, args.campaigns)
+    messages = make_messages(rng, args.messages)
+    message_behavior = extract_message_behaviors(messages)
+    messages = messages[['message_id', 'campaign_id', 'client_id', 'sent_at']].set_index('message_id')
+    users = make_users(rng, args.users)
+
+    cases = [
+        ('campaigns (bulk/trigger/subject details)', len(campaigns),
+         apply_campaign_docs, build_campaign_docs, (campaigns,)),
+        ('messages.behaviors', len(messages),
+         apply_message_behaviors, group_message_behaviors, (messages, message_behavior)),
+        ('users.devices', len(users),
+         apply_user_devices, build_user_devices, (users,)),
+    ]
+    report = []
+    for name, rows, before, after, inputs in cases:
+        expected, before_time = timed(before, *inputs, repeat=args.repeat)
+        actual, after_time = timed(after, *inputs, repeat=args.repeat)
+        identical = expected.to_json(orient='records', date_format='iso') \
+            == actual.to_json(orient='records', date_format='iso')
+        report.append([name, rows, f"{before_time:.3f}s", f"{after_time:.3f}s",
+                       f"{before_time / after_time:.1f}x", identical])
+    print(tabulate(report, headers=["Builder", "Rows", "apply/groupby", "columnar", "Speedup", "Identical JSON"],
+                   tablefmt="pretty"))
+    if not all(row[-1] for row in report):
+        raise SystemExit("Columnar builders produced different JSON")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Check and benchmark the vectorized representative category_code against the previous per-group mode().
+
+Builds synthetic events with the (product_id, category_id, category_code)
+columns of clean_data.py: groups with tied modes, all-null groups and
+single-row groups, and category codes whose category order is not
+alphabetical. Both representative_values() (clean_data.py) and
+most_frequent() over counts summed chunk by chunk (streaming.py) must give
+the same rows as groupby(...).agg(choose_representative), which is kept
+below as the reference; a difference is an error.
+
+    uv run python scripts/loading/bench_representative.py --events 2000000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+
+from transforms import most_frequent, representative_values
+
+KEYS = ['product_id', 'category_id']
+
+
+# ------------------------------------------------------------------------------
+# PREVIOUS IMPLEMENTATION (reference)
+# ------------------------------------------------------------------------------
+# Function to choose the representative value from category_code within each group.
+def choose_representative(series):
+    non_null = series.dropna()
+    if non_null.empty: return np.nan
+    else:
+        mode_vals = non_null.mode()
+        if not mode_vals.empty:
+            return mode_vals.iloc[0]
+        else:
+            return non_null.iloc[0]
+
+
+def apply_representative(events):
+    return events.groupby(KEYS, as_index=False)['category_code'].agg(choose_representative)
+
+
+def chunked_most_frequent(events, chunks=4):
+    """The streaming.py path: (keys, code) counts summed over chunks, then most_frequent()"""
+    counts, size = None, -(-len(events) // chunks)
+    for start in range(0, len(events), size):
+        chunk = events.iloc[start:start + size]
+        chunk_counts = chunk.groupby(KEYS + ['category_code'], observed=True).size().rename('count')
+        counts = chunk_counts if counts is None else counts.add(chunk_counts, fill_value=0)
+    groups = events[KEYS].drop_duplicates().sort_values(KEYS)
+    return groups.merge(most_frequent(counts.reset_index(), KEYS, 'category_code'), how='left', on=KEYS)
+
+
+# ------------------------------------------------------------------------------
+# SYNTHETIC DATA
+# ------------------------------------------------------------------------------
+def make_events(rng, n):
+    codes = ['electronics.smartphone', 'appliances.kitchen', 'computers.notebook', 'apparel.shoes', 'kids.toys']
+    products = max(n // 8, 4)
+    events = pd.DataFrame({
+        'product_id': rng.integers(0, products, n),
+        'category_id': rng.integers(0, 3, n),
+        # Categories in first-appearance order, as an Arrow dictionary column is read.
+        'category_code': pd.Categorical(rng.choice(codes, n), categories=codes),
+    })
+    events.loc[rng.random(n) < 0.2, 'category_code'] = np.nan
+    # All-null groups.
+    events.loc[events['product_id'] % 17 == 0, 'category_code'] = np.nan
+    # Tied modes: two codes, once each, in the order opposite to the categories.
+    ties = pd.DataFrame({'product_id': np.repeat(np.arange(products, products + n // 20 + 1), 2), 'category_id': 0})
+    ties['category_code'] = pd.Categorical(np.tile([codes[3], codes[1]], len(ties) // 2), categories=codes)
+    # Single-row groups, some null.
+    singles = pd.DataFrame({'product_id': np.arange(2 * products, 2 * products + n // 20 + 1), 'category_id': 1})
+    singles['category_code'] = pd.Categorical(rng.choice(codes + [None], len(singles)), categories=codes)
+    return pd.concat([events, ties, singles], ignore_index=True).sample(frac=1, random_state=0, ignore_index=True)
+
+
+# ------------------------------------------------------------------------------
+# BENCHMARK
+# ------------------------------------------------------------------------------
+def timed(func, *args, repeat=1):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def rows(df):
+    return df[KEYS + ['category_code']].reset_index(drop=True)\
+             .astype({'category_code': object}).to_json(orient='records')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=200_000)
+    parser.add_argument('--repeat', type=int, default=1, help="Best of N runs per implementation")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    events = make_events(np.random.default_rng(args.seed), args.events)
+    expected, before_time = timed(apply_representative, events, repeat=args.repeat)
+    report = []
+    for name, after in [('representative_values', lambda df: representative_values(df, KEYS, 'category_code')),
+                        ('most_frequent (chunked counts)', chunked_most_frequent)]:
+        actual, after_time = timed(after, events, repeat=args.repeat)
+        report.append([name, len(expected), f"{before_time:.3f}s", f"{after_time:.3f}s",
+                       f"{before_time / after_time:.1f}x", rows(expected) == rows(actual)])
+    print(tabulate(report, headers=["Implementation", "Groups", "agg(choose_representative)", "vectorized",
+                                    "Speedup", "Identical rows"], tablefmt="pretty"))
+    if not all(row[-1] for row in report):
+        raise SystemExit("The vectorized representative category_code differs from choose_representative")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,439 @@
+"""Load the MongoDB and Neo4j outputs of clean_data.py from Python, in batches, with parallel workers.
+
+mongo: the documents of every collection (NDJSON shards or one JSON array,
+as import_mongo_shards.py finds them) are inserted with
+`insert_many(ordered=False)` in batches of --batch-size, by --workers threads.
+Duplicate keys are counted and skipped, as by mongoimport. Create the
+collections first with load_data_mongodb.js: on a full load, their secondary
+indexes are dropped before the insertion and built again once the data is in.
+A delta directory (output/delta/<run>/mongo) keeps the indexes and upserts the
+users and campaign_conversions documents it holds (see incremental.py).
+
+neo4j: the node and relationship files of a delta directory
+(output/delta/<run>/neo4j) are written into the running database with
+batched `UNWIND $rows` transactions through the neo4j driver: MERGE of the
+nodes on their key, then CREATE of the relationships between existing nodes.
+Values are stored as strings, as by neo4j-admin. A full load is faster with
+neo4j-admin on the stopped database: for any other directory the import
+scripts are written (neo4j_import.py) and their command is printed.
+
+Both report the rows/s of every collection, label and relationship type, and
+bump the load generation of their backend (see load_generation.py):
+
+    mongosh --file scripts/loading/load_data_mongodb.js
+    uv run python scripts/loading/bulk_load.py mongo --workers 8 --batch-size 5000
+    uv run python scripts/loading/bulk_load.py mongo --input output/delta/00002/mongo
+    uv run python scripts/loading/bulk_load.py neo4j --input output/delta/00002/neo4j
+"""
+import argparse
+import configparser
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field, replace
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+from neo4j import GraphDatabase
+from pymongo import IndexModel, MongoClient, ReplaceOne
+from pymongo.errors import BulkWriteError
+from tabulate import tabulate
+
+import load_generation
+from import_mongo_shards import COLLECTIONS, import_jobs
+from neo4j_import import NODES, RELATIONSHIPS, write_import_scripts
+from paths import DELTA_PATH, MONGO_CLEANED_PATH, NEO4J_CLEANED_PATH
+from psql_copy import CONFIG_PATH
+from writers import neo4j_output
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 5000
+READ_BYTES = 1024 * 1024
+# Documents of a delta directory that replace the loaded ones (incremental.py), by their key.
+UPSERT_KEYS = {'users': ['user_id'], 'campaign_conversions': ['campaign_id', 'campaign_type']}
+# Key property of every label, as in the node key constraints of load_data_neo4j.cypher.
+NODE_KEYS = {'user': 'user_id', 'client': 'client_id', 'campaign': 'campaign_pk',
+             'message': 'message_id', 'product': 'product_pk'}
+# neo4j-admin header: `name`, `name:type`, `name:ID(group)`, `:LABEL`, ...
+HEADER_PATTERN = re.compile(r'^(?P<name>[^:]*)(?::(?P<kind>\w+)(?:\((?P<group>[^)]*)\))?)?$')
+CONVERTERS: Dict[str, Callable[[str], object]] = {
+    'int': int, 'long': int, 'short': int, 'byte': int, 'float': float, 'double': float,
+    'boolean': lambda value: value.lower() == 'true',
+}
+
+
+def is_delta(path: Path) -> bool:
+    """Whether `path` is in a delta directory of incremental.py"""
+    return Path(DELTA_PATH).resolve() in Path(path).resolve().parents
+
+
+def batches(items: Iterable, size: int) -> Iterator[List]:
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+@dataclass
+class Throughput:
+    """Rows of one collection, label or relationship type, and the wall-clock time from its first to its last batch."""
+    rows: int = 0
+    written: int = 0
+    skipped: int = 0
+    batches: int = 0
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, started: float, rows: int, written: int, skipped: int = 0):
+        """Count a batch that started at `started` (perf_counter) and just finished; called by the workers"""
+        with self.lock:
+            self.rows += rows
+            self.written += written
+            self.skipped += skipped
+            self.batches += 1
+            self.started = started if self.started is None else min(self.started, started)
+            self.finished = max(self.finished or 0.0, time.perf_counter())
+
+    @property
+    def seconds(self) -> float:
+        return (self.finished - self.started) if self.started is not None else 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+class BatchPool:
+    """A thread pool that runs at most 2 batches per worker ahead of the reader, so files are never read whole."""
+
+    def __init__(self, workers: int):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(2 * workers)
+        self.futures = []
+
+    def submit(self, function, *args):
+        """Run `function(*args)` on a worker; raises the error of a failed batch instead of reading on"""
+        self.slots.acquire()
+        for future in self.futures:
+            if future.done() and future.exception():
+                self.slots.release()
+                raise future.exception()
+        self.futures = [future for future in self.futures if not future.done()] + \
+                       [self.executor.submit(function, *args)]
+        self.futures[-1].add_done_callback(lambda _: self.slots.release())
+
+    def wait(self):
+        """Wait for every batch; raises the first error of a batch"""
+        try:
+            for future in as_completed(self.futures):
+                future.result()
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+
+
+# ------------------------------------------------------------------------------
+# MONGODB
+# ------------------------------------------------------------------------------
+def iter_json_array(path: Path) -> Iterator[Dict]:
+    """The documents of a JSON array file (ChunkedJsonWriter), decoded one at a time from a buffer"""
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as source:
+        buffer, position, eof = '', 0, False
+        while True:
+            # Skip the separators between documents, reading on when the buffer runs out.
+            while True:
+                while position < len(buffer) and buffer[position] in '[], \t\r\n':
+                    position += 1
+                if position < len(buffer) or eof:
+                    break
+                buffer, position = source.read(READ_BYTES), 0
+                eof = not buffer
+            if position >= len(buffer):
+                return
+            try:
+                document, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # The document continues past the buffer.
+                more = source.read(READ_BYTES)
+                buffer, position, eof = buffer[position:] + more, 0, not more
+                continue
+            yield document
+            position = end
+
+
+def iter_documents(path: Path, json_array: bool) -> Iterator[Dict]:
+    if json_array:
+        yield from iter_json_array(path)
+        return
+    opener = gzip.open if path.suffix == '.gz' else open
+    with opener(path, 'rt', encoding='utf-8') as source:
+        for line in source:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_documents(collection, documents: List[Dict], keys: Optional[List[str]]) -> Tuple[int, int]:
+    """Insert (or upsert on `keys`) a batch, unordered; returns (written, duplicates)"""
+    try:
+        if keys:
+            collection.bulk_write([ReplaceOne({key: document[key] for key in keys}, document, upsert=True)
+                                   for document in documents], ordered=False)
+        else:
+            collection.insert_many(documents, ordered=False)
+        return len(documents), 0
+    except BulkWriteError as error:
+        errors = error.details['writeErrors']
+        duplicates = sum(1 for write_error in errors if write_error['code'] == 11000)
+        if duplicates < len(errors):
+            rejected = next(write_error for write_error in errors if write_error['code'] != 11000)
+            raise RuntimeError(f"{len(errors) - duplicates} documents of {collection.name} rejected, "
+                               f"first: {rejected['errmsg']}") from error
+        return len(documents) - duplicates, duplicates
+
+
+def drop_secondary_indexes(collection) -> List[Dict]:
+    """Drop the indexes of `collection` but _id; returns their specifications"""
+    indexes = [dict(index) for index in collection.list_indexes() if index['name'] != '_id_']
+    for index in indexes:
+        collection.drop_index(index['name'])
+    return indexes
+
+
+def build_indexes(collection, indexes: List[Dict]) -> float:
+    """Create `indexes` (list_indexes specifications) in one createIndexes command; returns its duration"""
+    start = time.perf_counter()
+    if indexes:
+        collection.create_indexes([IndexModel(list(index['key'].items()),
+                                              **{option: value for option, value in index.items()
+                                                 if option not in ('v', 'key', 'ns')})
+                                   for index in indexes])
+    return time.perf_counter() - start
+
+
+def load_mongo(args):
+    incremental = is_delta(args.input)
+    jobs = list(import_jobs(args.input, args.collections))
+    collections = list(dict.fromkeys(collection for collection, _, _ in jobs))
+    client = MongoClient(args.uri, maxPoolSize=args.workers)
+    database = client[args.db]
+    stats = {collection: Throughput() for collection in collections}
+    deferred: Dict[str, List[Dict]] = {}
+    if not incremental and not args.keep_indexes:
+        for collection in collections:
+            deferred[collection] = drop_secondary_indexes(database[collection])
+            if not deferred[collection]:
+                logger.warning("[MONGODB]: %s has no secondary index: was load_data_mongodb.js run?", collection)
+    logger.info("[MONGODB]: Loading %s files into %s (%s) with %s workers, batches of %s",
+                len(jobs), args.db, 'incremental' if incremental else 'full', args.workers, args.batch_size)
+
+    def write(collection: str, documents: List[Dict]):
+        started = time.perf_counter()
+        keys = UPSERT_KEYS.get(collection) if incremental else None
+        written, duplicates = write_documents(database[collection], documents, keys)
+        stats[collection].add(started, len(documents), written, duplicates)
+
+    start = time.perf_counter()
+    pool = BatchPool(args.workers)
+    try:
+        for collection, path, json_array in jobs:
+            for documents in batches(iter_documents(path, json_array), args.batch_size):
+                pool.submit(write, collection, documents)
+            logger.info("[MONGODB]: %s read into %s", path, collection)
+    finally:
+        pool.wait()
+    loaded = time.perf_counter() - start
+
+    # Built once the data is in: one sort per index instead of an update per document.
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        index_times = dict(zip(deferred, executor.map(lambda item: build_indexes(database[item[0]], item[1]),
+                                                      deferred.items())))
+    client.close()
+    total = time.perf_counter() - start
+
+    logger.info("\nMongo load report:\n" +
+                tabulate([[collection, stat.rows, stat.written, stat.skipped, stat.batches, f"{stat.seconds:.2f}s",
+                           f"{stat.rate:,.0f}",
+                           f"{len(deferred[collection])} in {index_times[collection]:.2f}s"
+                           if collection in deferred else "kept"]
+                          for collection, stat in stats.items()],
+                         headers=["Collection", "Documents", "Written", "Duplicates", "Batches", "Load time",
+                                  "Rows/s", "Secondary indexes"],
+                         tablefmt="pretty"))
+    logger.info("Loaded in %.2fs, indexes built in %.2fs (total wall-clock time %.2fs)",
+                loaded, total - loaded, total)
+    load_generation.bump('mongo')
+
+
+# ------------------------------------------------------------------------------
+# NEO4J
+# ------------------------------------------------------------------------------
+def parse_header(columns: List[str]) -> List[Tuple[str, Optional[str], Optional[str]]]:
+    """(property name, kind, id group) of every neo4j-admin header column"""
+    fields = []
+    for column in columns:
+        match = HEADER_PATTERN.match(column)
+        if match is None:
+            raise ValueError(f"Unsupported neo4j-admin header column {column!r}")
+        fields.append((match['name'], match['kind'], match['group']))
+    return fields
+
+
+def iter_csv(files: List[Path], batch_size: int) -> Iterator[Tuple[List[Tuple], pd.DataFrame]]:
+    """(parsed header, chunk of string values) of a table: one CSV, or a header file and gzip parts"""
+    read = dict(dtype=str, keep_default_na=False, chunksize=batch_size)
+    if files[0].name.endswith('.header.csv'):
+        columns = pd.read_csv(files[0], nrows=0).columns.tolist()
+        parts = [(part, dict(header=None, names=columns, compression='gzip')) for part in files[1:]]
+    else:
+        columns = pd.read_csv(files[0], nrows=0).columns.tolist()
+        parts = [(files[0], {})]
+    header = parse_header(columns)
+    for part, options in parts:
+        with pd.read_csv(part, **read, **options) as reader:
+            for chunk in reader:
+                yield header, chunk
+
+
+def properties(header: List[Tuple], values: Tuple) -> Dict:
+    """The properties neo4j-admin would store for a row: its non-empty value columns, typed as in the header"""
+    row = {}
+    for (name, kind, _), value in zip(header, values):
+        if value == '' or not name or kind in ('LABEL', 'TYPE', 'START_ID', 'END_ID', 'IGNORE'):
+            continue
+        row[name] = CONVERTERS[kind](value) if kind in CONVERTERS else value
+    return row
+
+
+def node_batches(files: List[Path], label: str, batch_size: int) -> Iterator[Tuple[str, List[Dict]]]:
+    for header, chunk in iter_csv(files, batch_size):
+        key = next(index for index, (_, kind, _) in enumerate(header) if kind == 'ID')
+        query = (f"UNWIND $rows AS row MERGE (n:`{label}` {{`{header[key][0]}`: row.id}}) SET n += row.properties")
+        yield query, [{'id': values[key], 'properties': properties(header, values)}
+                      for values in chunk.itertuples(index=False, name=None)]
+
+
+def relationship_batches(files: List[Path], rel_type: str, batch_size: int) -> Iterator[Tuple[str, List[Dict]]]:
+    for header, chunk in iter_csv(files, batch_size):
+        kinds = [kind for _, kind, _ in header]
+        start, end = kinds.index('START_ID'), kinds.index('END_ID')
+        start_label, end_label = header[start][2], header[end][2]
+        # As with neo4j-admin, the :TYPE column overrides the type the file is imported as.
+        types = chunk.iloc[:, kinds.index('TYPE')] if 'TYPE' in kinds else pd.Series(rel_type, index=chunk.index)
+        for row_type, rows in chunk.groupby(types.replace('', rel_type), sort=False):
+            query = (f"UNWIND $rows AS row "
+                     f"MATCH (a:`{start_label}` {{`{NODE_KEYS[start_label]}`: row.start}}) "
+                     f"MATCH (b:`{end_label}` {{`{NODE_KEYS[end_label]}`: row.end}}) "
+                     f"CREATE (a)-[r:`{row_type}`]->(b) SET r = row.properties")
+            yield query, [{'start': values[start], 'end': values[end], 'properties': properties(header, values)}
+                          for values in rows.itertuples(index=False, name=None)]
+
+
+def write_rows(driver, database: str, query: str, rows: List[Dict]) -> int:
+    """Run one UNWIND batch in a write transaction (retried on deadlocks); returns the entities created"""
+    with driver.session(database=database) as session:
+        counters = session.execute_write(lambda tx: tx.run(query, rows=rows).consume().counters)
+    return counters.nodes_created + counters.relationships_created
+
+
+def neo4j_auth(args) -> Tuple[str, Tuple[str, str]]:
+    """URI and credentials of the arguments, or of the [neo4j] section of config.ini"""
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    section = config['neo4j'] if config.has_section('neo4j') else {}
+    return (args.uri or section.get('uri', 'bolt://localhost:7687'),
+            (args.user or section.get('user', 'neo4j'), args.password or section.get('password', '')))
+
+
+def load_neo4j(args):
+    output = replace(neo4j_output, directory=args.input)
+    if not is_delta(args.input) and not args.unwind:
+        # A full load: neo4j-admin into the stopped database.
+        write_import_scripts(output)
+        script = output.directory / ('import_neo4j.bat' if os.name == 'nt' else 'import_neo4j.sh')
+        logger.info("[NEO4J]: %s is a full load: stop the database and run %s (neo4j-admin), "
+                    "or pass --unwind to write it into the running database:\n%s",
+                    args.input, script, script.read_text())
+        return
+
+    uri, auth = neo4j_auth(args)
+    driver = GraphDatabase.driver(uri, auth=auth, max_connection_pool_size=args.workers)
+    stats: Dict[Tuple[str, str], Throughput] = {}
+
+    def write(name: Tuple[str, str], query: str, rows: List[Dict]):
+        started = time.perf_counter()
+        stats[name].add(started, len(rows), write_rows(driver, args.database, query, rows))
+
+    start = time.perf_counter()
+    try:
+        # Every node before the relationships that match them.
+        for kind, tables, make_batches in [('nodes', NODES, node_batches),
+                                           ('relationships', RELATIONSHIPS, relationship_batches)]:
+            pool = BatchPool(args.workers)
+            try:
+                for name, file in tables.items():
+                    files = output.files(file)
+                    if not files:
+                        continue
+                    stats[kind, name] = Throughput()
+                    for query, rows in make_batches(files, name, args.batch_size):
+                        pool.submit(write, (kind, name), query, rows)
+                    logger.info("[NEO4J]: %s read (%s %s)", ', '.join(path.name for path in files), kind, name)
+            finally:
+                pool.wait()
+    finally:
+        driver.close()
+    total = time.perf_counter() - start
+
+    logger.info("\nNeo4j load report:\n" +
+                tabulate([[kind, name, stat.rows, stat.written, stat.batches, f"{stat.seconds:.2f}s",
+                           f"{stat.rate:,.0f}"] for (kind, name), stat in stats.items()],
+                         headers=["Kind", "Label / type", "Rows", "Created", "Batches", "Load time", "Rows/s"],
+                         tablefmt="pretty"))
+    logger.info("Total wall-clock time: %.2fs", total)
+    load_generation.bump('neo4j')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='backend', required=True)
+    mongo = subparsers.add_parser('mongo', help="insert_many into MongoDB")
+    mongo.add_argument('--uri', default='mongodb://localhost:27017')
+    mongo.add_argument('--db', default='ecommerce')
+    mongo.add_argument('--input', type=Path, default=MONGO_CLEANED_PATH)
+    mongo.add_argument('--collections', nargs='+', default=COLLECTIONS)
+    mongo.add_argument('--keep-indexes', action='store_true',
+                       help="Insert into the indexed collections on a full load too.")
+    neo4j = subparsers.add_parser('neo4j', help="UNWIND batches into Neo4j (delta directories)")
+    neo4j.add_argument('--uri', help="Default: the [neo4j] section of --config.")
+    neo4j.add_argument('--user')
+    neo4j.add_argument('--password')
+    neo4j.add_argument('--config', type=Path, default=CONFIG_PATH)
+    neo4j.add_argument('--database', default='neo4j')
+    neo4j.add_argument('--input', type=Path, default=NEO4J_CLEANED_PATH)
+    neo4j.add_argument('--unwind', action='store_true',
+                       help="Load a full output directory with UNWIND too, instead of writing the neo4j-admin scripts.")
+    for subparser in (mongo, neo4j):
+        subparser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                               help="Documents or rows per insert_many call or UNWIND transaction.")
+        subparser.add_argument('--workers', type=int, default=os.cpu_count(),
+                               help="Number of batches written at the same time.")
+    args = parser.parse_args()
+    if args.backend == 'mongo':
+        load_mongo(args)
+    else:
+        load_neo4j(args)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
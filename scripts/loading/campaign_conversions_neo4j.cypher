@@ -0,0 +1,15 @@
+// Sets the campaign-conversion rollups of clean_data.py (campaign_conversions.csv, in the import directory)
+// as properties of the campaign nodes, after the import; run it again with the campaign_conversions.csv of an
+// incremental run (output/delta/<run>/neo4j/) to refresh the campaigns it lists:
+//     cat scripts/loading/campaign_conversions_neo4j.cypher | cypher-shell
+LOAD CSV WITH HEADERS FROM 'file:///campaign_conversions.csv' AS row
+MATCH (c:campaign {campaign_pk: row.campaign_pk})
+SET c.total_messages = toInteger(row.total_messages),
+    c.clients_with_interaction = toInteger(row.clients_with_interaction),
+    c.users_purchased = toInteger(row.users_purchased),
+    c.friends_who_also_purchased = toInteger(row.friends_who_also_purchased),
+    c.conversion_rate = toFloat(row.conversion_rate),
+    c.conversions_refreshed_at = localdatetime(replace(row.refreshed_at, ' ', 'T'));
+
+CREATE INDEX campaign_conversion_rate_index IF NOT EXISTS
+FOR (n:campaign) ON (n.conversion_rate);
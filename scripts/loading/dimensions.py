@@ -0,0 +1,147 @@
+"""Sections of the cleaning pipeline that work on the small dimension tables
+(campaigns, clients, users and friends). Both the in-memory and the streaming
+drivers call them once per run."""
+import logging
+
+import numpy as np
+import pandas as pd
+
+from paths import DATASET_PATH, NEO4J_CLEANED_PATH
+from readers import read_campaigns, read_first_purchase, read_friends
+from transforms import (convert_for_neo4J_node, convert_for_neo4J_rels, filter_campaigns,
+                        bulk_cols, subject_cols, trigger_cols)
+from mongo_docs import build_campaign_docs, build_user_devices
+from writers import mongo_output, psql_output
+from telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------------------------
+# PROCESS CAMPAIGNS
+# ------------------------------------------------------------------------------
+@telemetry.track
+def load_campaigns() -> pd.DataFrame:
+    logger.info("Reading campaigns.csv and applying business rules")
+    campaigns = read_campaigns(DATASET_PATH / 'campaigns.csv')
+    campaigns.index.names = ['campaign_pk']
+    logger.info("Campaigns loaded, shape: %s", campaigns.shape)
+
+    logger.info("Filtering campaigns based on business rules")
+    campaigns = filter_campaigns(campaigns)
+    logger.info("Filtered campaigns shape: %s", campaigns.shape)
+    return campaigns
+
+
+@telemetry.track
+def emit_campaigns(campaigns: pd.DataFrame):
+    ################### MONGODB ######################
+    logger.info("[MONGODB]: Preparing campaign documents")
+    campaigns_docs = build_campaign_docs(campaigns)
+    logger.info("[MONGODB]: Prepared %s campaign documents", campaigns_docs.shape[0])
+    with mongo_output.writer('campaigns') as writer:
+        writer.write(campaigns_docs)
+    del(campaigns_docs)
+
+    # Split campaigns into subtype tables.
+    logger.info("[PSQL]: Preparing campaign table.")
+    bulks = campaigns[campaigns['campaign_type'] == 'bulk'][bulk_cols]
+    logger.info("Extracted bulk campaign data, shape: %s", bulks.shape)
+    psql_output.write(bulks, 'campaign_bulks.csv')
+    bulks.reset_index().transform(convert_for_neo4J_rels,
+                    name='has_bulk_details',
+                    start_table='campaign', end_table='campaign')\
+         .to_csv(NEO4J_CLEANED_PATH / 'campaign_bulks.csv', index=False)
+    del(bulks)
+
+    campaign_subjects = campaigns[~campaigns['channel'].isin(['sms', 'multichannel'])][subject_cols]
+    logger.info("[PSQL]: Extracted campaign subject data, shape: %s", campaign_subjects.shape)
+    psql_output.write(campaign_subjects, 'campaign_subjects.csv')
+    campaign_subjects.reset_index().transform(convert_for_neo4J_rels,
+                      name='has_subject_details',
+                      start_table='campaign', end_table='campaign')\
+                     .to_csv(NEO4J_CLEANED_PATH / 'campaign_subjects.csv', index=False)
+    del(campaign_subjects)
+
+    triggers = campaigns[campaigns['campaign_type'] == 'trigger'][trigger_cols]
+    logger.info("[PSQL]: Extracted trigger campaign data, shape: %s", triggers.shape)
+    psql_output.write(triggers, 'campaign_triggers.csv')
+    triggers.reset_index().transform(convert_for_neo4J_rels,
+                    name='has_trigger_details',
+                    start_table='campaign', end_table='campaign')\
+            .to_csv(NEO4J_CLEANED_PATH / 'campaign_triggers.csv', index=False)
+    del(triggers)
+
+    campaigns = campaigns.drop(columns=bulk_cols + subject_cols + trigger_cols)
+    logger.info("[PSQL]: Final general campaigns table shape: %s", campaigns.shape)
+    psql_output.write(campaigns, 'campaigns.csv')
+    campaigns.reset_index().transform(convert_for_neo4J_node, name='campaign')\
+             .to_csv(NEO4J_CLEANED_PATH / 'campaigns.csv', index=False)
+
+
+# ------------------------------------------------------------------------------
+# PROCESS CLIENT FIRST PURCHASE DATA
+# ------------------------------------------------------------------------------
+@telemetry.track
+def emit_clients(clients: pd.DataFrame):
+    """Complete clients with client_first_purchase_date.csv; returns (clients, first_purchase)."""
+    logger.info("Reading client_first_purchase_date.csv and integrating with clients/users")
+    first_purchase = read_first_purchase(DATASET_PATH / 'client_first_purchase_date.csv')
+    logger.info("First purchase data shape: %s", first_purchase.shape)
+    clients = pd.concat([clients, first_purchase\
+                         .drop(columns='first_purchase_date')]).drop_duplicates('client_id')
+    clients = clients.merge(first_purchase[['client_id','first_purchase_date']], how='left', on='client_id')
+    psql_output.write(clients, 'clients.csv', index=False, columns=['client_id', 'first_purchase_date'])
+    clients.drop(columns=['user_id','user_device_id'])\
+           .transform(convert_for_neo4J_node, name='client')\
+           .to_csv(NEO4J_CLEANED_PATH / 'clients.csv', index=False)
+    return clients, first_purchase
+
+
+# ------------------------------------------------------------------------------
+# PROCESS FRIENDS
+# ------------------------------------------------------------------------------
+def load_friends() -> pd.DataFrame:
+    """The friendships of friends.csv as they are loaded: one (friend1, friend2) row per pair, friend1 < friend2."""
+    logger.info("Processing friends.csv to enforce symmetric representation (sort values in each row)")
+    friends = read_friends(DATASET_PATH / 'friends.csv')
+    # Sorting each row ensures symmetric pairs are stored consistently.
+    return pd.DataFrame(np.sort(friends.values, axis=1), columns=friends.columns).drop_duplicates()
+
+
+@telemetry.track
+def emit_friends_and_users(users: pd.Series, clients: pd.DataFrame, first_purchase: pd.DataFrame) -> pd.Series:
+    """Write friends and users, completed with the users of first_purchase and friends; returns all user_id values."""
+    users = pd.concat([users, first_purchase['user_id'].drop_duplicates()]).drop_duplicates()
+
+    friends = load_friends()
+    logger.info("Friends table processed, final shape: %s", friends.shape)
+    users = pd.concat([users,
+                       friends['friend1'].drop_duplicates()]).drop_duplicates()
+    users = pd.concat([users,
+                       friends['friend2'].drop_duplicates()]).drop_duplicates()
+    psql_output.write(users.rename('user_id').to_frame(), 'users.csv', index=False)
+    psql_output.write(friends, 'friends.csv', index=False)
+    with mongo_output.writer('friends') as writer:
+        writer.write(friends)
+
+    friends.transform(convert_for_neo4J_rels, duplicate=False,
+                      name='FRIENDSHIP', start_table='user', end_table='user')\
+           .to_csv(NEO4J_CLEANED_PATH / 'friends.csv', index=False)
+    del(friends)
+
+    users.rename('user_id').to_frame().transform(convert_for_neo4J_node, name='user')\
+         .to_csv(NEO4J_CLEANED_PATH / 'users.csv', index=False)
+    users = pd.merge(users.rename('user_id'),  clients.drop(columns='first_purchase_date'),
+                     on='user_id', how='left')
+    users[['user_id','client_id']].transform(convert_for_neo4J_rels,
+                                             name='OWNS', start_table='user', end_table='client')\
+                                  .to_csv(NEO4J_CLEANED_PATH / 'user_owns.csv', index=False)
+    del(clients)
+
+    users = users.merge(first_purchase[['client_id','first_purchase_date']], how='left', on='client_id')
+    logger.info("[MONGODB]: Grouping users with clients dictionary, skipping the nan first_purchase_date fields")
+    grouped = build_user_devices(users)
+    with mongo_output.writer('users') as writer:
+        writer.write(grouped)
+    return users['user_id'].drop_duplicates()
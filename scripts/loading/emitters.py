@@ -0,0 +1,136 @@
+"""Parallel writers for the PSQL, MongoDB and Neo4j outputs.
+
+Inside an `emitter` block, each intermediate DataFrame is shared once as an
+Arrow IPC file and one write task is submitted per target. The tasks run in a
+process pool. Each worker memory-maps the Arrow file and materializes only the
+columns it writes, so no frame is pickled per worker, and the CSV/JSON
+serialization of the three targets runs at the same time. With one worker the
+tasks run in place on the original frames.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+
+from paths import CACHE_PATH
+from readers import ingestion
+from writers import MongoOutput, Neo4jOutput, PsqlOutput
+from telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SharedFrame:
+    """Handle to a shared DataFrame: the path of its Arrow IPC file, or the frame itself when running serially."""
+    path: Optional[str] = None
+    frame: Optional[pd.DataFrame] = None
+
+    def load(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """The shared frame, or only `columns` of it (index levels included) as plain columns."""
+        if self.frame is not None:
+            return self.frame if columns is None else self.frame.reset_index()[columns]
+        with pa.memory_map(self.path) as source, ingestion.strings():
+            table = pa.ipc.open_file(source).read_all()
+            if columns is None:
+                return table.to_pandas()
+            df = table.select(columns).to_pandas()
+        if df.index.names != [None]:
+            df = df.reset_index()
+        return df[columns]
+
+
+class Emitter:
+    """Context manager running the write tasks submitted in its block, waiting for all of them on exit."""
+
+    def __init__(self, workers: int = 1):
+        self.workers = workers
+
+    def __enter__(self):
+        self.futures, self.writes = [], []
+        self.pool, self.shared_dir = None, None
+        if self.workers > 1:
+            CACHE_PATH.mkdir(parents=True, exist_ok=True)
+            self.shared_dir = tempfile.mkdtemp(prefix='shared-', dir=CACHE_PATH)
+            self.pool = ProcessPoolExecutor(self.workers)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if self.pool is not None:
+                self.pool.shutdown(wait=True, cancel_futures=exc_type is not None)
+                if exc_type is None:
+                    self.writes.extend(future.result() for future in self.futures)
+            telemetry.add_writes(self.writes)
+        finally:
+            if self.shared_dir is not None:
+                shutil.rmtree(self.shared_dir, ignore_errors=True)
+
+    def share(self, df: pd.DataFrame) -> SharedFrame:
+        if self.pool is None:
+            return SharedFrame(frame=df)
+        path = os.path.join(self.shared_dir, f'{uuid.uuid4().hex}.arrow')
+        table = pa.Table.from_pandas(df)
+        with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        return SharedFrame(path=path)
+
+    def submit(self, task: Callable, *args, **kwargs):
+        if self.pool is None:
+            self.writes.append(task(*args, **kwargs))
+        else:
+            self.futures.append(self.pool.submit(task, *args, **kwargs))
+
+    def submit_neo4j(self, output: Neo4jOutput, shared: SharedFrame, file: str, convert: Callable, **kwargs):
+        """Submit the to_neo4j tasks of `file`, one per part in the 'parts' format, to write the parts in parallel."""
+        output.clear(file)
+        for part in range(output.parts if output.format == 'parts' else 1):
+            self.submit(to_neo4j, output, shared, file, convert, part=part, **kwargs)
+
+
+emitter = Emitter()
+
+
+# ------------------------------------------------------------------------------
+# WRITE TASKS
+# ------------------------------------------------------------------------------
+# Every task returns its timing record for the run report.
+def _write_record(target: str, path, rows: int, start: float) -> Dict:
+    logger.info("[%s]: Wrote %s, %s rows", target, path, rows)
+    return {'target': target, 'path': str(path), 'rows': rows,
+            'seconds': round(time.perf_counter() - start, 4), 'pid': os.getpid()}
+
+
+def to_psql(output: PsqlOutput, shared: SharedFrame, file: str, columns=None, **write_kwargs) -> Dict:
+    """Write a CSV file, or COPY the table over this task's own connection."""
+    start = time.perf_counter()
+    df = shared.load(columns)
+    path = output.write(df, file, **write_kwargs)
+    return _write_record('PSQL', path, len(df), start)
+
+
+def to_neo4j(output: Neo4jOutput, shared: SharedFrame, file: str, convert: Callable,
+             columns=None, part: int = 0, **convert_kwargs) -> Dict:
+    """Write the frame converted by convert_for_neo4J_node/convert_for_neo4J_rels, or one part of it."""
+    start = time.perf_counter()
+    df = shared.load(columns)
+    path = output.write(df.transform(convert, **convert_kwargs), file, part)
+    return _write_record('NEO4J', path, len(df), start)
+
+
+def to_mongo(output: MongoOutput, collection: str, *shared: SharedFrame, build: Optional[Callable] = None) -> Dict:
+    """Write a collection; `build` turns the shared frames into its documents (default: the first frame)."""
+    start = time.perf_counter()
+    frames = [s.load() for s in shared]
+    docs = build(*frames) if build is not None else frames[0]
+    with output.writer(collection) as writer:
+        writer.write(docs)
+    return _write_record('MONGODB', output.path(collection), len(docs), start)
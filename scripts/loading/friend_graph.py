@@ -0,0 +1,74 @@
+"""Friend-graph index: the friendships and purchases of every user as CSR arrays, memory-mapped by the analysis.
+
+Users are numbered 0..n-1 in user_id order (users.npy). The adjacency is
+stored in both directions, so the friends of user i are
+
+    friend_neighbors[friend_offsets[i]:friend_offsets[i + 1]]
+
+(user numbers, sorted), and the purchases of user i, a sparse row of the
+user x product card matrix, are the product_card_pk and purchase counts
+
+    purchase_products[purchase_offsets[i]:purchase_offsets[i + 1]]
+    purchase_counts[purchase_offsets[i]:purchase_offsets[i + 1]]
+
+counted over the deduplicated PSQL events. Offsets and values are int32
+(the graph must have fewer than 2**31 edges and purchase entries); the
+product_id, category_id and brand of the product cards are in
+product_cards.parquet. Every array is a plain .npy file, so
+np.load(..., mmap_mode='r') maps it without reading it
+(scripts/analysis/friend_index.py serves the queries from them).
+"""
+import json
+import logging
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from paths import FRIEND_GRAPH_PATH
+from telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+INDEX_DTYPE = np.int32
+ARRAYS = ['users', 'friend_offsets', 'friend_neighbors', 'purchase_offsets', 'purchase_products', 'purchase_counts']
+
+
+def csr(rows: np.ndarray, values: np.ndarray, n_rows: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(offsets, values sorted by row then value, the order that sorts them) of the (row, value) pairs"""
+    if len(values) >= np.iinfo(INDEX_DTYPE).max:
+        raise ValueError(f"{len(values)} entries do not fit int32 CSR offsets")
+    order = np.lexsort((values, rows))
+    offsets = np.zeros(n_rows + 1, dtype=INDEX_DTYPE)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=offsets[1:])
+    return offsets, values[order].astype(INDEX_DTYPE), order
+
+
+@telemetry.track
+def build_friend_graph(friends: pd.DataFrame, purchases: pd.DataFrame, product_cards: pd.DataFrame,
+                       path: Path = FRIEND_GRAPH_PATH):
+    """Write the index of `friends` (friend1, friend2), `purchases` (user_id, product_card_pk, purchases)
+    and `product_cards` (product_card_pk, product_id, category_id, brand) to `path`."""
+    users = np.unique(np.concatenate([friends['friend1'].to_numpy(), friends['friend2'].to_numpy(),
+                                      purchases['user_id'].to_numpy()])).astype('int64')
+    friend1 = np.searchsorted(users, friends['friend1'].to_numpy())
+    friend2 = np.searchsorted(users, friends['friend2'].to_numpy())
+    # Both directions of every friendship.
+    friend_offsets, friend_neighbors, _ = csr(np.concatenate([friend1, friend2]),
+                                              np.concatenate([friend2, friend1]), len(users))
+    purchase_offsets, purchase_products, order = csr(np.searchsorted(users, purchases['user_id'].to_numpy()),
+                                                     purchases['product_card_pk'].to_numpy(), len(users))
+    purchase_counts = purchases['purchases'].to_numpy()[order].astype(INDEX_DTYPE)
+
+    path.mkdir(exist_ok=True, parents=True)
+    for name, array in zip(ARRAYS, [users, friend_offsets, friend_neighbors,
+                                    purchase_offsets, purchase_products, purchase_counts]):
+        np.save(path / f'{name}.npy', array)
+    product_cards[['product_card_pk', 'product_id', 'category_id', 'brand']]\
+        .to_parquet(path / 'product_cards.parquet', index=False)
+    (path / 'meta.json').write_text(json.dumps({'users': len(users), 'friendships': len(friends),
+                                                'purchase_entries': len(purchase_products)}, indent=2))
+    logger.info("Friend graph index: %s users, %s friendships, %s (user, product card) purchase entries, %.1f MB",
+                len(users), len(friends), len(purchase_products),
+                sum((path / f'{name}.npy').stat().st_size for name in ARRAYS) / 1024**2)
@@ -0,0 +1,103 @@
+"""Import the MongoDB outputs of clean_data.py with several mongoimport processes in parallel.
+
+Every NDJSON shard in output/mongo/<collection>/ (written with
+`clean_data.py --mongo-format ndjson`) is one import job; gzip shards are
+decompressed on the fly into mongoimport's stdin. A collection written as a
+single <collection>.json array is imported as one --jsonArray job.
+
+Create the collections and indexes first, as for load_data_mongodb.sh:
+
+    mongosh --file scripts/loading/load_data_mongodb.js
+    uv run python scripts/loading/import_mongo_shards.py --workers 8
+
+A successful import bumps the load generation of mongo (see load_generation.py).
+"""
+import argparse
+import gzip
+import logging
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from tabulate import tabulate
+
+import load_generation
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+COLLECTIONS = ['users', 'friends', 'campaigns', 'messages', 'products', 'events', 'campaign_conversions']
+
+
+def import_jobs(mongo_path: Path, collections):
+    """(collection, file, is_json_array) for every file to import."""
+    for collection in collections:
+        shards = sorted((mongo_path / collection).glob('part-*.ndjson*'))
+        if shards:
+            yield from ((collection, shard, False) for shard in shards)
+        elif (mongo_path / f'{collection}.json').exists():
+            yield collection, mongo_path / f'{collection}.json', True
+        else:
+            logger.warning("No output found for collection %s in %s", collection, mongo_path)
+
+
+def run_mongoimport(args, collection: str, path: Path, json_array: bool) -> float:
+    cmd = ['mongoimport', '--uri', args.uri, '--db', args.db, '--collection', collection,
+           '--numInsertionWorkers', str(args.insertion_workers), '--quiet']
+    if json_array:
+        cmd.append('--jsonArray')
+    start = time.perf_counter()
+    if path.suffix == '.gz':
+        with gzip.open(path, 'rb') as source, subprocess.Popen(cmd, stdin=subprocess.PIPE) as process:
+            shutil.copyfileobj(source, process.stdin, 1024 * 1024)
+            process.stdin.close()
+        returncode = process.returncode
+    else:
+        returncode = subprocess.run(cmd + ['--file', str(path)]).returncode
+    if returncode:
+        raise RuntimeError(f"mongoimport failed for {path} (exit code {returncode})")
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uri', default='mongodb://localhost:27017')
+    parser.add_argument('--db', default='ecommerce')
+    parser.add_argument('--input', type=Path, default=Path('output/mongo'))
+    parser.add_argument('--collections', nargs='+', default=COLLECTIONS)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="Number of mongoimport processes running at the same time.")
+    parser.add_argument('--insertion-workers', type=int, default=1,
+                        help="--numInsertionWorkers of each mongoimport process.")
+    args = parser.parse_args()
+
+    jobs = list(import_jobs(args.input, args.collections))
+    logger.info("Importing %s files with %s workers", len(jobs), args.workers)
+    stats = {collection: [0, 0, 0.0] for collection, _, _ in jobs}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(run_mongoimport, args, *job): job for job in jobs}
+        for future in as_completed(futures):
+            collection, path, _ = futures[future]
+            elapsed = future.result()
+            stats[collection][0] += 1
+            stats[collection][1] += path.stat().st_size
+            stats[collection][2] += elapsed
+            logger.info("Imported %s into %s in %.2fs", path, collection, elapsed)
+    total = time.perf_counter() - start
+
+    logger.info("\nMongo import report:\n" +
+                tabulate([[collection, files, f"{size / 1024**2:.1f} MB", f"{busy:.2f}s"]
+                          for collection, (files, size, busy) in stats.items()],
+                         headers=["Collection", "Files", "Size on disk", "Import time (sum)"],
+                         tablefmt="pretty"))
+    logger.info("Total wall-clock time: %.2fs", total)
+    load_generation.bump('mongo')
+
+
+if __name__ == '__main__':
+    main()
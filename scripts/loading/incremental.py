@@ -0,0 +1,208 @@
+"""Incremental ingestion of the rows appended to messages.csv and events.csv.
+
+The first run (no state in output/.state/) is a full streaming run into
+output/. It saves the StreamState as Parquet: the surrogate-key dictionaries
+((campaign_id, message_type, channel) -> id, (product_id, brand, category_id)
+-> product_pk, ...), the category_code counts, the known clients and users and
+the event deduplication boundaries. It also saves a watermark per file: the
+byte offset up to which the file was read and a digest of the bytes before it.
+
+Every following run reads only the rows past the watermarks and writes delta
+files to output/delta/<run>/{psql,mongo,neo4j}, with just the new nodes,
+relationships and rows. Surrogate keys continue the persisted dictionaries,
+so the deltas can be appended to the loaded databases, except:
+
+- psql/product_updates.csv: known products whose representative category_code
+  changed (UPDATE products SET category_code ... WHERE product_pk = ...);
+- mongo users: the full documents of new users and of users with new devices,
+  to be imported with `--mode upsert --upsertFields user_id`;
+- campaign_conversions: the recomputed rollups of the campaigns that got new
+  messages, to be upserted with refresh_campaign_conversions_psql.sql,
+  `mongoimport --mode upsert --upsertFields campaign_id,campaign_type` and
+  campaign_conversions_neo4j.cypher.
+
+campaigns.csv, friends.csv and client_first_purchase_date.csv are only read
+for lookups; changes to them (or a rewrite of the tracked files) need a new
+full run: delete output/.state/.
+"""
+import hashlib
+import json
+import logging
+import shutil
+from dataclasses import replace
+from pathlib import Path
+
+import pandas as pd
+
+from paths import DATASET_PATH, STATE_PATH, DELTA_PATH
+from readers import iter_messages, iter_events, read_first_purchase
+from transforms import convert_for_neo4J_node, convert_for_neo4J_rels
+from mongo_docs import build_user_devices
+from dimensions import load_campaigns
+from streaming import StreamState, stream_messages, stream_events, run_streaming
+from writers import OutputDirs, mongo_output, neo4j_output, psql_output
+from telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+TRACKED_FILES = {'messages.csv': iter_messages, 'events.csv': iter_events}
+# Bytes before the watermark that must be unchanged for the file to count as appended to.
+DIGEST_BYTES = 64 * 1024
+
+STATE_KEYS = ['message_keys', 'product_keys', 'product_pks', 'card_keys']
+STATE_FRAMES = ['code_counts', 'product_codes', 'clients']
+STATE_DEDUPS = ['event_dedup', 'psql_event_dedup']
+STATE_CONVERSIONS = ['sent', 'interacted', 'purchasers']
+
+
+# ------------------------------------------------------------------------------
+# WATERMARKS
+# ------------------------------------------------------------------------------
+def complete_end(path: Path) -> int:
+    """Size of `path` without a trailing partial line (a row still being appended)."""
+    size = path.stat().st_size
+    with open(path, 'rb') as f:
+        f.seek(max(0, size - DIGEST_BYTES))
+        tail = f.read()
+    return size - len(tail) + tail.rfind(b'\n') + 1 if b'\n' in tail else size
+
+
+def digest(path: Path, offset: int) -> str:
+    with open(path, 'rb') as f:
+        f.seek(max(0, offset - DIGEST_BYTES))
+        return hashlib.sha256(f.read(offset - f.tell())).hexdigest()
+
+
+def counted(chunks, counter: dict, name: str):
+    for chunk in chunks:
+        counter[name] = counter.get(name, 0) + len(chunk)
+        yield chunk
+
+
+# ------------------------------------------------------------------------------
+# STATE
+# ------------------------------------------------------------------------------
+def save_state(state: StreamState, watermarks: dict, path: Path = STATE_PATH):
+    """Write the state next to the current one and swap them, so a failed run leaves the previous state."""
+    tmp = path.with_name(path.name + '.tmp')
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    for name in STATE_KEYS:
+        keys = getattr(state, name).keys
+        if keys is not None:
+            keys.to_parquet(tmp / f'{name}.parquet')
+    for name in STATE_FRAMES:
+        if getattr(state, name) is not None:
+            getattr(state, name).to_parquet(tmp / f'{name}.parquet')
+    state.users.rename('user_id').to_frame().to_parquet(tmp / 'users.parquet')
+    watermarks['dedup_times'] = {}
+    for name in STATE_DEDUPS:
+        dedup = getattr(state, name)
+        if dedup.boundary is not None:
+            dedup.boundary.to_parquet(tmp / f'{name}.parquet')
+            watermarks['dedup_times'][name] = dedup.last_time.isoformat()
+    for name in STATE_CONVERSIONS:
+        if getattr(state.conversions, name) is not None:
+            getattr(state.conversions, name).to_parquet(tmp / f'conversions_{name}.parquet')
+    (tmp / 'watermarks.json').write_text(json.dumps(watermarks, indent=2))
+    shutil.rmtree(path, ignore_errors=True)
+    tmp.rename(path)
+
+
+def load_state(path: Path = STATE_PATH):
+    """(StreamState, watermarks) saved by the previous run."""
+    watermarks = json.loads((path / 'watermarks.json').read_text())
+    state = StreamState()
+    for name in STATE_KEYS:
+        if (path / f'{name}.parquet').exists():
+            getattr(state, name).keys = pd.read_parquet(path / f'{name}.parquet')
+    for name in STATE_FRAMES:
+        if (path / f'{name}.parquet').exists():
+            setattr(state, name, pd.read_parquet(path / f'{name}.parquet'))
+    state.users = pd.read_parquet(path / 'users.parquet')['user_id']
+    for name, last_time in watermarks['dedup_times'].items():
+        dedup = getattr(state, name)
+        dedup.boundary = pd.read_parquet(path / f'{name}.parquet')
+        dedup.last_time = pd.Timestamp(last_time)
+    for name in STATE_CONVERSIONS:
+        if (path / f'conversions_{name}.parquet').exists():
+            setattr(state.conversions, name, pd.read_parquet(path / f'conversions_{name}.parquet'))
+    return state, watermarks
+
+
+# ------------------------------------------------------------------------------
+# NEW CLIENTS AND USERS
+# ------------------------------------------------------------------------------
+@telemetry.track
+def emit_new_clients_and_users(state: StreamState, clients_before: int, users_before: int, out: OutputDirs):
+    new_clients = state.clients.iloc[clients_before:]
+    new_users = state.users.iloc[users_before:]
+    logger.info("%s new clients, %s new users", len(new_clients), len(new_users))
+    first_purchase = read_first_purchase(DATASET_PATH / 'client_first_purchase_date.csv')\
+        [['client_id', 'first_purchase_date']]
+
+    clients = new_clients.merge(first_purchase, how='left', on='client_id')
+    out.psql.write(clients, 'clients.csv', index=False, columns=['client_id', 'first_purchase_date'])
+    clients.drop(columns=['user_id','user_device_id'])\
+           .transform(convert_for_neo4J_node, name='client')\
+           .to_csv(out.neo4j.directory / 'clients.csv', index=False)
+    clients[['user_id','client_id']].transform(convert_for_neo4J_rels,
+                                               name='OWNS', start_table='user', end_table='client')\
+                                    .to_csv(out.neo4j.directory / 'user_owns.csv', index=False)
+
+    out.psql.write(new_users.rename('user_id').to_frame(), 'users.csv', index=False)
+    new_users.rename('user_id').to_frame().transform(convert_for_neo4J_node, name='user')\
+             .to_csv(out.neo4j.directory / 'users.csv', index=False)
+
+    # Whole documents of the new users and of the users owning a new client.
+    users = pd.concat([new_users, new_clients['user_id']]).drop_duplicates().rename('user_id').to_frame()
+    users = users.merge(state.clients, on='user_id', how='left')\
+                 .merge(first_purchase, how='left', on='client_id')
+    with out.mongo.writer('users') as writer:
+        writer.write(build_user_devices(users))
+
+
+# ------------------------------------------------------------------------------
+# RUN
+# ------------------------------------------------------------------------------
+def run_incremental(chunksize: int):
+    ends = {name: complete_end(DATASET_PATH / name) for name in TRACKED_FILES}
+    rows = {}
+    if not (STATE_PATH / 'watermarks.json').exists():
+        logger.info("No incremental state in %s, running a full streaming run first", STATE_PATH)
+        state = run_streaming(chunksize, *(counted(read(DATASET_PATH / name, chunksize, end=ends[name]), rows, name)
+                                           for name, read in TRACKED_FILES.items()))
+        watermarks = {'run': 0, 'files': {}}
+    else:
+        state, watermarks = load_state()
+        for name in TRACKED_FILES:
+            offset = watermarks['files'][name]['offset']
+            if ends[name] < offset or digest(DATASET_PATH / name, offset) != watermarks['files'][name]['digest']:
+                raise RuntimeError(f"{name} was modified before its watermark (offset {offset}), not appended to. "
+                                   f"Delete {STATE_PATH} for a full run.")
+        if all(ends[name] == watermarks['files'][name]['offset'] for name in TRACKED_FILES):
+            logger.info("No new rows since run %s", watermarks['run'])
+            return
+        watermarks['run'] += 1
+        root = DELTA_PATH / f"{watermarks['run']:05d}"
+        shutil.rmtree(root, ignore_errors=True)
+        out = OutputDirs(replace(psql_output, directory=root / 'psql'),
+                         replace(neo4j_output, directory=root / 'neo4j'),
+                         replace(mongo_output, directory=root / 'mongo'))
+        out.make()
+        logger.info("Writing delta %s to %s", watermarks['run'], root)
+
+        chunks = {name: counted(read(DATASET_PATH / name, chunksize, start=watermarks['files'][name]['offset'],
+                                     end=ends[name]), rows, name)
+                  for name, read in TRACKED_FILES.items()}
+        clients_before, users_before = len(state.clients), len(state.users)
+        stream_messages(chunks['messages.csv'], load_campaigns(), state, out)
+        stream_events(chunks['events.csv'], state, out)
+        emit_new_clients_and_users(state, clients_before, users_before, out)
+
+    for name in TRACKED_FILES:
+        previous = watermarks['files'].get(name, {}).get('rows', 0)
+        watermarks['files'][name] = {'offset': ends[name], 'digest': digest(DATASET_PATH / name, ends[name]),
+                                     'rows': previous + rows.get(name, 0)}
+        logger.info("%s: %s new rows, watermark at byte %s", name, rows.get(name, 0), ends[name])
+    save_state(state, watermarks)
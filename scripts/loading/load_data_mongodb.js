@@ -406,4 +406,72 @@ db.friends.createIndex({
 {
     "name": "friendship",
     "unique": true
-});
\ No newline at end of file
+});
+
+
+
+db.createCollection("campaign_conversions", {
+    "capped": false,
+    "validator": {
+        "$jsonSchema": {
+            "bsonType": "object",
+            "title": "campaign_conversions",
+            "properties": {
+                "_id": {
+                    "bsonType": "objectId"
+                },
+                "campaign_id": {
+                    "bsonType": "long"
+                },
+                "campaign_type": {
+                    "bsonType": "string"
+                },
+                "total_messages": {
+                    "bsonType": "int"
+                },
+                "clients_with_interaction": {
+                    "bsonType": "int"
+                },
+                "users_purchased": {
+                    "bsonType": "int"
+                },
+                "friends_who_also_purchased": {
+                    "bsonType": "int"
+                },
+                "conversion_rate": {
+                    "bsonType": "double"
+                },
+                "refreshed_at": {
+                    "bsonType": "string"
+                }
+            },
+            "additionalProperties": false,
+            "required": [
+                "campaign_id",
+                "campaign_type",
+                "total_messages",
+                "conversion_rate"
+            ]
+        }
+    },
+    "validationLevel": "off",
+    "validationAction": "warn"
+});
+
+db.campaign_conversions.createIndex({
+    "campaign_id": 1,
+    "campaign_type": 1
+},
+{
+    "name": "unique_campaign_conversion",
+    "unique": true
+});
+
+db.campaign_conversions.createIndex({
+    "conversion_rate": -1,
+    "campaign_id": 1,
+    "campaign_type": 1
+},
+{
+    "name": "conversion_rate"
+});
@@ -5,4 +5,5 @@ mongoimport --db ecommerce --collection friends --file output/mongo/friends.json
 mongoimport --db ecommerce --collection campaigns --file output/mongo/campaigns.json --jsonArray
 mongoimport --db ecommerce --collection messages --file output/mongo/messages.json --jsonArray
 mongoimport --db ecommerce --collection products --file output/mongo/products.json --jsonArray
-mongoimport --db ecommerce --collection events --file output/mongo/events.json --jsonArray
\ No newline at end of file
+mongoimport --db ecommerce --collection events --file output/mongo/events.json --jsonArray
+mongoimport --db ecommerce --collection campaign_conversions --file output/mongo/campaign_conversions.json --jsonArray
\ No newline at end of file
@@ -119,6 +119,21 @@ CREATE TABLE IF NOT EXISTS e_commerce.message_behaviors (
 	CONSTRAINT fk_message_sent_message_id_to_message_behavior_message_id FOREIGN KEY (message_id) REFERENCES e_commerce.message_sent (message_id) ON DELETE CASCADE
 ) TABLESPACE pg_default;
 
+-- Campaign-conversion rollups of q1, computed by clean_data.py (rollups.py).
+CREATE TABLE IF NOT EXISTS e_commerce.campaign_conversions (
+	campaign_id bigint NOT NULL,
+	campaign_type varchar(52) NOT NULL,
+	total_messages integer NOT NULL,
+	clients_with_interaction integer NOT NULL,
+	users_purchased integer NOT NULL,
+	friends_who_also_purchased integer NOT NULL,
+	conversion_rate double precision NOT NULL,
+	refreshed_at timestamp NOT NULL,
+	CONSTRAINT campaign_conversion PRIMARY KEY (campaign_id, campaign_type),
+	CONSTRAINT fk_campaigns_id_to_campaign_conversions_campaign_id FOREIGN KEY (campaign_id, campaign_type) REFERENCES e_commerce.campaigns (id, campaign_type) ON DELETE CASCADE
+) TABLESPACE pg_default;
+
+CREATE INDEX IF NOT EXISTS campaign_conversions_rate_idx ON e_commerce.campaign_conversions (conversion_rate DESC, campaign_id, campaign_type);
 
 \COPY users(user_id)  FROM 'output/psql/users.csv'  DELIMITER ','  CSV HEADER;
 \COPY clients(client_id,first_purchase_date)  FROM 'output/psql/clients.csv'  DELIMITER ','  CSV HEADER;
@@ -132,4 +147,5 @@ CREATE TABLE IF NOT EXISTS e_commerce.message_behaviors (
 \COPY campaign_triggers(campaign_pk, position)  FROM 'output/psql/campaign_triggers.csv'  DELIMITER ','  CSV HEADER;
 \COPY messages(id,campaign_id,message_type,channel,created_at,updated_at)  FROM 'output/psql/messages.csv'  DELIMITER ','  CSV HEADER;
 \COPY message_sent(message_id,id,client_id,email_provider,platform,sent_at)  FROM 'output/psql/message_sent.csv'  DELIMITER ','  CSV HEADER;
-\COPY message_behaviors(message_id,type,happened_first_time,happened_last_time)  FROM 'output/psql/message_behavior.csv'  DELIMITER ','  CSV HEADER;
\ No newline at end of file
+\COPY message_behaviors(message_id,type,happened_first_time,happened_last_time)  FROM 'output/psql/message_behavior.csv'  DELIMITER ','  CSV HEADER;
+\COPY campaign_conversions(campaign_id,campaign_type,total_messages,clients_with_interaction,users_purchased,friends_who_also_purchased,conversion_rate,refreshed_at)  FROM 'output/psql/campaign_conversions.csv'  DELIMITER ','  CSV HEADER;
@@ -0,0 +1,55 @@
+"""Load-generation marker: a counter per backend, bumped after each reload of its data.
+
+The query result cache of the analysis scripts (scripts/analysis/result_cache.py)
+drops the cached results of a backend as soon as its generation changes.
+clean_data.py --psql-load, import_mongo_shards.py, bulk_load.py, the generated
+Neo4j import scripts, the friend_graph stage ('csr') and --parquet ('duckdb') of
+clean_data.py bump it themselves; after a load by other means (psql -f
+load_data_psql.sql, load_data_mongodb.sh, ...) run
+
+    uv run python scripts/loading/load_generation.py postgres mongo
+"""
+import argparse
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict
+
+from paths import GENERATION_PATH
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ['postgres', 'mongo', 'neo4j', 'csr', 'duckdb']
+
+
+def read(path: Path = GENERATION_PATH) -> Dict[str, Dict]:
+    """backend -> {'generation': n, 'loaded_at': ISO time}; empty before the first bump"""
+    path = Path(path)
+    return json.loads(path.read_text(encoding='utf-8')) if path.exists() else {}
+
+
+def bump(*backends: str, path: Path = GENERATION_PATH) -> Dict[str, Dict]:
+    """Increment the generation of `backends`; the file is replaced atomically, so a reader never sees half of it"""
+    path = Path(path)
+    generations = read(path)
+    loaded_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    for backend in backends:
+        generation = generations.get(backend, {}).get('generation', 0) + 1
+        generations[backend] = {'generation': generation, 'loaded_at': loaded_at}
+        logger.info("Load generation of %s: %s", backend, generation)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix('.tmp')
+    temporary.write_text(json.dumps(generations, indent=2), encoding='utf-8')
+    os.replace(temporary, path)
+    return generations
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Bump the load generation of the reloaded backends.")
+    parser.add_argument('backends', nargs='+', choices=BACKENDS)
+    parser.add_argument('--path', type=Path, default=GENERATION_PATH)
+    args = parser.parse_args()
+    bump(*args.backends, path=args.path)
@@ -0,0 +1,128 @@
+"""neo4j-admin import scripts for the Neo4j output files.
+
+import_neo4j.bat (Windows) and import_neo4j.sh (Linux/macOS) are written next to
+the files. They list the files of every node and relationship table found on
+disk: its single CSV, or its header file followed by all of its gzip-compressed
+parts (--neo4j-format parts). They run `neo4j-admin database import full` into
+the database given as first argument (default: neo4j), which must be stopped,
+then bump its load generation (see load_generation.py) with the PYTHON
+interpreter. The repository is found relative to the scripts, so the
+directory can be moved with it; copied on its own (e.g. to the Neo4j host),
+the scripts only import and say that the generation was not bumped.
+
+clean_data.py writes them at the end of every run; run this module to write
+them again for the files currently on disk:
+
+    uv run python scripts/loading/neo4j_import.py
+"""
+import logging
+import os
+from pathlib import Path
+from typing import List, Tuple
+
+from paths import GENERATION_PATH
+from writers import Neo4jOutput, neo4j_output
+
+logger = logging.getLogger(__name__)
+
+# The repository, where the scripts bump the load generation from.
+ROOT = Path(__file__).resolve().parents[2]
+
+# Label or relationship type -> file, as in load_data_neo4j.bat.
+NODES = {
+    'user': 'users.csv',
+    'client': 'clients.csv',
+    'campaign': 'campaigns.csv',
+    'message': 'messages.csv',
+    'product': 'products.csv',
+}
+RELATIONSHIPS = {
+    'FRIENDSHIP': 'friends.csv',
+    'OWNS': 'user_owns.csv',
+    'HAS_BULK_DETAILS': 'campaign_bulks.csv',
+    'HAS_SUBJECT_DETAILS': 'campaign_subjects.csv',
+    'HAS_TRIGGER_DETAILS': 'campaign_triggers.csv',
+    'SENT_TO': 'message_sent.csv',
+    'BELONGS_TO': 'messages_belong_to.csv',
+    'DO_BEHAVIOR': 'message_behavior.csv',
+    'INTERACTED_WITH': 'events.csv',
+}
+
+
+def import_options(output: Neo4jOutput) -> List[Tuple[str, str, List[str]]]:
+    """(option, label or type, file names) of every table with files in `output.directory`."""
+    options = []
+    for option, tables in [('nodes', NODES), ('relationships', RELATIONSHIPS)]:
+        for name, file in tables.items():
+            files = output.files(file)
+            if files:
+                options.append((option, name, [path.name for path in files]))
+            else:
+                logger.warning("[NEO4J]: No file for %s %s (%s), left out of the import scripts", option, name, file)
+    return options
+
+
+def relative(path: Path, start: Path) -> str:
+    """`path` relative to `start`, with / separators; absolute when there is none (another Windows drive)"""
+    try:
+        return Path(os.path.relpath(Path(path).resolve(), Path(start).resolve())).as_posix()
+    except ValueError:
+        return Path(path).resolve().as_posix()
+
+
+def windows(path: str) -> str:
+    return path.replace('/', '\\')
+
+
+def write_import_scripts(output: Neo4jOutput = neo4j_output):
+    options = import_options(output)
+    # The marker is bumped from the repository, found relative to the scripts, with the PYTHON interpreter
+    # (python3 / python by default); the bump is skipped when the directory was copied without it.
+    root, generation = relative(ROOT, output.directory), relative(GENERATION_PATH, ROOT)
+    bump = f'scripts/loading/load_generation.py --path "{generation}" neo4j'
+    skipped = 'scripts/loading/load_generation.py not found: the neo4j load generation was not bumped'
+    sh = ['#!/bin/sh',
+          '# Generated by clean_data.py: imports the files of this directory with neo4j-admin.',
+          '# Usage: ./import_neo4j.sh [database]  (the database must be stopped)',
+          'DIR=$(cd "$(dirname "$0")" && pwd)',
+          'neo4j-admin database import full \\']
+    sh += [f'  --{option}={name}="' + ','.join(f'$DIR/{file}' for file in files) + '" \\'
+           for option, name, files in options]
+    sh += ['  --verbose --overwrite-destination \\', '  "${1:-neo4j}" || exit $?',
+           f'ROOT="{root if Path(root).is_absolute() else "$DIR/" + root}"',
+           'if [ -f "$ROOT/scripts/loading/load_generation.py" ]; then',
+           f'  (cd "$ROOT" && "${{PYTHON:-python3}}" {bump})',
+           'else',
+           f'  echo "{skipped}" >&2',
+           'fi']
+    bat = ['@echo off',
+           'rem Generated by clean_data.py: imports the files of this directory with neo4j-admin.',
+           'rem Usage: import_neo4j.bat [database]  (the database must be stopped)',
+           'set DB=%1',
+           'if "%DB%"=="" set DB=neo4j',
+           # neo4j-admin is a batch file on Windows: without call, it would not return.
+           'call neo4j-admin database import full ^']
+    bat += [f'  --{option}={name}="' + ','.join(f'%~dp0{file}' for file in files) + '" ^'
+            for option, name, files in options]
+    bat += ['  --verbose --overwrite-destination ^', '  %DB%', 'if errorlevel 1 exit /b %errorlevel%',
+            f'set ROOT={windows(root) if Path(root).is_absolute() else "%~dp0" + windows(root)}',
+            'if "%PYTHON%"=="" set PYTHON=python',
+            'if not exist "%ROOT%\\scripts\\loading\\load_generation.py" (',
+            f'  echo {windows(skipped)} 1>&2',
+            '  exit /b 0',
+            ')',
+            'pushd "%ROOT%"',
+            f'"%PYTHON%" {windows(bump)}',
+            'popd']
+
+    sh_path, bat_path = output.directory / 'import_neo4j.sh', output.directory / 'import_neo4j.bat'
+    sh_path.write_text('\n'.join(sh) + '\n', newline='\n')
+    os.chmod(sh_path, 0o755)
+    bat_path.write_text('\n'.join(bat) + '\n', newline='\r\n')
+    logger.info("[NEO4J]: Import scripts for %s files written to %s",
+                sum(len(files) for *_, files in options), output.directory)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    write_import_scripts()
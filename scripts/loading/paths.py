@@ -0,0 +1,27 @@
+import os
+from pathlib import Path
+
+DATASET_PATH = Path('datasets')
+PSQL_CLEANED_PATH = Path('output/psql/')
+MONGO_CLEANED_PATH = Path('output/mongo/')
+CACHE_PATH = Path('output/.cache/')
+STATE_PATH = Path('output/.state/')
+DELTA_PATH = Path('output/delta/')
+REPORT_PATH = Path('output/run_report.jsonl')
+GENERATION_PATH = Path('output/load_generation.json')
+FRIEND_GRAPH_PATH = Path('output/friend_graph/')
+PARQUET_PATH = Path('output/parquet/')
+load_to_neo4j_import_dir = True
+
+
+if load_to_neo4j_import_dir \
+    and (path_list := os.environ.get('PATH')) \
+    and (neo4j_root := [i for i in path_list.split(';') if 'neo4j' in i.lower()]):
+    NEO4J_CLEANED_PATH = Path(neo4j_root[0]).parent / 'import'
+else: NEO4J_CLEANED_PATH = Path('output/neo4j/')
+
+
+def make_output_dirs():
+    PSQL_CLEANED_PATH.mkdir(exist_ok=True, parents=True)
+    MONGO_CLEANED_PATH.mkdir(exist_ok=True, parents=True)
+    NEO4J_CLEANED_PATH.mkdir(exist_ok=True, parents=True)
@@ -0,0 +1,85 @@
+-- Optional physical design of the PSQL schema, applied after load_data_psql.sql (or clean_data.py --psql-load):
+--     psql -d <database> -f scripts/loading/physical_design_psql.sql
+-- or benchmarked before and after with:
+--     uv run python scripts/analysis/data_analysis.py design
+-- Every statement can be run again on a database it was already applied to.
+SET search_path TO e_commerce, public;
+
+-- events: monthly range partitions on event_time, plus a default partition for rows outside the loaded months.
+-- The primary key of a partitioned table must include the partition key, so it becomes (event_id, event_time);
+-- no table references events.
+DO $$ -- events: monthly partitions
+DECLARE
+	partition_start timestamp WITH TIME ZONE;
+BEGIN
+	IF (SELECT relkind FROM pg_class WHERE oid = 'e_commerce.events'::regclass) = 'p' THEN
+		RAISE NOTICE 'e_commerce.events is already partitioned';
+		RETURN;
+	END IF;
+	ALTER TABLE e_commerce.events RENAME TO events_unpartitioned;
+	ALTER INDEX IF EXISTS e_commerce.events_pkey RENAME TO events_unpartitioned_pkey;
+	ALTER INDEX IF EXISTS e_commerce.unique_event RENAME TO unique_event_unpartitioned;
+	ALTER SEQUENCE e_commerce.events_event_id_seq OWNED BY NONE;
+
+	CREATE TABLE e_commerce.events (
+		event_id integer DEFAULT nextval('e_commerce.events_event_id_seq') NOT NULL,
+		product_card_pk integer NOT NULL,
+		user_id integer NOT NULL,
+		event_time timestamp WITH TIME ZONE NOT NULL,
+		event_type varchar NOT NULL,
+		user_session uuid NOT NULL,
+		price real NOT NULL
+	) PARTITION BY RANGE (event_time);
+	FOR partition_start IN
+		SELECT generate_series(date_trunc('month', min(event_time)), max(event_time), interval '1 month')
+		FROM e_commerce.events_unpartitioned
+	LOOP
+		EXECUTE format('CREATE TABLE e_commerce.%I PARTITION OF e_commerce.events FOR VALUES FROM (%L) TO (%L)',
+					   'events_' || to_char(partition_start, 'YYYY_MM'), partition_start,
+					   partition_start + interval '1 month');
+	END LOOP;
+	CREATE TABLE e_commerce.events_default PARTITION OF e_commerce.events DEFAULT;
+
+	-- The rows are moved before the keys are built, as in the initial load.
+	INSERT INTO e_commerce.events
+	SELECT event_id, product_card_pk, user_id, event_time, event_type, user_session, price
+	FROM e_commerce.events_unpartitioned;
+	DROP TABLE e_commerce.events_unpartitioned;
+	ALTER SEQUENCE e_commerce.events_event_id_seq OWNED BY e_commerce.events.event_id;
+
+	ALTER TABLE e_commerce.events
+		ADD PRIMARY KEY (event_id, event_time),
+		ADD CONSTRAINT unique_event UNIQUE (user_id, event_time, product_card_pk),
+		ADD CONSTRAINT fk_products_product_id_to_events_product_id FOREIGN KEY (product_card_pk) REFERENCES e_commerce.product_cards (product_card_pk) ON DELETE CASCADE,
+		ADD CONSTRAINT fk_user_user_id_to_events_user_id FOREIGN KEY (user_id) REFERENCES e_commerce.users (user_id) ON DELETE CASCADE;
+END $$;
+
+-- q2: purchases of the friends of a user (events by event_type, joined on user_id).
+CREATE INDEX IF NOT EXISTS events_event_type_user_id_idx ON e_commerce.events (event_type, user_id) INCLUDE (product_card_pk);
+
+-- q1, q2: friendships looked up from their second member (the primary key leads with friend1).
+CREATE INDEX IF NOT EXISTS friends_friend2_idx ON e_commerce.friends (friend2, friend1);
+
+-- q1: behaviors by type (e.g. 'purchased') joined on message_id.
+CREATE INDEX IF NOT EXISTS message_behaviors_type_message_id_idx ON e_commerce.message_behaviors (type, message_id) INCLUDE (happened_first_time);
+
+-- q1: sent messages joined on their message (foreign key without an index).
+CREATE INDEX IF NOT EXISTS message_sent_id_idx ON e_commerce.message_sent (id) INCLUDE (client_id, sent_at);
+
+-- sent_at range scans: message_sent rows keep the order of the source messages file, which roughly follows sent_at,
+-- so a BRIN index prunes most blocks at a fraction of the size of a B-tree.
+CREATE INDEX IF NOT EXISTS message_sent_sent_at_brin_idx ON e_commerce.message_sent USING brin (sent_at);
+
+-- q3: full-text search on category_code. The index expression, like q3.sql, names the text search configuration,
+-- since to_tsvector(text) depends on default_text_search_config and cannot be indexed.
+CREATE INDEX IF NOT EXISTS products_category_code_fts_idx ON e_commerce.products USING gin (to_tsvector('english', category_code));
+
+-- q3: brand of the matching products. The unique key of product_cards leads with brand, not product_pk.
+CREATE INDEX IF NOT EXISTS product_cards_product_pk_idx ON e_commerce.product_cards (product_pk) INCLUDE (brand);
+
+ANALYZE e_commerce.events;
+ANALYZE e_commerce.friends;
+ANALYZE e_commerce.message_behaviors;
+ANALYZE e_commerce.message_sent;
+ANALYZE e_commerce.product_cards;
+ANALYZE e_commerce.products;
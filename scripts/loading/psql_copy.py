@@ -0,0 +1,364 @@
+"""Binary COPY of the PSQL tables straight into PostgreSQL.
+
+With `clean_data.py --psql-load`, no PSQL CSV file is written: every table (or
+every chunk, when streaming) is encoded in the binary COPY format and sent with
+`COPY ... FROM STDIN (FORMAT binary)`. The emitter workers load the tables of a
+stage in parallel, each over its own connection.
+
+The schema comes from load_data_psql.sql, split in two:
+
+- before the load, the tables are dropped and created again without their keys,
+  constraints and indexes, so COPY only appends rows;
+- after the load, the primary keys, unique and check constraints and indexes are
+  built (one connection per table, in parallel), then the foreign keys, and the
+  serial sequences are moved past the loaded keys.
+
+Naive timestamps are sent as they are; for `timestamp WITH TIME ZONE` columns
+they are taken as UTC, as the raw event_time is.
+"""
+import configparser
+import io
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+import pandas as pd
+import psycopg2
+import pyarrow as pa
+
+from transforms import UUID_DIGITS
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_PATH = Path(__file__).with_name('load_data_psql.sql')
+CONFIG_PATH = Path('scripts/analysis/config.ini')
+# Rows encoded per COPY data block: bounds the memory of the byte scatter.
+COPY_ROWS = 50_000
+# Output files whose table has another name.
+FILE_TABLES = {'message_behavior.csv': 'message_behaviors'}
+
+# Binary representation of every column type of load_data_psql.sql (first matching prefix).
+COLUMN_KINDS = [
+    ('timestamp with time zone', 'timestamptz'),
+    ('timestamp', 'timestamp'),
+    ('bigserial', 'int8'),
+    ('serial', 'int4'),
+    ('bigint', 'int8'),
+    ('integer', 'int4'),
+    ('smallint', 'int2'),
+    ('real', 'float4'),
+    ('double precision', 'float8'),
+    ('boolean', 'bool'),
+    ('date', 'date'),
+    ('uuid', 'uuid'),
+    ('varchar', 'text'),
+    ('text', 'text'),
+]
+FIXED_WIDTH = {'int2': '>i2', 'int4': '>i4', 'int8': '>i8', 'float4': '>f4', 'float8': '>f8'}
+
+COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + np.array([0, 0], '>i4').tobytes()
+COPY_TRAILER = np.array([-1], '>i2').tobytes()
+PG_EPOCH = np.datetime64('2000-01-01T00:00:00', 'us')
+# Hex digit value of every byte (16 for non-hex bytes).
+HEX_VALUES = np.full(256, 16, np.uint8)
+HEX_VALUES[np.frombuffer(b'0123456789', np.uint8)] = np.arange(10)
+HEX_VALUES[np.frombuffer(b'abcdef', np.uint8)] = np.arange(10, 16)
+HEX_VALUES[np.frombuffer(b'ABCDEF', np.uint8)] = np.arange(10, 16)
+
+
+# ------------------------------------------------------------------------------
+# SCHEMA
+# ------------------------------------------------------------------------------
+@dataclass
+class Table:
+    schema: str
+    name: str
+    columns: Dict[str, str]     # column -> binary kind
+    definitions: List[str]      # column definitions, without PRIMARY KEY
+    keys: List[str] = field(default_factory=list)          # ALTER TABLE statements, built first
+    foreign_keys: List[str] = field(default_factory=list)  # ALTER TABLE statements, built last
+    serials: List[str] = field(default_factory=list)
+
+    @property
+    def qualified(self) -> str:
+        return f'{self.schema}.{self.name}'
+
+    def create(self) -> str:
+        return f'CREATE TABLE {self.qualified} (\n\t' + ',\n\t'.join(self.definitions) + '\n)'
+
+
+def _split_items(body: str) -> List[str]:
+    """The comma-separated items of a CREATE TABLE body, ignoring the commas inside parentheses."""
+    items, depth, start = [], 0, 0
+    for i, char in enumerate(body):
+        depth += (char == '(') - (char == ')')
+        if char == ',' and not depth:
+            items.append(body[start:i].strip())
+            start = i + 1
+    items.append(body[start:].strip())
+    return [item for item in items if item]
+
+
+def _column_kind(declaration: str) -> str:
+    declaration = declaration.lower()
+    for prefix, kind in COLUMN_KINDS:
+        if declaration.startswith(prefix):
+            return kind
+    raise ValueError(f"No binary COPY encoding for column type: {declaration}")
+
+
+def parse_schema(sql: str) -> Tuple[str, Dict[str, Table]]:
+    """The schema name and tables of load_data_psql.sql, with their keys and constraints split off."""
+    schema = re.search(r'CREATE SCHEMA IF NOT EXISTS (\w+);', sql).group(1)
+    tables = {}
+    for schema_name, name, body in re.findall(
+            r'CREATE TABLE IF NOT EXISTS (\w+)\.(\w+) \((.*?)\)\s*TABLESPACE \w+;', sql, re.DOTALL):
+        table = Table(schema_name, name, {}, [])
+        for item in _split_items(body):
+            alter = f'ALTER TABLE {table.qualified} ADD {item}'
+            if item.split()[0].upper() in ('CONSTRAINT', 'UNIQUE', 'PRIMARY', 'FOREIGN', 'CHECK'):
+                (table.foreign_keys if 'FOREIGN KEY' in item.upper() else table.keys).append(alter)
+                continue
+            column, declaration = item.split(None, 1)
+            table.columns[column] = _column_kind(declaration)
+            if re.search(r'\bPRIMARY KEY\b', declaration, re.IGNORECASE):
+                declaration = re.sub(r'\s*\bPRIMARY KEY\b', '', declaration, flags=re.IGNORECASE)
+                table.keys.append(f'ALTER TABLE {table.qualified} ADD PRIMARY KEY ({column})')
+            if declaration.lower().startswith(('serial', 'bigserial')):
+                table.serials.append(column)
+            table.definitions.append(f'{column} {declaration}')
+        tables[name] = table
+    # Indexes of load_data_psql.sql are built after the load too, with the keys of their table.
+    for statement, name in re.findall(r'(CREATE (?:UNIQUE )?INDEX [^;]*? ON (?:\w+\.)?(\w+)[^;]*);', sql):
+        tables[name].keys.append(statement)
+    return schema, tables
+
+
+SCHEMA, TABLES = parse_schema(SCHEMA_PATH.read_text(encoding='utf-8'))
+
+
+def table_for(file: str) -> Table:
+    """The table an output file (e.g. 'message_sent.csv') is loaded into."""
+    name = FILE_TABLES.get(file, Path(file).stem)
+    if name not in TABLES:
+        raise ValueError(f"{file}: no table {name} in {SCHEMA_PATH.name}")
+    return TABLES[name]
+
+
+def read_dsn(config_path=CONFIG_PATH) -> Dict[str, str]:
+    """psycopg2 connection parameters of the [postgresql] section of config.ini."""
+    config = configparser.ConfigParser()
+    if not config.read(config_path):
+        raise FileNotFoundError(f"PostgreSQL config not found: {config_path}")
+    return dict(config['postgresql'])
+
+
+# ------------------------------------------------------------------------------
+# BINARY ENCODING
+# ------------------------------------------------------------------------------
+def _utf8(values: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """Byte lengths and concatenated UTF-8 bytes of non-null values, through an Arrow string array."""
+    array = pa.array(values, from_pandas=True)
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    if pa.types.is_dictionary(array.type):
+        array = array.dictionary_decode()
+    if array.type != pa.string():
+        array = array.cast(pa.string())
+    if not len(array):
+        return np.empty(0, np.int32), np.empty(0, np.uint8)
+    offsets = np.frombuffer(array.buffers()[1], np.int32)[array.offset:array.offset + len(array) + 1]
+    data = array.buffers()[2]
+    data = np.frombuffer(data, np.uint8)[offsets[0]:offsets[-1]] if data is not None else np.empty(0, np.uint8)
+    return np.diff(offsets).astype(np.int32), data
+
+
+def _naive_utc(values: pd.Series) -> np.ndarray:
+    values = pd.to_datetime(values)
+    if values.dt.tz is not None:
+        values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+    return values.to_numpy('datetime64[us]')
+
+
+def encode_field(values: pd.Series, kind: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Field lengths (-1 for NULL) and concatenated field bytes of a column, in binary COPY format."""
+    null = values.isna().to_numpy()
+    present = values[~null]
+    if kind in FIXED_WIDTH:
+        dtype = 'float64' if kind.startswith('float') else 'int64'
+        data = present.to_numpy(dtype=dtype).astype(FIXED_WIDTH[kind])
+        width = data.itemsize
+    elif kind == 'bool':
+        data, width = present.to_numpy(dtype=bool), 1
+    elif kind in ('timestamp', 'timestamptz'):
+        data, width = (_naive_utc(present) - PG_EPOCH).astype('>i8'), 8
+    elif kind == 'date':
+        days = _naive_utc(present).astype('datetime64[D]') - PG_EPOCH.astype('datetime64[D]')
+        data, width = days.astype('>i4'), 4
+    elif kind == 'uuid':
+        lengths, text = _utf8(present)
+        if (lengths != 36).any():
+            raise ValueError(f"{values.name}: not a UUID (8-4-4-4-12 hex digits)")
+        digits = HEX_VALUES[text.reshape(-1, 36)[:, UUID_DIGITS]]
+        if (digits > 15).any():
+            raise ValueError(f"{values.name}: not a UUID (8-4-4-4-12 hex digits)")
+        data, width = (digits[:, 0::2] << 4) | digits[:, 1::2], 16
+    else:
+        text_lengths, data = _utf8(present)
+        lengths = np.full(len(values), -1, np.int32)
+        lengths[~null] = text_lengths
+        return lengths, data
+    lengths = np.where(null, -1, width).astype(np.int32)
+    return lengths, np.ascontiguousarray(data).view(np.uint8).reshape(-1)
+
+
+def _scatter(out: np.ndarray, starts: np.ndarray, sizes: np.ndarray, data: np.ndarray):
+    """Copy the consecutive runs of `sizes` bytes of `data` to out[starts[i]:starts[i] + sizes[i]]."""
+    ends = np.cumsum(sizes)
+    if not len(ends) or not ends[-1]:
+        return
+    out[np.repeat(starts - (ends - sizes), sizes) + np.arange(ends[-1])] = data
+
+
+def encode_rows(frame: pd.DataFrame, kinds: List[str]) -> bytes:
+    """The binary COPY tuples of `frame` (one field per column, of the given kinds), without header."""
+    fields = [encode_field(frame.iloc[:, i], kind) for i, kind in enumerate(kinds)]
+    rows = len(frame)
+    sizes = np.full(rows, 2, np.int64)
+    for lengths, _ in fields:
+        sizes += 4 + np.maximum(lengths, 0)
+    out = np.empty(int(sizes.sum()), np.uint8)
+    starts = np.cumsum(sizes) - sizes
+    _scatter(out, starts, np.full(rows, 2), np.tile(np.array([len(fields)], '>i2').view(np.uint8), rows))
+    starts += 2
+    for lengths, data in fields:
+        _scatter(out, starts, np.full(rows, 4), lengths.astype('>i4').view(np.uint8))
+        starts += 4
+        size = np.maximum(lengths, 0)
+        _scatter(out, starts, size, data)
+        starts += size
+    return out.tobytes()
+
+
+class CopyStream(io.RawIOBase):
+    """File-like binary COPY stream of a frame, encoded `rows` rows at a time as COPY reads it."""
+
+    def __init__(self, frame: pd.DataFrame, kinds: List[str], rows: int = COPY_ROWS):
+        self.blocks = self._blocks(frame, kinds, rows)
+        self.pending = b''
+
+    @staticmethod
+    def _blocks(frame, kinds, rows) -> Iterator[bytes]:
+        yield COPY_HEADER
+        for start in range(0, len(frame), rows):
+            yield encode_rows(frame.iloc[start:start + rows], kinds)
+        yield COPY_TRAILER
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            block = next(self.blocks, None)
+            if block is None:
+                return 0
+            self.pending = memoryview(block)
+        n = min(len(buffer), len(self.pending))
+        buffer[:n], self.pending = self.pending[:n], self.pending[n:]
+        return n
+
+
+# ------------------------------------------------------------------------------
+# LOAD
+# ------------------------------------------------------------------------------
+def table_frame(df: pd.DataFrame, index: bool = True, columns=None) -> pd.DataFrame:
+    """The columns to_csv would write (index levels first), as plain columns."""
+    if columns is not None:
+        df = df[columns]
+    return df.reset_index() if index else df
+
+
+def copy_frame(connection, table: Table, frame: pd.DataFrame) -> int:
+    """COPY the columns of `frame` into `table`, in the current transaction of `connection`."""
+    unknown = [col for col in frame.columns if col not in table.columns]
+    if unknown:
+        raise ValueError(f"Columns {unknown} are not in table {table.qualified}")
+    kinds = [table.columns[col] for col in frame.columns]
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {table.qualified} ({', '.join(frame.columns)}) FROM STDIN (FORMAT binary)",
+                           CopyStream(frame, kinds), size=1024**2)
+    return len(frame)
+
+
+def copy_table(dsn: Dict[str, str], file: str, df: pd.DataFrame, index: bool = True, columns=None) -> str:
+    """Load a whole table over a new connection, as one transaction."""
+    table = table_for(file)
+    with psycopg2.connect(**dsn) as connection:
+        copy_frame(connection, table, table_frame(df, index, columns))
+    connection.close()
+    return table.qualified
+
+
+class CopyWriter:
+    """Stream DataFrame chunks into one table with one COPY per chunk, committed on exit."""
+
+    def __init__(self, dsn: Dict[str, str], file: str, index: bool = True):
+        self.dsn = dsn
+        self.table = table_for(file)
+        self.index = index
+        self.rows = 0
+
+    def __enter__(self):
+        self.connection = psycopg2.connect(**self.dsn)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+        finally:
+            self.connection.close()
+
+    def write(self, df: pd.DataFrame):
+        self.rows += copy_frame(self.connection, self.table, table_frame(df, self.index))
+
+
+def create_tables(dsn: Dict[str, str]):
+    """Drop the tables and create them again without keys, constraints and indexes."""
+    with psycopg2.connect(**dsn) as connection, connection.cursor() as cursor:
+        cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {SCHEMA}')
+        cursor.execute('DROP TABLE IF EXISTS ' + ', '.join(t.qualified for t in TABLES.values()) + ' CASCADE')
+        for table in TABLES.values():
+            cursor.execute(table.create())
+    connection.close()
+    logger.info("[PSQL]: Created %s tables in %s, keys and constraints deferred", len(TABLES), SCHEMA)
+
+
+def _execute(dsn: Dict[str, str], statements: List[str]) -> float:
+    start = time.perf_counter()
+    with psycopg2.connect(**dsn) as connection, connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+    connection.close()
+    return time.perf_counter() - start
+
+
+def add_constraints(dsn: Dict[str, str], workers: int = 4):
+    """Build the deferred keys and indexes (tables in parallel), then the foreign keys; reset the sequences."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        seconds = dict(zip(TABLES, pool.map(lambda t: _execute(dsn, t.keys), TABLES.values())))
+    for name, elapsed in seconds.items():
+        logger.info("[PSQL]: Keys of %s built in %.2fs", name, elapsed)
+    elapsed = _execute(dsn, [statement for table in TABLES.values() for statement in table.foreign_keys])
+    logger.info("[PSQL]: Foreign keys built in %.2fs", elapsed)
+    _execute(dsn, [f"SELECT setval(pg_get_serial_sequence('{table.qualified}', '{column}'), "
+                   f"COALESCE(max({column}), 0) + 1, false) FROM {table.qualified}"
+                   for table in TABLES.values() for column in table.serials]
+             + [f'ANALYZE {table.qualified}' for table in TABLES.values()])
@@ -0,0 +1,85 @@
+"""Parquet copies of the PSQL tables, for the embedded columnar backend of the analysis (scripts/analysis/columnar.py).
+
+Every output/psql/<file>.csv is converted to <table>.parquet in PARQUET_PATH,
+named and typed after its table in load_data_psql.sql (psql_copy.TABLES):
+the CSV is read by the pyarrow CSV reader in blocks and written one row group
+per block, so a table never has to fit in memory. Naive timestamps of
+`timestamp WITH TIME ZONE` columns are taken as UTC, as with binary COPY.
+
+Run it with `clean_data.py --parquet`, or on its own after a run that wrote
+the CSV files (not --psql-load):
+
+    uv run python scripts/loading/psql_parquet.py
+"""
+import argparse
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from paths import PSQL_CLEANED_PATH, PARQUET_PATH
+from psql_copy import table_for, Table
+from telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+# Arrow type of every binary COPY kind of psql_copy.py.
+ARROW_TYPES = {
+    'int2': pa.int16(), 'int4': pa.int32(), 'int8': pa.int64(),
+    'float4': pa.float32(), 'float8': pa.float64(), 'bool': pa.bool_(), 'date': pa.date32(),
+    'timestamp': pa.timestamp('us'), 'timestamptz': pa.timestamp('us'),
+    'uuid': pa.string(), 'text': pa.string(),
+}
+BLOCK_BYTES = 64 * 1024**2
+
+
+def convert_table(csv_path: Path, table: Table, directory: Path) -> Tuple[str, int]:
+    """Write `csv_path` as `directory/<table>.parquet`; returns (table, rows)"""
+    column_types = {column: ARROW_TYPES[kind] for column, kind in table.columns.items()}
+    reader = pacsv.open_csv(csv_path, read_options=pacsv.ReadOptions(block_size=BLOCK_BYTES),
+                            convert_options=pacsv.ConvertOptions(column_types=column_types,
+                                                                 strings_can_be_null=True))
+    fields = [field.with_type(pa.timestamp('us', tz='UTC'))
+              if table.columns.get(field.name) == 'timestamptz' else field for field in reader.schema]
+    schema, rows = pa.schema(fields), 0
+    # Written next to the target and renamed, so a reader never maps a half-written file.
+    temporary = directory / f'{table.name}.parquet.tmp'
+    with pq.ParquetWriter(temporary, schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch.cast(schema))
+            rows += batch.num_rows
+    os.replace(temporary, directory / f'{table.name}.parquet')
+    return table.name, rows
+
+
+@telemetry.track
+def convert(source: Path = PSQL_CLEANED_PATH, directory: Path = PARQUET_PATH, workers: int = 4) -> Dict[str, int]:
+    """Convert every PSQL CSV file of `source` with a table in load_data_psql.sql; returns table -> rows"""
+    directory.mkdir(exist_ok=True, parents=True)
+    jobs: List[Tuple[Path, Table]] = []
+    for csv_path in sorted(source.glob('*.csv')):
+        try:
+            jobs.append((csv_path, table_for(csv_path.name)))
+        except ValueError:
+            # Files loaded as updates (product_updates.csv), not as tables.
+            logger.info("%s has no table, not converted", csv_path.name)
+    # The CSV reader and the Parquet writer release the GIL.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        tables = dict(executor.map(lambda job: convert_table(*job, directory), jobs))
+    logger.info("[PARQUET]: %s tables written to %s, %s rows", len(tables), directory, sum(tables.values()))
+    return tables
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Convert the PSQL CSV outputs to Parquet for the columnar backend.")
+    parser.add_argument('--source', type=Path, default=PSQL_CLEANED_PATH)
+    parser.add_argument('--output', type=Path, default=PARQUET_PATH)
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count()))
+    args = parser.parse_args()
+    convert(args.source, args.output, args.workers)
@@ -0,0 +1,249 @@
+import io
+from dataclasses import dataclass
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+
+MESSAGES_DATE_COLUMNS = [
+    'clicked_first_time_at',
+    'clicked_last_time_at',
+    'opened_first_time_at',
+    'opened_last_time_at',
+    'unsubscribed_at',
+    'hard_bounced_at',
+    'soft_bounced_at',
+    'complained_at',
+    'purchased_at',
+    'blocked_at',
+    'created_at',
+    'sent_at',
+    'updated_at'
+]
+MESSAGES_DROP_COLUMNS = ['category', 'date', 'id','stream']
+
+MESSAGES_OPTIONS = dict(
+    parse_dates=MESSAGES_DATE_COLUMNS,
+    date_format='%Y-%m-%d %H:%M:%S.%f',
+    true_values=['t'], false_values=['f'],
+    dtype={
+        'message_id': 'string',
+        'campaign_id': 'int32',
+        'message_type': 'category',
+        'channel': 'category',
+        'platform': 'category',
+        'stream':'category',
+        'email_provider': 'string',
+        'user_device_id': 'int16',
+        'user_id': 'int32'
+    }
+)
+
+EVENTS_OPTIONS = dict(
+    parse_dates=['event_time'],
+    date_format='%Y-%m-%d %H:%M:%S UTC',
+    dtype={
+        'event_type': 'category',
+        'product_id': 'int32',
+        'category_id': 'int64',
+        'category_code': 'category',
+        'brand': 'category',
+        'price': 'float32',
+        'user_id': 'int32',
+        'user_session': 'string'
+    }
+)
+
+# Arrow types of the same columns for the pyarrow CSV engine. UUIDs are Arrow strings,
+# repetitive strings are dictionary-encoded (categories) and the is_* flags booleans.
+DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+
+MESSAGES_ARROW_TYPES = {
+    'message_id': pa.string(),
+    'campaign_id': pa.int32(),
+    'message_type': DICTIONARY,
+    'client_id': pa.int64(),
+    'channel': DICTIONARY,
+    'platform': DICTIONARY,
+    'email_provider': DICTIONARY,
+    **{f'is_{b}': pa.bool_() for b in ['opened', 'clicked', 'unsubscribed', 'hard_bounced', 'soft_bounced',
+                                       'complained', 'blocked', 'purchased']},
+    **{col: pa.timestamp('us') for col in MESSAGES_DATE_COLUMNS},
+    'user_device_id': pa.int16(),
+    'user_id': pa.int32(),
+}
+
+EVENTS_ARROW_TYPES = {
+    'event_time': pa.timestamp('s'),
+    'event_type': DICTIONARY,
+    'product_id': pa.int32(),
+    'category_id': pa.int64(),
+    'category_code': DICTIONARY,
+    'brand': DICTIONARY,
+    'price': pa.float32(),
+    'user_id': pa.int32(),
+    'user_session': pa.string(),
+}
+
+
+@dataclass
+class Ingestion:
+    """How messages.csv and events.csv are parsed: 'numpy' (pandas C engine) or 'arrow' (pyarrow CSV engine).
+
+    The arrow mode keeps UUIDs as Arrow-backed strings and the repetitive strings
+    (email_provider included) as categories, so the frames take about half the
+    memory, and parses dates in Arrow instead of pandas."""
+    dtypes: str = 'numpy'
+
+    def use(self, dtypes: str):
+        self.dtypes = dtypes
+
+    def strings(self):
+        """Context in which the 'string' columns read back from Parquet or Arrow files get the storage of this mode
+        (their files do not record it); the pandas option is restored on exit."""
+        return pd.option_context('mode.string_storage', 'pyarrow' if self.dtypes == 'arrow' else 'python')
+
+
+ingestion = Ingestion()
+
+
+def _arrow_csv(column_types: dict, timestamp_format: str):
+    return pv.ConvertOptions(column_types=column_types, include_columns=list(column_types),
+                             timestamp_parsers=[timestamp_format], strings_can_be_null=True,
+                             true_values=['t'], false_values=['f'])
+
+
+MESSAGES_ARROW_OPTIONS = _arrow_csv(MESSAGES_ARROW_TYPES, pv.ISO8601)
+EVENTS_ARROW_OPTIONS = _arrow_csv(EVENTS_ARROW_TYPES, EVENTS_OPTIONS['date_format'])
+
+
+def _arrow_to_pandas(table: pa.Table) -> pd.DataFrame:
+    df = table.to_pandas(types_mapper={pa.string(): pd.StringDtype('pyarrow')}.get,
+                         coerce_temporal_nanoseconds=True)
+    # Sorted categories, as read_csv makes them, so that ordering by a category is the same in both modes.
+    for col in df.select_dtypes('category'):
+        df[col] = df[col].cat.reorder_categories(sorted(df[col].cat.categories))
+    return df
+
+
+class ByteRange(io.RawIOBase):
+    """Bytes [start, end) of a CSV file, preceded by its header line when start is past it."""
+
+    def __init__(self, path, start=0, end=None):
+        self.file = open(path, 'rb')
+        header = self.file.readline()
+        self.prefix = header if start > len(header) else b''
+        self.file.seek(start if self.prefix else 0)
+        self.remaining = (end if end is not None else float('inf')) - self.file.tell()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.prefix:
+            n = min(len(buffer), len(self.prefix))
+            buffer[:n], self.prefix = self.prefix[:n], self.prefix[n:]
+            return n
+        data = self.file.read(int(min(len(buffer), self.remaining)))
+        self.remaining -= len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def _iter_csv(path, chunksize: int, start: int, end, options: dict):
+    with io.BufferedReader(ByteRange(path, start, end)) as source, \
+         pd.read_csv(source, chunksize=chunksize, **options) as reader:
+        yield from (chunk for chunk in reader if len(chunk))
+
+
+def _iter_arrow_csv(path, chunksize: int, start: int, end, options: pv.ConvertOptions):
+    """Like _iter_csv with the pyarrow engine: its record batches regrouped into chunks of `chunksize` rows."""
+    with io.BufferedReader(ByteRange(path, start, end)) as source:
+        batches, rows = [], 0
+        for batch in pv.open_csv(source, convert_options=options):
+            batches.append(batch)
+            rows += len(batch)
+            while rows >= chunksize:
+                table = pa.Table.from_batches(batches)
+                yield _arrow_to_pandas(table.slice(0, chunksize))
+                batches, rows = table.slice(chunksize).to_batches(), rows - chunksize
+        if rows:
+            yield _arrow_to_pandas(pa.Table.from_batches(batches))
+
+
+def read_messages(path) -> pd.DataFrame:
+    if ingestion.dtypes == 'arrow':
+        return _arrow_to_pandas(pv.read_csv(path, convert_options=MESSAGES_ARROW_OPTIONS))
+    return pd.read_csv(path, **MESSAGES_OPTIONS).drop(columns=MESSAGES_DROP_COLUMNS)
+
+
+def iter_messages(path, chunksize: int, start=0, end=None):
+    """Yield messages.csv (or its rows between byte offsets start and end) in chunks of at most `chunksize` rows."""
+    if ingestion.dtypes == 'arrow':
+        yield from _iter_arrow_csv(path, chunksize, start, end, MESSAGES_ARROW_OPTIONS)
+        return
+    for chunk in _iter_csv(path, chunksize, start, end, MESSAGES_OPTIONS):
+        yield chunk.drop(columns=MESSAGES_DROP_COLUMNS)
+
+
+def read_events(path) -> pd.DataFrame:
+    if ingestion.dtypes == 'arrow':
+        return _arrow_to_pandas(pv.read_csv(path, convert_options=EVENTS_ARROW_OPTIONS))
+    return pd.read_csv(path, **EVENTS_OPTIONS)
+
+
+def iter_events(path, chunksize: int, start=0, end=None):
+    """Yield events.csv (or its rows between byte offsets start and end) in chunks of at most `chunksize` rows."""
+    if ingestion.dtypes == 'arrow':
+        yield from _iter_arrow_csv(path, chunksize, start, end, EVENTS_ARROW_OPTIONS)
+        return
+    yield from _iter_csv(path, chunksize, start, end, EVENTS_OPTIONS)
+
+
+def read_campaigns(path) -> pd.DataFrame:
+    return pd.read_csv(
+        path,
+        parse_dates=['started_at', 'finished_at'],
+        dtype={
+            'campaign_type': 'category',
+            'channel': 'category',
+            'topic': 'string',
+            'total_count': 'Int32',
+            'ab_test': 'boolean',
+            'warmup_mode': 'boolean',
+            'hour_limit': 'Int32',
+            'subject_length': 'Int16',
+            'subject_with_personalization': 'boolean',
+            'subject_with_deadline': 'boolean',
+            'subject_with_emoji': 'boolean',
+            'subject_with_bonuses': 'boolean',
+            'subject_with_discount': 'boolean',
+            'subject_with_saleout': 'boolean',
+            'is_test': 'boolean',
+            'position': 'Int16'
+        }
+    ).fillna({
+        'ab_test': False,
+        'warmup_mode': False,
+        'is_test': False
+    })
+
+
+def read_first_purchase(path) -> pd.DataFrame:
+    return pd.read_csv(
+        path,
+        parse_dates=['first_purchase_date'],
+        date_format='%Y-%m-%d',
+        dtype={'user_id': 'int32', 'user_device_id': 'int16'}
+    ).drop_duplicates(['client_id'])
+
+
+def read_friends(path) -> pd.DataFrame:
+    return pd.read_csv(
+        path,
+        dtype={'friend1': 'int32', 'friend2': 'int32'}
+    )
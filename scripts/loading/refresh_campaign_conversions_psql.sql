@@ -0,0 +1,19 @@
+-- Refresh of the campaign-conversion rollups with the delta of an incremental run of clean_data.py:
+-- its rows replace the rollups of the campaigns they list.
+--     psql -d <database> -f scripts/loading/refresh_campaign_conversions_psql.sql < output/delta/<run>/psql/campaign_conversions.csv
+SET search_path TO e_commerce, public;
+
+CREATE TEMPORARY TABLE campaign_conversions_delta (LIKE e_commerce.campaign_conversions);
+\COPY campaign_conversions_delta FROM pstdin DELIMITER ',' CSV HEADER;
+
+INSERT INTO e_commerce.campaign_conversions
+SELECT * FROM campaign_conversions_delta
+ON CONFLICT (campaign_id, campaign_type) DO UPDATE SET
+	total_messages = EXCLUDED.total_messages,
+	clients_with_interaction = EXCLUDED.clients_with_interaction,
+	users_purchased = EXCLUDED.users_purchased,
+	friends_who_also_purchased = EXCLUDED.friends_who_also_purchased,
+	conversion_rate = EXCLUDED.conversion_rate,
+	refreshed_at = EXCLUDED.refreshed_at;
+
+ANALYZE e_commerce.campaign_conversions;
@@ -0,0 +1,141 @@
+"""Campaign-conversion rollups: the q1 leaderboard, computed once at cleaning time.
+
+q1 counts, per campaign (id, campaign_type), the clients sent one of its
+messages, those of them who clicked or opened it, the users who purchased and
+those of them with a purchasing friend. The counts are computed here from three
+distinct fact tables, built with vectorized joins one frame (or chunk) of
+messages at a time:
+
+    sent         (campaign_id, campaign_type, client_id) of every message of a known campaign
+    interacted   (campaign_id, client_id) of the clicked and opened behaviors in the interaction window
+    purchasers   (campaign_id, user_id) of the purchased behaviors in the interaction window
+
+A behavior is in the interaction window when it happened within INTERACTION_WINDOW
+of sent_at and, for a bulk campaign, between its started_at and its finished_at
+(now if unfinished). As in q1.sql, interactions and purchases are matched on
+campaign_id only, the user of a client is digits 10-18 of its client_id, and a
+friend purchase is a purchaser who is the friend2 of another purchaser of the
+same campaign (friends as loaded: sorted, distinct pairs).
+
+The rollups are written as the campaign_conversions PSQL table and MongoDB
+collection, both indexed on conversion_rate, and as a Neo4j campaign_conversions.csv
+that campaign_conversions_neo4j.cypher sets as properties of the campaign nodes.
+The fact tables are part of the incremental state (incremental.py): an
+incremental run adds the facts of its new messages and writes the rollups of
+the campaigns they touched, which replace the loaded ones.
+"""
+import logging
+from dataclasses import dataclass, field
+from typing import Optional, Set
+
+import pandas as pd
+
+from dimensions import load_friends
+from writers import OutputDirs
+from telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+INTERACTION_WINDOW = pd.Timedelta(days=30)
+INTERACTIONS = ['clicked', 'opened']
+CAMPAIGN = ['campaign_id', 'campaign_type']
+ROLLUP_COLUMNS = [*CAMPAIGN, 'total_messages', 'clients_with_interaction', 'users_purchased',
+                  'friends_who_also_purchased', 'conversion_rate', 'refreshed_at']
+
+
+def client_users(client_id: pd.Series) -> pd.Series:
+    """The user_id of every client, as q1.sql reads it: SUBSTRING(client_id::varchar(19), 10, 9)::int"""
+    return client_id.astype(str).str[9:18].astype('int64')
+
+
+def message_facts(messages: pd.DataFrame, message_behavior: pd.DataFrame, campaigns: pd.DataFrame):
+    """(sent, interacted, purchasers) facts of `messages`, their behaviors and the campaigns they belong to."""
+    windows = campaigns[['id', 'campaign_type', 'started_at', 'finished_at']]\
+        .rename(columns={'id': 'campaign_id'}).astype({'campaign_type': str})
+    sent = messages[['message_id', 'campaign_id', 'message_type', 'client_id', 'sent_at']]\
+        .rename(columns={'message_type': 'campaign_type'}).astype({'campaign_type': str})\
+        .merge(windows, on=CAMPAIGN)
+
+    behaviors = message_behavior.reset_index()[['message_id', 'type', 'happened_first_time']]
+    behaviors = behaviors[behaviors['type'].isin(INTERACTIONS + ['purchased'])].merge(sent, on='message_id')
+    at = behaviors['happened_first_time']
+    in_window = (at >= behaviors['sent_at']) & (at <= behaviors['sent_at'] + INTERACTION_WINDOW) \
+        & ((behaviors['campaign_type'] != 'bulk')
+           | ((at >= behaviors['started_at']) & (at <= behaviors['finished_at'].fillna(pd.Timestamp.now()))))
+    behaviors = behaviors[in_window.values]
+
+    interacted = behaviors.loc[behaviors['type'].isin(INTERACTIONS).values, ['campaign_id', 'client_id']]
+    purchased = behaviors[(behaviors['type'] == 'purchased').values]
+    purchasers = pd.DataFrame({'campaign_id': purchased['campaign_id'].values,
+                               'user_id': client_users(purchased['client_id']).values})
+    return (sent[[*CAMPAIGN, 'client_id']].drop_duplicates(), interacted.drop_duplicates(),
+            purchasers.drop_duplicates())
+
+
+def _union(seen: Optional[pd.DataFrame], new: pd.DataFrame) -> pd.DataFrame:
+    return new.reset_index(drop=True) if seen is None else \
+        pd.concat([seen, new], ignore_index=True).drop_duplicates(ignore_index=True)
+
+
+@dataclass
+class ConversionFacts:
+    """The fact tables of the rollups, and the campaign ids whose rollups changed since the last emit."""
+    sent: Optional[pd.DataFrame] = None
+    interacted: Optional[pd.DataFrame] = None
+    purchasers: Optional[pd.DataFrame] = None
+    touched: Set[int] = field(default_factory=set)
+
+    def add(self, messages: pd.DataFrame, message_behavior: pd.DataFrame, campaigns: pd.DataFrame):
+        sent, interacted, purchasers = message_facts(messages, message_behavior, campaigns)
+        self.sent = _union(self.sent, sent)
+        self.interacted = _union(self.interacted, interacted)
+        self.purchasers = _union(self.purchasers, purchasers)
+        self.touched.update(sent['campaign_id'].unique().tolist())
+
+
+def conversion_rollups(facts: ConversionFacts, friends: pd.DataFrame, campaigns: pd.DataFrame,
+                       campaign_ids=None) -> pd.DataFrame:
+    """The rollup of every campaign of the facts (only of `campaign_ids` if given), by conversion_rate,
+    with the campaign_pk of the campaign node."""
+    sent, interacted, purchasers = facts.sent, facts.interacted, facts.purchasers
+    if campaign_ids is not None:
+        sent, interacted, purchasers = (df[df['campaign_id'].isin(campaign_ids)]
+                                        for df in (sent, interacted, purchasers))
+    sent = sent.assign(user_id=client_users(sent['client_id']).values)
+    users = sent[[*CAMPAIGN, 'user_id']].drop_duplicates()
+    # Purchasers who are the friend2 of another purchaser of the campaign (FriendPurchases of q1.sql).
+    friend_purchasers = purchasers.rename(columns={'user_id': 'friend1'})\
+        .merge(friends, on='friend1')\
+        .merge(purchasers.rename(columns={'user_id': 'friend2'}), on=['campaign_id', 'friend2'])\
+        [['campaign_id', 'friend2']].drop_duplicates().rename(columns={'friend2': 'user_id'})
+
+    rollups = sent.groupby(CAMPAIGN).size().rename('total_messages').to_frame()
+    rollups['clients_with_interaction'] = sent.merge(interacted, on=['campaign_id', 'client_id'])\
+        .groupby(CAMPAIGN).size()
+    rollups['users_purchased'] = users.merge(purchasers, on=['campaign_id', 'user_id']).groupby(CAMPAIGN).size()
+    rollups['friends_who_also_purchased'] = users.merge(friend_purchasers, on=['campaign_id', 'user_id'])\
+        .groupby(CAMPAIGN).size()
+    rollups = rollups.fillna(0).astype('int64')
+    rollups['conversion_rate'] = rollups['users_purchased'] * 100.0 / rollups['total_messages']
+    rollups['refreshed_at'] = pd.Timestamp.now().floor('s')
+    pks = campaigns[['id', 'campaign_type']].reset_index()\
+        .rename(columns={'id': 'campaign_id'}).astype({'campaign_type': str})
+    return rollups.reset_index().merge(pks, on=CAMPAIGN)\
+        .sort_values(['conversion_rate', *CAMPAIGN], ascending=[False, True, True], ignore_index=True)
+
+
+@telemetry.track
+def emit_rollups(facts: ConversionFacts, campaigns: pd.DataFrame, out: OutputDirs = None):
+    """Write the rollups of the campaigns touched since the last emit (all of them in a full run)."""
+    out = out or OutputDirs()
+    if facts.sent is None:
+        logger.warning("No messages, no campaign-conversion rollups written")
+        return
+    rollups = conversion_rollups(facts, load_friends(), campaigns, sorted(facts.touched))
+    logger.info("Campaign-conversion rollups of %s campaigns, top conversion rate %.2f%%",
+                len(rollups), rollups['conversion_rate'].max() if len(rollups) else 0)
+    out.psql.write(rollups, 'campaign_conversions.csv', index=False, columns=ROLLUP_COLUMNS)
+    with out.mongo.writer('campaign_conversions') as writer:
+        writer.write(rollups[ROLLUP_COLUMNS])
+    rollups[['campaign_pk', *ROLLUP_COLUMNS]].to_csv(out.neo4j.directory / 'campaign_conversions.csv', index=False)
+    facts.touched.clear()
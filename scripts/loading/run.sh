@@ -11,6 +11,8 @@ mongosh --file scripts\loading\load_data_mongodb.js
 .\scripts\loading\load_data_mongodb.bat
 ## Linux
 # bash .\scripts\loading\load_data_mongodb.bash
+## Or, batched and parallel, with a rows/s report (collections created by load_data_mongodb.js):
+# uv run python scripts/loading/bulk_load.py mongo --workers 8
 ################################### Neo4J ######################################
 # Windows
 neo4j.bat start
@@ -0,0 +1,123 @@
+"""Named pipeline stages with cached Parquet results.
+
+Every stage returns a dictionary of DataFrames that is saved as Parquet under
+the cache directory, together with a fingerprint of its input files, its code
+and the fingerprints of the stages it depends on. On the next run a stage is
+skipped when its fingerprint is unchanged and its output files still exist;
+its results are then read back from Parquet only if a recomputed stage needs them.
+Every executed stage is a telemetry section, with its rows in/out and output files.
+"""
+import hashlib
+import inspect
+import json
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import pandas as pd
+
+from readers import ingestion
+from telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable[..., Dict[str, pd.DataFrame]]
+    inputs: List[Path] = field(default_factory=list)
+    deps: List[str] = field(default_factory=list)
+    code: List[Any] = field(default_factory=list)
+    # Paths, or callables returning a path that depends on run options.
+    outputs: List[Any] = field(default_factory=list)
+
+
+class Pipeline:
+    def __init__(self, cache_path: Path, force: bool = False):
+        self.cache_path = Path(cache_path)
+        self.force = force
+        self.stages: Dict[str, Stage] = {}
+        self.results: Dict[str, Dict[str, pd.DataFrame]] = {}
+        self.fingerprints: Dict[str, str] = {}
+        self.manifest_path = self.cache_path / 'manifest.json'
+
+    def stage(self, name, inputs=(), deps=(), code=(), outputs=()):
+        """Register the decorated function as a stage.
+
+        Upstream results are passed as keyword arguments named after their result keys."""
+        def decorator(func):
+            self.stages[name] = Stage(name, func, [Path(p) for p in inputs], list(deps),
+                                      list(code), list(outputs))
+            return func
+        return decorator
+
+    def fingerprint(self, stage: Stage) -> str:
+        digest = hashlib.sha256()
+        for path in stage.inputs:
+            stat = path.stat()
+            digest.update(f'{path}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+        for obj in [stage.func] + stage.code:
+            # Modules, functions and classes are hashed by their source, settings (e.g. read_csv options) by repr.
+            source = inspect.getsource(obj) if callable(obj) or inspect.ismodule(obj) else repr(obj)
+            digest.update(source.encode())
+        for dep in stage.deps:
+            digest.update(self.fingerprints[dep].encode())
+        return digest.hexdigest()
+
+    def _load_manifest(self) -> Dict[str, Dict]:
+        if self.manifest_path.exists():
+            return json.loads(self.manifest_path.read_text())
+        return {}
+
+    def _result_path(self, stage_name: str, key: str) -> Path:
+        return self.cache_path / f'{stage_name}.{key}.parquet'
+
+    def _is_fresh(self, stage: Stage, entry: Dict) -> bool:
+        return not self.force \
+            and entry.get('fingerprint') == self.fingerprints[stage.name] \
+            and all(self._result_path(stage.name, key).exists() for key in entry.get('results', [])) \
+            and all(Path(path() if callable(path) else path).exists() for path in stage.outputs)
+
+    def result(self, stage_name: str, key: str) -> pd.DataFrame:
+        if key not in self.results.setdefault(stage_name, {}):
+            logger.info("Loading cached %s.%s from Parquet", stage_name, key)
+            with ingestion.strings():
+                self.results[stage_name][key] = pd.read_parquet(self._result_path(stage_name, key))
+        return self.results[stage_name][key]
+
+    def run(self):
+        self.cache_path.mkdir(exist_ok=True, parents=True)
+        manifest = self._load_manifest()
+        # Number of stages still to run that need each stage's results, to release them early.
+        consumers = {name: sum(name in s.deps for s in self.stages.values()) for name in self.stages}
+        for stage in self.stages.values():
+            self.fingerprints[stage.name] = self.fingerprint(stage)
+            if self._is_fresh(stage, manifest.get(stage.name, {})):
+                logger.info("Stage '%s' is up to date, skipping", stage.name)
+                telemetry.skipped(stage.name)
+            else:
+                logger.info("Running stage '%s'", stage.name)
+                # Only the upstream results named in the stage signature are loaded.
+                params = inspect.signature(stage.func).parameters
+                upstream = {key: self.result(dep, key)
+                            for dep in stage.deps
+                            for key in manifest[dep]['results'] if key in params}
+                outputs = [Path(path() if callable(path) else path) for path in stage.outputs]
+                with telemetry.section(stage.name, rows_in=sum(len(df) for df in upstream.values()) if upstream else None,
+                                       outputs=outputs) as section:
+                    results = stage.func(**upstream) or {}
+                    section.rows_out = sum(len(df) for df in results.values())
+                del(upstream)
+                for key, df in results.items():
+                    df.to_parquet(self._result_path(stage.name, key))
+                manifest[stage.name] = {'fingerprint': self.fingerprints[stage.name],
+                                        'results': list(results)}
+                self.manifest_path.write_text(json.dumps(manifest, indent=2))
+                if consumers[stage.name]:
+                    self.results[stage.name] = results
+            for dep in stage.deps:
+                consumers[dep] -= 1
+                if not consumers[dep]:
+                    self.results.pop(dep, None)
@@ -0,0 +1,229 @@
+"""Chunked, bounded-memory variant of the cleaning pipeline.
+
+messages.csv and events.csv are read `chunksize` rows at a time and every PSQL,
+MongoDB and Neo4j output is appended chunk by chunk. Only the StreamState
+(surrogate-key dictionaries, category_code counts, distinct clients/users,
+event deduplication boundaries and the fact tables of the campaign-conversion
+rollups) survives between chunks, so peak memory depends
+on the chunk size and the number of distinct entities, not on the number of
+messages or events. incremental.py persists the same state between runs.
+
+Differences from the in-memory run: message_behavior.csv is sorted by
+message_id within each chunk only, and rows of relationship files come out in
+chunk order. events.csv is expected to be ordered by event_time (as in the
+Kaggle dumps) for cross-chunk duplicate removal.
+"""
+import logging
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+import pandas as pd
+
+from paths import DATASET_PATH
+from readers import iter_messages, iter_events
+from transforms import (format_message_ids, extract_message_behaviors,
+                        convert_for_neo4J_node, convert_for_neo4J_rels, campaign_belongs_to,
+                        most_frequent, surrogate_keys, SurrogateKeys, TimeOrderedDeduplicator)
+from mongo_docs import group_message_behaviors
+from writers import ChunkedCsvWriter, OutputDirs
+from telemetry import telemetry
+from dimensions import load_campaigns, emit_campaigns, emit_clients, emit_friends_and_users
+from rollups import ConversionFacts, emit_rollups
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_KEYS = ['product_id', 'category_id']
+
+
+def _append_unique(seen: pd.DataFrame | pd.Series, new, subset=None):
+    """Append the rows of `new` whose key is not in `seen` yet, keeping first-appearance order."""
+    if isinstance(new, pd.Series):
+        new = new.drop_duplicates()
+        return new if seen is None else pd.concat([seen, new[~new.isin(seen)]])
+    new = new.drop_duplicates(subset)
+    return new if seen is None else pd.concat([seen, new[~new[subset].isin(seen[subset])]])
+
+
+@dataclass
+class StreamState:
+    """Everything carried from one chunk (or incremental run) to the next."""
+    message_keys: SurrogateKeys = field(
+        default_factory=lambda: SurrogateKeys(['campaign_id', 'message_type', 'channel'], 'id'))
+    # MongoDB/Neo4j products.
+    product_keys: SurrogateKeys = field(
+        default_factory=lambda: SurrogateKeys(['product_id', 'brand', 'category_id'], 'product_pk'))
+    # PSQL products and product cards. (product_id, category_id) -> product_pk is one-to-one,
+    # so a card is a distinct (product_id, category_id, brand).
+    product_pks: SurrogateKeys = field(default_factory=lambda: SurrogateKeys(PRODUCT_KEYS, 'product_pk'))
+    card_keys: SurrogateKeys = field(
+        default_factory=lambda: SurrogateKeys(['product_id', 'category_id', 'brand'], 'product_card_pk'))
+    # category_code counts, and the representative category_code of every PSQL product that has one.
+    code_counts: Optional[pd.DataFrame] = None
+    product_codes: Optional[pd.DataFrame] = None
+    clients: Optional[pd.DataFrame] = None
+    users: Optional[pd.Series] = None
+    event_dedup: TimeOrderedDeduplicator = field(
+        default_factory=lambda: TimeOrderedDeduplicator(['event_time','product_pk', 'user_id'], 'event_time'))
+    psql_event_dedup: TimeOrderedDeduplicator = field(
+        default_factory=lambda: TimeOrderedDeduplicator(['product_card_pk', 'user_id', 'event_time'], 'event_time'))
+    # Fact tables of the campaign-conversion rollups.
+    conversions: ConversionFacts = field(default_factory=ConversionFacts)
+
+
+# ------------------------------------------------------------------------------
+# PROCESS MESSAGES
+# ------------------------------------------------------------------------------
+@telemetry.track
+def stream_messages(chunks: Iterable[pd.DataFrame], campaigns: pd.DataFrame, state: StreamState, out: OutputDirs):
+    """Write every messages-derived output chunk by chunk; new clients and users are added to `state`."""
+    message_keys = state.message_keys
+    with ExitStack() as stack:
+        writers = {name: stack.enter_context(writer) for name, writer in {
+            'psql_behavior': out.psql.writer('message_behavior.csv'),
+            'neo4j_behavior': out.neo4j.writer('message_behavior.csv'),
+            'psql_sent': out.psql.writer('message_sent.csv'),
+            'neo4j_sent': out.neo4j.writer('message_sent.csv'),
+            'psql_messages': out.psql.writer('messages.csv'),
+            'neo4j_messages': out.neo4j.writer('messages.csv'),
+            'neo4j_belongs_to': ChunkedCsvWriter(out.neo4j.directory / 'messages_belong_to.csv', index=False),
+            'mongo_messages': out.mongo.writer('messages'),
+        }.items()}
+
+        for i, messages in enumerate(chunks):
+            messages = format_message_ids(messages)
+            messages, new_messages = message_keys.assign(messages)
+            state.clients = _append_unique(state.clients, messages[['client_id','user_id','user_device_id']],
+                                           'client_id')
+            state.users = _append_unique(state.users, messages['user_id'])
+
+            message_behavior = extract_message_behaviors(messages)
+            state.conversions.add(messages, message_behavior, campaigns)
+            writers['psql_behavior'].write(message_behavior)
+            writers['neo4j_behavior'].write(
+                messages.merge(message_behavior.reset_index(), 'right', 'message_id')\
+                    [['client_id','message_id',
+                      'type','happened_first_time','happened_last_time']]\
+                    .transform(convert_for_neo4J_rels, name='DO_BEHAVIOR', start_table='client', end_table='message'))
+
+            message_sent = messages[['message_id', 'id', 'client_id',
+                                     'email_provider', 'platform',
+                                     'sent_at']].set_index('message_id')
+            writers['psql_sent'].write(message_sent)
+            writers['neo4j_sent'].write(
+                message_sent.reset_index().drop(columns='id')\
+                    .transform(convert_for_neo4J_rels,
+                               name='SENT_TO', start_table='message', end_table='client'))
+            del(message_sent)
+
+            writers['psql_messages'].write(
+                messages.loc[messages['id'].isin(new_messages['id']),
+                             ['id', 'campaign_id', 'message_type',
+                              'channel','created_at', 'updated_at']]\
+                    .drop_duplicates('id').set_index('id'))
+            writers['neo4j_messages'].write(
+                messages[['message_id', 'campaign_id', 'message_type','channel']]\
+                    .transform(convert_for_neo4J_node, name='message'))
+
+            messages = messages[['message_id', 'campaign_id', 'message_type', 'client_id',
+                                 'channel', 'platform', 'email_provider',
+                                 'sent_at', 'created_at', 'updated_at']].drop_duplicates('message_id').set_index('message_id')
+            writers['mongo_messages'].write(group_message_behaviors(messages, message_behavior))
+            writers['neo4j_belongs_to'].write(campaign_belongs_to(campaigns, messages))
+            logger.info("Messages chunk %s processed, %s rows", i, len(messages))
+
+    logger.info("[PSQL]: %s abstract messages, %s message_sent rows, %s behaviors",
+                len(message_keys), writers['psql_sent'].rows, writers['psql_behavior'].rows)
+    emit_rollups(state.conversions, campaigns, out)
+
+
+# ------------------------------------------------------------------------------
+# PROCESS EVENTS & PRODUCTS
+# ------------------------------------------------------------------------------
+@telemetry.track
+def stream_events(chunks: Iterable[pd.DataFrame], state: StreamState, out: OutputDirs):
+    """Write every events-derived output in one pass over the chunks; new users are added to `state`.
+
+    The PSQL products and product cards first seen in these chunks are written at
+    the end. Known products whose representative category_code changed are listed
+    in product_updates.csv, which only an incremental run can produce."""
+    cards_before = len(state.card_keys)
+    with out.mongo.writer('products') as mongo_products, \
+         out.neo4j.writer('products.csv') as neo4j_products, \
+         out.mongo.writer('events') as mongo_events, \
+         out.neo4j.writer('events.csv') as neo4j_events, \
+         out.psql.writer('events.csv', index=False) as psql_events:
+        for i, events in enumerate(chunks):
+            state.users = _append_unique(state.users, events['user_id'])
+            counts = events.groupby(PRODUCT_KEYS + ['category_code'], observed=True)\
+                .size().reset_index(name='count')
+            counts['category_code'] = counts['category_code'].astype(object)
+            state.code_counts = counts if state.code_counts is None else \
+                pd.concat([state.code_counts, counts]).groupby(PRODUCT_KEYS + ['category_code'],
+                                                               as_index=False)['count'].sum()
+
+            events, _ = state.card_keys.assign(events)
+            psql_events.write(state.psql_event_dedup(events)[
+                ['product_card_pk', 'user_id', 'event_time', 'event_type', 'user_session', 'price']
+            ])
+
+            events, new_products = state.product_keys.assign(events, extra_cols=['category_code'])
+            mongo_products.write(new_products)
+            neo4j_products.write(new_products.transform(convert_for_neo4J_node, name='product'))
+            events = state.event_dedup(events)[['product_pk', 'user_id', 'event_time', 'event_type', 'user_session', 'price']]
+            mongo_events.write(events)
+            neo4j_events.write(events.transform(convert_for_neo4J_rels,
+                                                name='events', start_table='product', end_table='user'))
+            logger.info("Events chunk %s processed", i)
+    logger.info("[MONGODB/NEO4J]: %s unique products, %s events", len(state.product_keys), mongo_events.rows)
+    logger.info("[PSQL]: Final events table rows: %s", psql_events.rows)
+
+    #################################### PSQL ##########################################
+    logger.info("[PSQL]: Building product table.")
+    known_products = len(state.product_pks)
+    cards = state.card_keys.keys.iloc[cards_before:]
+    # New product_pk follow the sorted keys, rows stay in first-appearance order.
+    _, first = surrogate_keys(cards, PRODUCT_KEYS)
+    products = cards.iloc[first][PRODUCT_KEYS]
+    _, new_products = state.product_pks.assign(products.sort_values(PRODUCT_KEYS))
+    codes = pd.DataFrame(columns=PRODUCT_KEYS + ['category_code']) if state.code_counts is None \
+        else most_frequent(state.code_counts, PRODUCT_KEYS, 'category_code')
+    products = products.merge(new_products, on=PRODUCT_KEYS).merge(codes, on=PRODUCT_KEYS, how='left')
+    out.psql.write(products[['product_pk', 'product_id', 'category_id', 'category_code']]\
+        .set_index('product_pk'), 'products.csv')
+    logger.info("[PSQL]: Products table generated, shape: %s", products.shape)
+
+    if state.product_codes is not None and known_products:
+        updates = state.product_pks.keys.iloc[:known_products]\
+            .merge(codes, on=PRODUCT_KEYS, how='left')\
+            .merge(state.product_codes, on=PRODUCT_KEYS, how='left', suffixes=('', '_old'))
+        changed = updates['category_code'].ne(updates['category_code_old']) \
+            & updates['category_code'].notna()
+        updates = updates.loc[changed.values, ['product_pk', 'category_code']]
+        out.psql.write(updates, 'product_updates.csv', index=False)
+        logger.info("[PSQL]: %s products changed their category_code", len(updates))
+    state.product_codes = codes
+
+    product_cards = cards.merge(state.product_pks.keys, on=PRODUCT_KEYS)
+    out.psql.write(product_cards[['product_card_pk', 'product_pk', 'brand']]\
+        .set_index('product_card_pk'), 'product_cards.csv')
+    logger.info("[PSQL]: Product cards table generated, shape: %s", product_cards.shape)
+
+
+def run_streaming(chunksize: int, messages=None, events=None) -> StreamState:
+    """Full streaming run; `messages` and `events` default to all chunks of messages.csv and events.csv."""
+    logger.info("Streaming mode, chunk size: %s rows", chunksize)
+    state, out = StreamState(), OutputDirs()
+    campaigns = load_campaigns()
+    emit_campaigns(campaigns)
+    if messages is None:
+        messages = iter_messages(DATASET_PATH / 'messages.csv', chunksize)
+    stream_messages(messages, campaigns, state, out)
+    del(campaigns)
+    if events is None:
+        events = iter_events(DATASET_PATH / 'events.csv', chunksize)
+    stream_events(events, state, out)
+    clients, first_purchase = emit_clients(state.clients)
+    state.users = emit_friends_and_users(state.users, clients, first_purchase)
+    state.clients = clients[['client_id', 'user_id', 'user_device_id']]
+    return state
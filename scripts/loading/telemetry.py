@@ -0,0 +1,217 @@
+"""Per-section performance telemetry for the cleaning pipeline.
+
+Every `telemetry.section(name)` block records its wall and CPU time (own and of
+finished child processes, such as the emitter workers), RSS at entry and exit,
+peak RSS sampled in a background thread, rows in/out and the size of the files
+it wrote. Records are appended as JSON lines to the run report, one line per
+section plus a summary line, all tagged with the same run_id so that runs can
+be compared. One section can additionally be profiled with tracemalloc or
+cProfile.
+"""
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pandas as pd
+import psutil
+
+logger = logging.getLogger(__name__)
+
+PROFILERS = ['tracemalloc', 'cprofile']
+
+
+def path_bytes(path: Path) -> int:
+    """Size of a file, or of all files under a directory."""
+    path = Path(path)
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+    return path.stat().st_size if path.exists() else 0
+
+
+def _rows(*frames) -> Optional[int]:
+    sizes = [len(f) for f in frames if isinstance(f, (pd.DataFrame, pd.Series))]
+    return sum(sizes) if sizes else None
+
+
+class _RssSampler(threading.Thread):
+    def __init__(self, process: psutil.Process, interval: float):
+        super().__init__(daemon=True)
+        self.process = process
+        self.interval = interval
+        self.peak = process.memory_info().rss
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def stop(self) -> int:
+        self.stopped.set()
+        self.join()
+        return max(self.peak, self.process.memory_info().rss)
+
+
+class Section:
+    """Mutable record of a running section; set rows_in/rows_out and add outputs inside the block."""
+
+    def __init__(self, name: str, parent: Optional[str]):
+        self.name = name
+        self.parent = parent
+        self.rows_in: Optional[int] = None
+        self.rows_out: Optional[int] = None
+        self.outputs: List[Path] = []
+        self.extra: Dict = {}
+
+
+class Telemetry:
+    def __init__(self, report_path: Optional[Path] = None, sample_interval: float = 0.05):
+        self.report_path = report_path
+        self.sample_interval = sample_interval
+        self.profile_section: Optional[str] = None
+        self.profiler = 'tracemalloc'
+        self.run_id = uuid.uuid4().hex[:12]
+        self.records: List[Dict] = []
+        self.stack: List[Section] = []
+        self.process = psutil.Process()
+
+    @contextmanager
+    def section(self, name: str, rows_in: Optional[int] = None, outputs=()):
+        record = Section(name, self.stack[-1].name if self.stack else None)
+        record.rows_in = rows_in
+        record.outputs.extend(outputs)
+        self.stack.append(record)
+        profiler = self._start_profiler(name)
+        sampler = _RssSampler(self.process, self.sample_interval)
+        rss_start = sampler.peak
+        sampler.start()
+        children_start = self._children_cpu()
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        status = 'ok'
+        try:
+            yield record
+        except BaseException:
+            status = 'failed'
+            raise
+        finally:
+            wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            children = self._children_cpu() - children_start
+            peak_rss = sampler.stop()
+            rss_end = self.process.memory_info().rss
+            self.stack.pop()
+            entry = {
+                'run_id': self.run_id, 'section': name, 'parent': record.parent, 'status': status,
+                'wall_s': round(wall, 4), 'cpu_s': round(cpu, 4),
+                'cpu_children_s': round(children, 4),
+                'rss_start_mb': round(rss_start / 1024**2, 1), 'rss_end_mb': round(rss_end / 1024**2, 1),
+                'delta_rss_mb': round((rss_end - rss_start) / 1024**2, 1),
+                'peak_rss_mb': round(peak_rss / 1024**2, 1),
+                'rows_in': record.rows_in, 'rows_out': record.rows_out,
+                'output_bytes': {str(path): path_bytes(path) for path in record.outputs},
+                **record.extra,
+            }
+            entry.update(self._stop_profiler(name, profiler))
+            self.records.append(entry)
+            logger.info("[TELEMETRY]: %s: %.2fs wall, %.2fs CPU, peak RSS %.1f MB (%+.1f MB)",
+                        name, wall, cpu, entry['peak_rss_mb'], entry['delta_rss_mb'])
+
+    def track(self, func):
+        """Decorator running `func` as a section named after it; rows are counted on the frames passed and returned."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.section(func.__name__, rows_in=_rows(*args, *kwargs.values())) as section:
+                result = func(*args, **kwargs)
+                section.rows_out = _rows(*(result if isinstance(result, tuple) else (result,)))
+            return result
+        return wrapper
+
+    def add_writes(self, writes: List[Dict]):
+        """Attach per-file write timings (e.g. from the emitter workers) to the current section."""
+        if self.stack:
+            self.stack[-1].extra.setdefault('writes', []).extend(writes)
+
+    def _children_cpu(self) -> float:
+        # Only reaped child processes are counted (always 0 on Windows and macOS).
+        times = self.process.cpu_times()
+        return times.children_user + times.children_system
+
+    def skipped(self, name: str):
+        self.records.append({'run_id': self.run_id, 'section': name, 'parent': None, 'status': 'skipped'})
+
+    # --------------------------------------------------------------------------
+    # PROFILING
+    # --------------------------------------------------------------------------
+    def _start_profiler(self, name: str):
+        if name != self.profile_section:
+            return None
+        logger.info("[TELEMETRY]: Profiling section '%s' with %s", name, self.profiler)
+        if self.profiler == 'tracemalloc':
+            # One frame per trace: deeper tracebacks slow allocation-heavy pandas code by orders of magnitude.
+            tracemalloc.start(1)
+            return tracemalloc.take_snapshot()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _stop_profiler(self, name: str, profiler) -> Dict:
+        if profiler is None:
+            return {}
+        if isinstance(profiler, tracemalloc.Snapshot):
+            # Lines that allocated the memory still held at the end of the section.
+            _, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().compare_to(profiler, 'lineno')[:20]
+            tracemalloc.stop()
+            for stat in top[:10]:
+                logger.info("[TELEMETRY]: %s", stat)
+            return {'tracemalloc_peak_mb': round(peak / 1024**2, 1),
+                    'tracemalloc_top': [{'line': str(stat.traceback),
+                                         'size_diff_mb': round(stat.size_diff / 1024**2, 2),
+                                         'count_diff': stat.count_diff} for stat in top]}
+        profiler.disable()
+        stats_path = self._sibling(f'{name}.prof')
+        profiler.dump_stats(stats_path)
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(20)
+        logger.info("[TELEMETRY]: cProfile of '%s' (full stats in %s):\n%s", name, stats_path, text.getvalue())
+        return {'cprofile_stats': str(stats_path)}
+
+    def _sibling(self, name: str) -> Path:
+        directory = Path(self.report_path).parent if self.report_path else Path('.')
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory / f'{self.run_id}-{name}'
+
+    # --------------------------------------------------------------------------
+    # REPORT
+    # --------------------------------------------------------------------------
+    def write_report(self, **summary):
+        """Append the section records and a run summary line to the report."""
+        if self.report_path is None:
+            return
+        summary = {
+            'run_id': self.run_id, 'section': None, 'status': 'summary',
+            'finished_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'argv': sys.argv[1:], 'cpu_count': os.cpu_count(),
+            'max_rss_mb': max((r['peak_rss_mb'] for r in self.records if 'peak_rss_mb' in r), default=None),
+            'wall_s': round(sum(r.get('wall_s', 0) for r in self.records if r.get('parent') is None), 4),
+            **summary,
+        }
+        Path(self.report_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.report_path, 'a', encoding='utf-8') as report:
+            for record in self.records + [summary]:
+                report.write(json.dumps(record, default=str) + '\n')
+        logger.info("[TELEMETRY]: Run %s report appended to %s", self.run_id, self.report_path)
+
+
+telemetry = Telemetry()
@@ -0,0 +1,205 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def surrogate_keys(df: pd.DataFrame, key_cols, sort=False):
+    """Dense 1-based surrogate keys of the `key_cols` tuples of `df`, by hash factorization.
+
+    Keys follow the first appearance of each tuple (or the sorted tuple order with
+    `sort=True`); nulls compare equal, as in drop_duplicates. Returns the key of every
+    row and the position of the first row of every key."""
+    codes = None
+    for col in key_cols:
+        col_codes, uniques = pd.factorize(df[col], sort=sort, use_na_sentinel=False)
+        if codes is None:
+            codes = col_codes.astype(np.int64)
+        else:
+            # Combine pairwise and refactorize, so the combined code never overflows.
+            codes, _ = pd.factorize(codes * len(uniques) + col_codes, sort=sort)
+    first = np.empty(codes.max() + 1 if len(codes) else 0, dtype=np.intp)
+    first[codes[::-1]] = np.arange(len(codes) - 1, -1, -1)
+    return codes + 1, first
+
+
+# The 32 digits of a raw message_id ('<19 digits>-<13 digits>') and their positions in the 8-4-4-4-12 UUID layout.
+RAW_ID_DIGITS = np.r_[0:19, 20:33]
+UUID_DIGITS = np.r_[0:8, 9:13, 14:18, 19:23, 24:36]
+
+
+def format_message_ids(messages: pd.DataFrame) -> pd.DataFrame:
+    """Rewrite the raw message_id values as UUIDs by moving their bytes to fixed positions; other values are kept."""
+    ids = messages['message_id']
+    raw = ids.to_numpy(dtype='S34', na_value=b'').view(np.uint8).reshape(-1, 34)
+    # 33 bytes with the dash at position 19 (the 34th byte is only set by longer values).
+    is_raw = (raw[:, 19] == ord('-')) & (raw[:, 32] != 0) & (raw[:, 33] == 0)
+    uuids = np.full((is_raw.sum(), 36), ord('-'), np.uint8)
+    uuids[:, UUID_DIGITS] = raw[is_raw][:, RAW_ID_DIGITS]
+    ids = ids.copy()
+    ids[is_raw] = uuids.view('S36').ravel().astype(str)
+    messages['message_id'] = ids
+    return messages
+
+
+def extract_message_behaviors(messages: pd.DataFrame) -> pd.DataFrame:
+    """Unpivot the is_<behavior> flags of messages into a long (message_id, type) table.
+
+    Only the rows whose flag is set are taken from each column, so the work is
+    proportional to the number of behaviors, not messages x behavior types."""
+    # Identify behavior types from columns starting with 'is_'
+    behaviors_cols = [col.replace('is_', '') for col in messages.columns if col.startswith('is_')]
+    message_ids = messages['message_id'].reset_index(drop=True)
+    no_time = pd.Series(pd.NaT, index=messages.index, dtype='datetime64[ns]')
+    message_behavior_list = []
+    for b in behaviors_cols:
+        rows = np.flatnonzero((messages[f'is_{b}'] == True).to_numpy())
+        message_behavior_list.append(pd.DataFrame({
+            'message_id': message_ids.take(rows).reset_index(drop=True),
+            'type': b,
+            # Use the specific first/last columns if present; otherwise, fallback to <behavior>_at for first_time.
+            'happened_first_time': messages.get(f'{b}_first_time_at', messages.get(f'{b}_at', no_time))
+                                           .take(rows).reset_index(drop=True),
+            'happened_last_time': messages.get(f'{b}_last_time_at', no_time).take(rows).reset_index(drop=True),
+        }))
+    message_behavior = pd.concat(message_behavior_list, ignore_index=True)
+    message_behavior = message_behavior.sort_values(['message_id', 'happened_first_time'])
+    # Set a MultiIndex for clear identification of behavior per message.
+    return message_behavior.set_index(['message_id', 'type'])
+
+
+#################################### NEO4J ####################################
+def convert_for_neo4J_node(df, name):
+    """Rename the id column to its neo4j-admin header and add :LABEL, sharing the data of `df` (no copy)."""
+    df = df.set_axis([f'{df.columns[0]}:ID({name})', *df.columns[1:]], axis=1, copy=False)
+    df.insert(1, ':LABEL', name)
+    return df
+
+def convert_for_neo4J_rels(df, name, start_table, end_table, duplicate=True):
+    """Rename the start and end id columns to their neo4j-admin headers and add :TYPE, sharing the data of `df`.
+
+    With the same start and end table (and `duplicate`), the first column is both the start and the end id."""
+    start, *rest = df.columns
+    if (start_table==end_table) and duplicate:
+        df = df.set_axis([f'{start}:START_ID({start_table})', *rest], axis=1, copy=False)
+        df.insert(1, f'{start}:END_ID({end_table})', df.iloc[:, 0])
+    else:
+        df = df.set_axis([f'{start}:START_ID({start_table})', f'{rest[0]}:END_ID({end_table})', *rest[1:]],
+                         axis=1, copy=False)
+    df.insert(2, ':TYPE', name)
+    return df
+
+
+################################## CAMPAIGNS ##################################
+bulk_cols = ['started_at', 'finished_at', 'total_count', 'warmup_mode', 'hour_limit', 'ab_test']
+subject_cols = [
+    'subject_length',
+    'subject_with_personalization',
+    'subject_with_deadline',
+    'subject_with_emoji',
+    'subject_with_bonuses',
+    'subject_with_discount',
+    'subject_with_saleout'
+]
+trigger_cols = ['position']
+
+
+def filter_campaigns(campaigns: pd.DataFrame) -> pd.DataFrame:
+    return campaigns[~(
+        (campaigns['is_test'] == True)
+        | ((campaigns['campaign_type'] == 'bulk') &
+           (campaigns['started_at'].isna() | ((campaigns['warmup_mode'] == True) & campaigns['hour_limit'].isna())))
+        | ((campaigns['campaign_type'] == 'trigger') & campaigns['position'].isna())
+    )].drop(columns=['is_test'])
+
+
+def campaign_belongs_to(campaigns: pd.DataFrame, messages: pd.DataFrame) -> pd.DataFrame:
+    return campaigns.reset_index().merge(messages.reset_index(), how='inner',
+                    left_on=['id','campaign_type'],
+                    right_on=['campaign_id','message_type'])\
+                    [['message_id','campaign_pk','created_at','updated_at']]\
+                    .transform(convert_for_neo4J_rels,
+                               name='BELONGS_TO', start_table='message', end_table='campaign')
+
+
+################################### PRODUCTS ##################################
+def most_frequent(counts: pd.DataFrame, keys, value) -> pd.DataFrame:
+    """Row with the highest `count` per `keys` group of a (keys, value, count) table, without the count.
+
+    Ties go to the smallest value, as with Series.mode()."""
+    keys = list(keys)
+    return counts.sort_values(keys + ['count', value], ascending=[True] * len(keys) + [False, True])\
+                 .drop_duplicates(keys).drop(columns='count')
+
+
+def representative_values(df: pd.DataFrame, keys, value) -> pd.DataFrame:
+    """Most common non-null `value` of every `keys` group, in one groupby instead of one mode() per group.
+
+    Returns one row per group, sorted by keys; groups with only null values get NaN."""
+    keys = list(keys)
+    counts = df.groupby(keys + [value], observed=True).size().reset_index(name='count')
+    groups = df.groupby(keys).size().index.to_frame(index=False)
+    return groups.merge(most_frequent(counts, keys, value), how='left', on=keys)
+
+
+################################## STREAMING ##################################
+class SurrogateKeys:
+    """Dense 1-based surrogate keys for key tuples, in first-appearance order across chunks."""
+
+    def __init__(self, key_cols, name):
+        self.key_cols = list(key_cols)
+        self.name = name
+        self.keys = None
+
+    def __len__(self):
+        return 0 if self.keys is None else len(self.keys)
+
+    def assign(self, df: pd.DataFrame, extra_cols=()):
+        """Return `df` with the surrogate key column added, and the rows of newly seen keys."""
+        keys, first = surrogate_keys(df, self.key_cols)
+        uniques = df.iloc[first][self.key_cols + list(extra_cols)].reset_index(drop=True)
+        if self.keys is None:
+            ids = np.arange(1, len(uniques) + 1)
+        else:
+            # Known keys come first, so they get their ids back; new keys follow in order.
+            ids = surrogate_keys(pd.concat([self.keys[self.key_cols], uniques[self.key_cols]], ignore_index=True),
+                                 self.key_cols)[0][len(self):]
+        is_new = ids > len(self)
+        new = uniques[is_new].reset_index(drop=True)
+        new.insert(0, self.name, ids[is_new])
+        self.keys = pd.concat([self.keys, new[self.key_cols + [self.name]]], ignore_index=True)
+        return df.assign(**{self.name: ids[keys - 1]}), new
+
+
+class TimeOrderedDeduplicator:
+    """drop_duplicates(subset) across chunks of a file ordered by `time_col`.
+
+    A duplicate of an already emitted row can only share the latest timestamp seen so far,
+    so only the keys at that timestamp are carried over to the next chunk."""
+
+    def __init__(self, subset, time_col):
+        self.subset = list(subset)
+        self.time_col = time_col
+        self.boundary = None
+        self.last_time = None
+
+    def __call__(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        chunk = chunk.drop_duplicates(self.subset)
+        if chunk.empty:
+            return chunk
+        if self.boundary is not None:
+            if chunk[self.time_col].min() < self.last_time:
+                logger.warning("Chunk is not ordered by %s, cross-chunk duplicates may be kept", self.time_col)
+            seen = chunk[self.subset].merge(self.boundary, how='left', indicator=True)['_merge'] == 'both'
+            chunk = chunk[~seen.values]
+            if chunk.empty:
+                return chunk
+        last_time = chunk[self.time_col].max()
+        if self.last_time is None or last_time >= self.last_time:
+            tail = chunk.loc[chunk[self.time_col] == last_time, self.subset]
+            if self.boundary is not None and last_time == self.last_time:
+                tail = pd.concat([self.boundary, tail], ignore_index=True)
+            self.boundary, self.last_time = tail, last_time
+        return chunk
@@ -0,0 +1,277 @@
+import gzip
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import pandas as pd
+
+from paths import PSQL_CLEANED_PATH, MONGO_CLEANED_PATH, NEO4J_CLEANED_PATH
+import psql_copy
+
+# Rows serialized per to_json call, so no single string holds a whole collection.
+BATCH_ROWS = 100_000
+
+
+class ChunkedCsvWriter:
+    """Append DataFrame chunks to one CSV file, writing the header only once."""
+
+    def __init__(self, path, index=True):
+        self.path = Path(path)
+        self.index = index
+        self.rows = 0
+
+    def __enter__(self):
+        self.header = True
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def write(self, df: pd.DataFrame):
+        df.to_csv(self.path, mode='w' if self.header else 'a',
+                  header=self.header, index=self.index)
+        self.header = False
+        self.rows += len(df)
+
+
+class ChunkedJsonWriter:
+    """Stream DataFrame chunks into one JSON array (orient='records'), as mongoimport --jsonArray expects."""
+
+    def __init__(self, path, batch_rows=BATCH_ROWS, **to_json_kwargs):
+        self.path = Path(path)
+        self.batch_rows = batch_rows
+        self.to_json_kwargs = dict(orient='records', date_format='iso', **to_json_kwargs)
+        self.rows = 0
+
+    def __enter__(self):
+        self.file = open(self.path, 'w', encoding='utf-8')
+        self.file.write('[')
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.file.write(']')
+        self.file.close()
+
+    def write(self, df: pd.DataFrame):
+        for start in range(0, len(df), self.batch_rows):
+            batch = df.iloc[start:start + self.batch_rows]
+            if self.rows:
+                self.file.write(',')
+            self.file.write(batch.to_json(**self.to_json_kwargs)[1:-1])
+            self.rows += len(batch)
+
+
+class NdjsonShardWriter:
+    """Stream DataFrame chunks as newline-delimited JSON into size-capped shards.
+
+    Shards are written to `directory/part-00000.ndjson[.gz]`, ... Each holds at
+    most `max_bytes` of uncompressed JSON (to_json escapes non-ASCII, so
+    characters are bytes), unless a single document is larger than that."""
+
+    def __init__(self, directory, max_bytes, compress=False, batch_rows=BATCH_ROWS, **to_json_kwargs):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.batch_rows = batch_rows
+        self.to_json_kwargs = dict(orient='records', lines=True, date_format='iso', **to_json_kwargs)
+        self.rows = 0
+        self.shards = []
+
+    def __enter__(self):
+        self.directory.mkdir(exist_ok=True, parents=True)
+        for old in self.directory.glob('part-*.ndjson*'):
+            old.unlink()
+        self.file = None
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._close()
+
+    def _open(self):
+        path = self.directory / f"part-{len(self.shards):05d}.ndjson{'.gz' if self.compress else ''}"
+        self.file = gzip.open(path, 'wt', encoding='utf-8', compresslevel=6) if self.compress \
+            else open(path, 'w', encoding='utf-8')
+        self.shards.append(path)
+        self.shard_bytes = 0
+
+    def _close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _write_text(self, text: str):
+        while text:
+            if self.file is None:
+                self._open()
+            room = self.max_bytes - self.shard_bytes
+            if len(text) <= room:
+                self.file.write(text)
+                self.shard_bytes += len(text)
+                return
+            # Cut at the last full line that still fits.
+            cut = text.rfind('\n', 0, room) + 1
+            if not cut and not self.shard_bytes:
+                cut = text.find('\n') + 1 or len(text)
+            self.file.write(text[:cut])
+            self.shard_bytes += cut
+            text = text[cut:]
+            self._close()
+
+    def write(self, df: pd.DataFrame):
+        for start in range(0, len(df), self.batch_rows):
+            batch = df.iloc[start:start + self.batch_rows]
+            self._write_text(batch.to_json(**self.to_json_kwargs))
+            self.rows += len(batch)
+
+
+class CsvPartWriter:
+    """Write DataFrame chunks as a header file and one gzip-compressed CSV part per chunk, for neo4j-admin."""
+
+    def __init__(self, output: 'Neo4jOutput', file: str):
+        self.output = output
+        self.file = file
+        self.rows = 0
+        self.parts = 0
+
+    def __enter__(self):
+        self.output.clear(self.file)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def write(self, df: pd.DataFrame):
+        if self.parts and not len(df):
+            return
+        self.output.write_part(df, self.file, self.parts, header=not self.parts)
+        self.parts += 1
+        self.rows += len(df)
+
+
+@dataclass
+class PsqlOutput:
+    """How the PSQL tables are written.
+
+    By default, one `<table>.csv` per table in `directory`, for load_data_psql.sql.
+    With `dsn` (psycopg2 connection parameters), the frames are loaded straight into
+    PostgreSQL with binary COPY (psql_copy.py) and no CSV file is written."""
+    directory: Path = PSQL_CLEANED_PATH
+    dsn: Optional[Dict[str, str]] = None
+
+    def target(self, file: str) -> Union[Path, str]:
+        """The CSV file, or the table it is loaded into."""
+        if self.dsn is not None:
+            return psql_copy.table_for(file).qualified
+        return self.directory / file
+
+    def write(self, df: pd.DataFrame, file: str, index: bool = True, columns=None) -> Union[Path, str]:
+        """Write `df` as to_csv(index=index, columns=columns) would."""
+        if self.dsn is not None:
+            return psql_copy.copy_table(self.dsn, file, df, index, columns)
+        df.to_csv(self.directory / file, index=index, columns=columns)
+        return self.directory / file
+
+    def writer(self, file: str, index: bool = True):
+        if self.dsn is not None:
+            return psql_copy.CopyWriter(self.dsn, file, index)
+        return ChunkedCsvWriter(self.directory / file, index)
+
+
+psql_output = PsqlOutput()
+
+
+@dataclass
+class MongoOutput:
+    """How MongoDB collections are written.
+
+    'json' writes one `<collection>.json` array per collection (mongoimport --jsonArray);
+    'ndjson' writes `<collection>/part-*.ndjson[.gz]` shards of at most `shard_bytes`."""
+    format: str = 'json'
+    shard_bytes: int = 256 * 1024**2
+    compress: bool = False
+    directory: Path = MONGO_CLEANED_PATH
+
+    def path(self, collection: str) -> Path:
+        if self.format == 'ndjson':
+            return self.directory / collection
+        return self.directory / f'{collection}.json'
+
+    def writer(self, collection: str, **to_json_kwargs):
+        if self.format == 'ndjson':
+            return NdjsonShardWriter(self.path(collection), self.shard_bytes, self.compress, **to_json_kwargs)
+        return ChunkedJsonWriter(self.path(collection), **to_json_kwargs)
+
+
+mongo_output = MongoOutput()
+
+
+@dataclass
+class Neo4jOutput:
+    """How the Neo4j import files of the large node and relationship tables are written.
+
+    'csv' writes one `<name>.csv` with its header. 'parts' writes the header to
+    `<name>.header.csv` and the rows, without header, to gzip-compressed
+    `<name>.part-00000.csv.gz`, ...: `parts` parts per table (written in parallel
+    by the emitter), or one per chunk when streaming. neo4j-admin reads the parts
+    of a table in parallel."""
+    format: str = 'csv'
+    parts: int = 4
+    directory: Path = NEO4J_CLEANED_PATH
+
+    def path(self, file: str) -> Path:
+        """The CSV file, or the header file in the 'parts' format."""
+        if self.format == 'parts':
+            return self.directory / f'{Path(file).stem}.header.csv'
+        return self.directory / file
+
+    def part_path(self, file: str, part: int) -> Path:
+        return self.directory / f'{Path(file).stem}.part-{part:05d}.csv.gz'
+
+    def files(self, file: str) -> List[Path]:
+        """The files of `file` on disk, in the order neo4j-admin expects them (header first)."""
+        stem = Path(file).stem
+        if (self.directory / f'{stem}.header.csv').exists():
+            return [self.directory / f'{stem}.header.csv', *sorted(self.directory.glob(f'{stem}.part-*.csv.gz'))]
+        return [self.directory / file] if (self.directory / file).exists() else []
+
+    def clear(self, file: str):
+        """Remove the files of `file` in either format, so no stale part is imported."""
+        stem = Path(file).stem
+        for path in [self.directory / file, self.directory / f'{stem}.header.csv',
+                     *self.directory.glob(f'{stem}.part-*.csv.gz')]:
+            path.unlink(missing_ok=True)
+
+    def write(self, df: pd.DataFrame, file: str, part: int = 0) -> Path:
+        """Write `df` (already cleared with `clear`), or only its share of rows `part` of `parts`."""
+        if self.format != 'parts':
+            df.to_csv(self.path(file), index=False)
+            return self.path(file)
+        rows = slice(len(df) * part // self.parts, len(df) * (part + 1) // self.parts)
+        return self.write_part(df.iloc[rows], file, part, header=part == 0)
+
+    def write_part(self, df: pd.DataFrame, file: str, part: int, header: bool) -> Path:
+        if header:
+            df.iloc[:0].to_csv(self.path(file), index=False)
+        df.to_csv(self.part_path(file, part), index=False, header=False,
+                  compression={'method': 'gzip', 'compresslevel': 6})
+        return self.part_path(file, part)
+
+    def writer(self, file: str):
+        if self.format == 'parts':
+            return CsvPartWriter(self, file)
+        return ChunkedCsvWriter(self.path(file), index=False)
+
+
+neo4j_output = Neo4jOutput()
+
+
+@dataclass
+class OutputDirs:
+    """Where the streaming writers put the PSQL, MongoDB and Neo4j files (by default, the output/ tree)."""
+    psql: PsqlOutput = field(default_factory=lambda: psql_output)
+    neo4j: Neo4jOutput = field(default_factory=lambda: neo4j_output)
+    mongo: MongoOutput = field(default_factory=lambda: mongo_output)
+
+    def make(self):
+        for path in (self.psql.directory, self.neo4j.directory, self.mongo.directory):
+            path.mkdir(exist_ok=True, parents=True)